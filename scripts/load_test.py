@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""HTTP API 压测 - 并发发送请求，报告各端点的 p50/p95/p99 延迟和吞吐
+
+不指定 --url 时在进程内启动服务（替身模型 + 内存对话记忆），不调用Claude：
+    python scripts/load_test.py --requests 300 --concurrency 30 --stub-latency 0.3
+也可以压测已启动的服务：
+    python scripts/load_test.py --url http://127.0.0.1:8080
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import sys
+import os
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import aiohttp
+
+QUESTIONS = [
+    '现在有什么折扣',
+    '有哪些游戏在打折',
+    '推荐几个适合多人派对的游戏',
+    '马力欧有哪些游戏',
+    '塞尔达传说',
+    '有没有便宜的角色扮演游戏',
+]
+
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_request(endpoint, sessions):
+    """返回 (标签, method, path, json)"""
+    if endpoint == 'mixed':
+        endpoint = random.choice(['ask', 'ask', 'deals', 'search'])
+    if endpoint == 'ask':
+        return 'ask', 'POST', '/ask', {'question': random.choice(QUESTIONS),
+                                       'session_id': f"load-{random.randrange(sessions)}"}
+    if endpoint == 'deals':
+        return 'deals', 'GET', f"/deals?limit=30&min_discount={random.choice([0, 30, 50])}", None
+    return 'search', 'GET', '/games/search?q=' + random.choice(['马力欧', '薩爾達', 'Pokemon', 'Splatoon']), None
+
+
+async def run_load(base_url, total, concurrency, endpoint, sessions):
+    latencies = defaultdict(list)
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(make_request(endpoint, sessions))
+
+    async def worker(session):
+        while True:
+            try:
+                label, method, path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            try:
+                async with session.request(method, base_url + path, json=body) as resp:
+                    await resp.read()
+                    status = resp.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = 'conn_error'
+            elapsed = (time.perf_counter() - t0) * 1000
+            statuses[(label, status)] += 1
+            if status == 200:
+                latencies[label].append(elapsed)
+
+    timeout = aiohttp.ClientTimeout(total=120)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    t0 = time.perf_counter()
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    return latencies, statuses, wall
+
+
+def report(latencies, statuses, wall, total):
+    print(f"\n请求数: {total}, 总耗时: {wall:.1f}s, 吞吐: {total / wall:.1f} req/s")
+    print(f"{'端点':<8}{'成功':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label in sorted(latencies):
+        values = sorted(latencies[label])
+        print(f"{label:<8}{len(values):>6}{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}"
+              f"{percentile(values, 99):>10.1f}{values[-1]:>10.1f}")
+    errors = {k: v for k, v in statuses.items() if k[1] != 200}
+    if errors:
+        print("非200响应: " + ", ".join(f"{label} {status}×{n}" for (label, status), n in sorted(errors.items(), key=str)))
+
+
+async def main_async(args):
+    runner = None
+    base_url = args.url
+    if not base_url:
+        from aiohttp import web
+        from src.agent.stub_llm import StubChatModel
+        from src.server import create_app
+
+        app = create_app(llm=StubChatModel(latency=args.stub_latency), memory_path='',
+                         max_concurrent=args.max_concurrent, max_pending=args.max_pending)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = _free_port()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        base_url = f"http://127.0.0.1:{port}"
+        print(f"进程内服务: {base_url}（替身模型延迟 {args.stub_latency}s, "
+              f"Agent并发 {args.max_concurrent}, 排队上限 {args.max_pending}）")
+
+    try:
+        latencies, statuses, wall = await run_load(base_url.rstrip('/'), args.requests, args.concurrency,
+                                                   args.endpoint, args.sessions)
+        report(latencies, statuses, wall, args.requests)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+
+
+def main():
+    from src.config import API_MAX_CONCURRENT_ASKS, API_MAX_PENDING_ASKS
+
+    parser = argparse.ArgumentParser(description='HTTP API 压测')
+    parser.add_argument('--url', default=None, help='已启动服务的地址；不指定则进程内启动替身模型服务')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20, help='并发客户端数')
+    parser.add_argument('--endpoint', choices=['ask', 'deals', 'search', 'mixed'], default='mixed')
+    parser.add_argument('--sessions', type=int, default=50, help='ask请求使用的不同session数')
+    parser.add_argument('--stub-latency', type=float, default=0.2, help='替身模型每次调用的模拟延迟（秒）')
+    parser.add_argument('--max-concurrent', type=int, default=API_MAX_CONCURRENT_ASKS)
+    parser.add_argument('--max-pending', type=int, default=API_MAX_PENDING_ASKS)
+    args = parser.parse_args()
+
+    random.seed(0)
+    asyncio.run(main_async(args))
+
+
+if __name__ == '__main__':
+    main()
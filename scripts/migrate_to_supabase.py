@@ -78,6 +78,10 @@ def migrate():
     pg_conn.commit()
     print(f"Price history: {prices_migrated} 条迁移")
 
+    # 直接写入的 price_history 不经过 insert_price，重建当前价格表
+    from src.database import rebuild_current_prices
+    rebuild_current_prices()
+
     # 迁移 price_alerts 表（如有数据）
     alerts = sqlite_conn.execute("SELECT * FROM price_alerts ORDER BY id").fetchall()
     alerts_migrated = 0
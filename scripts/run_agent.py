@@ -12,6 +12,15 @@ def main():
     parser = argparse.ArgumentParser(description='HK eShop 折扣助手')
     parser.add_argument('--debug', action='store_true',
                         help='开启 LangChain 全局 debug（打印完整 LLM 请求/响应）')
+    parser.add_argument('--thread', default='default',
+                        help='对话ID：对话记忆按ID持久化，换一个ID即开始新对话')
+    parser.add_argument('--no-fast-path', action='store_true',
+                        help='所有问题都交给LLM Agent（关闭常见问题的直接查库回答）')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式输出：工具调用和回答token到达即打印，并报告首token时间')
+    parser.add_argument('--trace', default=None, metavar='PATH',
+                        help='把每轮的模型/工具/数据库span写入JSONL文件（用 trace_report.py 汇总）')
+    parser.add_argument('--otel', action='store_true', help='把span导出为OpenTelemetry')
     args = parser.parse_args()
 
     # 检查 API key
@@ -21,9 +30,14 @@ def main():
         sys.exit(1)
 
     from src.database import init_db
-    from src.agent.agent import create_agent, ask
+    from src.agent.agent import create_agent, ask, close_agent
+    from src.agent.cache import format_tool_cache_stats
+    from src.agent.router import format_router_stats
 
     init_db()
+    if args.trace or args.otel:
+        from src.tracing import configure_tracing
+        configure_tracing('otel' if args.otel else 'jsonl', args.trace)
     agent = create_agent(debug=args.debug)
 
     print("HK eShop 折扣助手（输入 quit 退出）")
@@ -43,11 +57,17 @@ def main():
             break
 
         try:
-            response = ask(agent, user_input)
-            print(f"\n{response}")
+            response = ask(agent, user_input, thread_id=args.thread, stream=args.stream,
+                           fast_path=not args.no_fast_path)
+            if not args.stream:
+                print(f"\n{response}")
         except Exception as e:
             print(f"\n出错了: {e}")
 
+    close_agent()
+    print(format_router_stats())
+    print(format_tool_cache_stats())
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Agent基准测试 - 回放模型 + 合成数据库，报告每个问题的工具调用数、SQL语句数和去掉模型时间后的耗时
+
+不调用Claude，结果确定，可用来比较不同提交的工具调用/查询次数：
+    python scripts/run_agent_benchmark.py --json bench.json
+    python scripts/run_agent_benchmark.py --compare bench.json
+用真实模型录制问题集的工具调用计划（需要ANTHROPIC_API_KEY），之后用 --scenario 回放：
+    python scripts/run_agent_benchmark.py --record plans.json
+"""
+
+import argparse
+import json
+import sys
+import os
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.agent.agent import close_agent, create_agent
+from src.agent.benchmark import (
+    DEFAULT_SCENARIO, ModelTimer, build_synthetic_db, compare, load_scenario, record_plans, run_benchmark,
+    scenario_plans, summarize,
+)
+from src.agent.stub_llm import ReplayChatModel
+
+
+def report(results, summary):
+    print(f"\n{'问题':<28}{'工具':>5}{'模型':>5}{'SQL':>6}{'端到端ms':>10}{'模型ms':>9}{'非模型ms':>10}{'工具ms':>9}")
+    for r in results:
+        question = r['question'] if len(r['question']) <= 24 else r['question'][:23] + '…'
+        print(f"{question:<28}{r['tool_calls']:>5}{r['model_calls']:>5}{r['db_queries']:>6}"
+              f"{r['e2e_ms']:>10.1f}{r['model_ms']:>9.1f}{r['non_model_ms']:>10.1f}{r['tool_ms']:>9.1f}")
+        if r['tools']:
+            print(f"    工具: {', '.join(r['tools'])}")
+        for problem in r['violations']:
+            print(f"    ⚠ {problem}")
+        if r['tool_errors']:
+            print(f"    ❌ {r['tool_errors']} 个工具调用出错")
+    print(f"\n{summary['questions']} 个问题: 工具调用 {summary['tool_calls']} 次, SQL {summary['db_queries']} 条, "
+          f"非模型耗时 中位数 {summary['non_model_ms_median']}ms / 合计 {summary['non_model_ms_total']}ms, "
+          f"规则违规 {summary['violations']} 处, 工具出错 {summary['tool_errors']} 次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Agent基准测试（回放模型 + 合成数据库）')
+    parser.add_argument('--scenario', default=None, help='问题集JSON（默认使用内置问题集）')
+    parser.add_argument('--db', default=None, help='合成数据库路径（默认临时文件，已存在的文件会被覆盖）')
+    parser.add_argument('--games', type=int, default=500, help='合成数据库的游戏数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数（耗时取中位数）')
+    parser.add_argument('--warm-cache', action='store_true', help='不在每个问题前清空工具缓存')
+    parser.add_argument('--fast-path', action='store_true', help='启用快速路径（router命中的问题不经过Agent）')
+    parser.add_argument('--json', default=None, help='把结果写入JSON文件，供之后 --compare')
+    parser.add_argument('--compare', default=None, help='与之前 --json 保存的结果对比工具调用数和SQL语句数')
+    parser.add_argument('--record', default=None, help='用Claude跑问题集并把工具调用计划录制到该文件')
+    args = parser.parse_args()
+
+    scenario = load_scenario(args.scenario) if args.scenario else DEFAULT_SCENARIO
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, 'bench.db')
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        n = build_synthetic_db(db_path, n_games=args.games, seed=args.seed)
+        print(f"合成数据库: {db_path}（{n} 个游戏）, {len(scenario)} 个问题")
+
+        try:
+            if args.record:
+                agent = create_agent(memory_path='')
+                recorded = record_plans(agent, scenario, fast_path=args.fast_path)
+                with open(args.record, 'w', encoding='utf-8') as f:
+                    json.dump(recorded, f, ensure_ascii=False, indent=2)
+                print(f"已录制 {len(recorded)} 个问题的计划到 {args.record}")
+                return
+
+            timer = ModelTimer()
+            agent = create_agent(memory_path='', llm=ReplayChatModel(plans=scenario_plans(scenario),
+                                                                     callbacks=[timer]))
+            results = run_benchmark(agent, timer, scenario, repeat=args.repeat,
+                                    cold_cache=not args.warm_cache, fast_path=args.fast_path)
+        finally:
+            close_agent()
+
+    summary = summarize(results)
+    report(results, summary)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'])
+        if regressions:
+            print("\n相比基线增加：")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n与基线相比工具调用数和SQL语句数没有增加")
+
+
+if __name__ == '__main__':
+    main()
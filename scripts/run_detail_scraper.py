@@ -7,24 +7,38 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.browser import create_browser, close_browser
-from src.database import init_db, get_games_without_details
+from src.config import DETAIL_REFRESH_BUDGET
+from src.database import init_db, get_games_without_details, bump_data_version
 from src.detail_scraper import scrape_all_details
+from src.refresh_scheduler import plan_detail_refresh
 
 
 def main():
     parser = argparse.ArgumentParser(description="爬取游戏详情页")
     parser.add_argument("--limit", type=int, default=0, help="限制爬取数量（0=全部）")
+    parser.add_argument("--refresh", action="store_true",
+                        help="刷新模式：新游戏优先，剩余预算按过期程度/折扣/热度刷新已有详情")
+    parser.add_argument("--budget", type=int, default=DETAIL_REFRESH_BUDGET,
+                        help=f"刷新模式下每次运行的页面预算（默认{DETAIL_REFRESH_BUDGET}）")
     args = parser.parse_args()
 
     init_db()
 
-    games = get_games_without_details()
-    if not games:
-        print("所有游戏详情页已爬取完成，无需重跑。")
-        return
-
-    if args.limit > 0:
-        games = games[:args.limit]
+    if args.refresh:
+        games, plan = plan_detail_refresh(budget=args.budget)
+        if not games:
+            print("没有需要爬取或刷新的详情页。")
+            return
+        print(f"刷新计划: 新游戏 {plan['new']} 个, 刷新 {plan['refresh']} 个"
+              f"（候选 {plan['candidates']} 个, 预算 {args.budget}）")
+    else:
+        games = get_games_without_details()
+        if not games:
+            print("所有游戏详情页已爬取完成，无需重跑。")
+            return
+
+        if args.limit > 0:
+            games = games[:args.limit]
 
     print(f"待爬取: {len(games)} 个游戏详情页")
     print()
@@ -32,9 +46,11 @@ def main():
     browser, page = create_browser(headless=True)
 
     try:
-        success, failed = scrape_all_details(page, games)
+        success, failed, unchanged = scrape_all_details(page, games)
         print()
-        print(f"完成: {success} 成功, {failed} 失败, 共 {len(games)} 个")
+        print(f"完成: {success} 写入, {unchanged} 未变化, {failed} 失败, 共 {len(games)} 个")
+        if success:
+            bump_data_version()
     finally:
         close_browser()
 
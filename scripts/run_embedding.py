@@ -1,29 +1,46 @@
 """Embedding生成入口脚本：构建search_text + 生成embedding向量"""
 
+import argparse
 import sys
 import os
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.database import init_db
-from src.embedding import batch_build_search_text, batch_generate_embeddings
+from src.config import EMBEDDING_CONCURRENCY, EMBEDDING_QUANTIZATION
+from src.database import init_db, backfill_quantized_embeddings
+from src.embedding import batch_build_search_text, batch_generate_embeddings, get_backend
 
 
 def main():
-    if not os.environ.get('OPENAI_API_KEY'):
-        print("错误: 请设置 OPENAI_API_KEY 环境变量")
+    parser = argparse.ArgumentParser(description="构建search_text并生成embedding")
+    parser.add_argument("--concurrency", type=int, default=EMBEDDING_CONCURRENCY,
+                        help=f"同时在途的embedding请求数（默认{EMBEDDING_CONCURRENCY}）")
+    parser.add_argument("--base-url", default=None,
+                        help="embedding API地址（如本地替身服务 http://127.0.0.1:8765/v1）")
+    parser.add_argument("--rebuild-search-text", action="store_true",
+                        help="重新计算全部search_text，只写回内容变化的行")
+    args = parser.parse_args()
+
+    if not get_backend().available():
+        print("错误: 请设置 OPENAI_API_KEY 环境变量（或设置 EMBEDDING_BACKEND=local 使用本地embedding）")
         sys.exit(1)
 
     init_db()
 
     # Step 1: 构建search_text
     print("=== Step 1: 构建search_text ===")
-    st_count = batch_build_search_text()
+    st_count = batch_build_search_text(rebuild=args.rebuild_search_text)
 
     # Step 2: 生成embedding
     print()
     print("=== Step 2: 生成embedding ===")
-    emb_count = batch_generate_embeddings()
+    emb_count = batch_generate_embeddings(concurrency=args.concurrency, base_url=args.base_url)
+
+    # Step 3: 补齐低精度向量（开启两阶段搜索时）
+    if EMBEDDING_QUANTIZATION != 'none':
+        print()
+        print(f"=== Step 3: 补齐 {EMBEDDING_QUANTIZATION} 向量 ===")
+        print(f"补齐: {backfill_quantized_embeddings()} 个")
 
     print()
     print(f"总结: search_text {st_count} 个, embedding {emb_count} 个")
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""重建筛选维度 - 从 game_details 的语言/人数/类型文本重新解析 language_mask、min/max_players、类型字典和 game_genres
+
+新爬取的详情写入时会自动解析；解析规则变化或补齐已有数据时运行一次。
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.database import bump_data_version, init_db, rebuild_facets
+
+
+def main():
+    init_db()
+    count = rebuild_facets()
+    bump_data_version()
+    print(f"完成: 重建了 {count} 个游戏的筛选维度")
+
+
+if __name__ == "__main__":
+    main()
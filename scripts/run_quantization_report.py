@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""向量量化评估：各低精度表示节省的存储 vs 两阶段搜索损失的召回率
+
+从数据库读出全部完整向量，在本地用NumPy模拟：
+- float32（基准）/ halfvec(float16) / int8（逐维对称量化）/ binary（符号位）
+- 可选截断到前N维（text-embedding-3 系列支持Matryoshka截断）
+- 第一阶段用低精度表示取 k*oversample 个候选，第二阶段用完整向量精排，
+  对比精确搜索的 top-k 计算 recall@k
+"""
+
+import argparse
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+
+from src.config import EMBEDDING_RERANK_OVERSAMPLE
+from src.database import init_db, get_all_embeddings
+from src.embedding import get_backend
+
+
+def _normalize(m):
+    return m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+
+
+def encode(full, mode, dims):
+    """返回 (第一阶段打分函数, 每个向量的字节数)"""
+    x = full[:, :dims]
+    if mode == 'float32':
+        xs = _normalize(x)
+        return (lambda q: xs @ _normalize(q[None, :dims])[0]), dims * 4
+    if mode == 'halfvec':
+        xh = _normalize(x).astype(np.float16)
+        return (lambda q: xh.astype(np.float32) @ _normalize(q[None, :dims])[0]), dims * 2
+    if mode == 'int8':
+        scale = np.abs(x).max(axis=0) / 127
+        scale[scale == 0] = 1
+        xi = np.round(x / scale).astype(np.int8)
+        xd = _normalize(xi.astype(np.float32) * scale)
+        return (lambda q: xd @ _normalize(q[None, :dims])[0]), dims + 4 * dims / len(full)
+    if mode == 'binary':
+        xb = np.packbits(x > 0, axis=1)
+
+        def score(q):
+            qb = np.packbits(q[None, :dims] > 0, axis=1)
+            return -np.unpackbits(np.bitwise_xor(xb, qb), axis=1).sum(axis=1).astype(np.float32)
+        return score, dims / 8
+    raise ValueError(mode)
+
+
+def evaluate(full, mode, dims, k, oversample, queries):
+    exact = _normalize(full)
+    score, nbytes = encode(full, mode, dims)
+    recall_first = recall_rerank = 0.0
+
+    for qi in queries:
+        q = full[qi]
+        truth = np.argsort(-(exact @ exact[qi]))
+        truth = set(truth[truth != qi][:k])
+
+        first = score(q)
+        first[qi] = -np.inf
+        shortlist = np.argsort(-first)[:k * oversample]
+        recall_first += len(truth & set(shortlist[:k])) / k
+
+        reranked = shortlist[np.argsort(-(exact[shortlist] @ exact[qi]))][:k]
+        recall_rerank += len(truth & set(reranked)) / k
+
+    n = len(queries)
+    return nbytes, recall_first / n, recall_rerank / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description='向量量化：存储节省 vs 召回损失')
+    parser.add_argument('--k', type=int, default=10, help='recall@k')
+    parser.add_argument('--oversample', type=int, default=EMBEDDING_RERANK_OVERSAMPLE,
+                        help='第一阶段候选数 = k * oversample')
+    parser.add_argument('--queries', type=int, default=200, help='随机抽取多少个游戏向量作为查询')
+    parser.add_argument('--dims', type=int, nargs='*', default=[1536, 768, 512, 256],
+                        help='评估的截断维度')
+    args = parser.parse_args()
+
+    init_db()
+    model = get_backend().name
+    rows = get_all_embeddings(model)
+    if len(rows) <= args.k:
+        print(f"向量太少（{len(rows)} 个），无法评估")
+        sys.exit(1)
+
+    full = np.array([e for _, e in rows], dtype=np.float32)
+    rng = np.random.default_rng(0)
+    queries = rng.choice(len(full), size=min(args.queries, len(full)), replace=False)
+    base_bytes = full.shape[1] * 4
+
+    print(f"模型: {model}, 向量数: {len(full)}, 维度: {full.shape[1]}, 查询数: {len(queries)}")
+    print(f"{'表示':<10}{'维度':>6}{'字节/向量':>10}{'总计KB':>10}{'节省':>8}"
+          f"{'recall@' + str(args.k):>12}{'精排后':>10}")
+    for dims in args.dims:
+        if dims > full.shape[1]:
+            continue
+        for mode in ('float32', 'halfvec', 'int8', 'binary'):
+            nbytes, r_first, r_rerank = evaluate(full, mode, dims, args.k, args.oversample, queries)
+            print(f"{mode:<10}{dims:>6}{nbytes:>10.0f}{nbytes * len(full) / 1024:>10.0f}"
+                  f"{1 - nbytes / base_bytes:>8.1%}{r_first:>12.3f}{r_rerank:>10.3f}")
+
+    print("\nint8 仅在本地评估（pgvector没有int8向量类型）；数据库两阶段搜索支持 halfvec / binary，"
+          "用 EMBEDDING_QUANTIZATION / EMBEDDING_SEARCH_DIMS 开启。")
+
+
+if __name__ == '__main__':
+    main()
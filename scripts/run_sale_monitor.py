@@ -1,18 +1,24 @@
 #!/usr/bin/env python3
-"""HK eShop 减价页监控 - 每6小时检查折扣变化"""
+"""HK eShop 减价页监控 - 每6小时全量检查减价页，另有按折扣窗口定向复查的模式"""
 
+import argparse
+import random
 import sys
 import os
+import time
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from src.config import BASE_URL
+from src.config import BASE_URL, SALE_TARGETED_MAX_PAGES, MIN_DELAY, MAX_DELAY
 from src.database import (
-    init_db, upsert_game, insert_price, save_alerts,
+    init_db, upsert_game, insert_price, save_alerts, insert_game_details,
+    get_discounted_games_missing, record_sales_ended, clear_listing_hash, mark_prices_checked, bump_data_version,
 )
 from src.browser import create_browser, close_browser
 from src.scraper import scrape_all_pages
-from src.price_tracker import detect_changes
+from src.detail_scraper import scrape_detail_page, scrape_detail_price
+from src.price_tracker import detect_changes, detect_disappeared
+from src.sale_scheduler import plan_sale_recheck
 
 SALE_URL_TEMPLATE = BASE_URL + "/download-code/sale?product_list_limit=48&p={page}"
 
@@ -26,47 +32,137 @@ def parse_price(value):
         return None
 
 
-def main():
-    init_db()
+def new_stats():
+    return {'total': 0, 'new_sale': 0, 'sale_ended': 0,
+            'price_drop': 0, 'price_increase': 0, 'changed': 0, 'unchanged': 0}
 
-    print("启动浏览器...")
-    browser, page = create_browser(headless=True)
 
-    try:
-        print("正在爬取减价页（所有页面）...")
-        items = scrape_all_pages(page, url_template=SALE_URL_TEMPLATE)
+def count_alerts(stats, alerts):
+    for a in alerts:
+        t = a['alert_type']
+        if t in stats:
+            stats[t] += 1
+
 
-        if len(items) == 0:
-            print("❌ 减价页无商品，可能加载失败")
-            sys.exit(1)
+def print_summary(stats, label):
+    price_changes = stats['new_sale'] + stats['sale_ended'] + stats['price_drop'] + stats['price_increase']
+    print(f"\n减价页监控完成")
+    print(f"{label}: {stats['total']}")
+    if stats['changed'] or stats['unchanged']:
+        print(f"列表项: {stats['changed']} 个变化, {stats['unchanged']} 个未变化（跳过写入）")
+    print(f"价格变动: {price_changes} ({stats['new_sale']}个新折扣, {stats['sale_ended']}个折扣结束, {stats['price_drop'] + stats['price_increase']}个价格变动)")
 
-        stats = {'total': 0, 'new_sale': 0, 'sale_ended': 0,
-                 'price_drop': 0, 'price_increase': 0}
 
-        for game in items:
-            current_price = parse_price(game.get('finalPrice'))
-            original_price = parse_price(game.get('oldPrice'))
+def run_full(page):
+    """全量爬取减价页所有页面"""
+    print("正在爬取减价页（所有页面）...")
+    items, complete = scrape_all_pages(page, url_template=SALE_URL_TEMPLATE, return_complete=True)
 
-            if current_price is None:
-                continue
+    if len(items) == 0:
+        print("❌ 减价页无商品，可能加载失败")
+        sys.exit(1)
 
-            game_id = upsert_game(game)
+    stats = new_stats()
+    unchanged_ids = []
+
+    for game in items:
+        current_price = parse_price(game.get('finalPrice'))
+        original_price = parse_price(game.get('oldPrice'))
+
+        if current_price is None:
+            continue
+
+        game_id, changed = upsert_game(game, return_changed=True)
+        alerts = []
+        if changed:
             alerts = detect_changes(game_id, current_price, original_price)
             insert_price(game_id, current_price, original_price)
             save_alerts(alerts)
+        else:
+            unchanged_ids.append(game_id)
+
+        stats['total'] += 1
+        stats['changed' if changed else 'unchanged'] += 1
+        count_alerts(stats, alerts)
+
+    mark_prices_checked(unchanged_ids)
+
+    # 减价页上消失的打折游戏 → 折扣结束（只在完整爬完减价页时判断）
+    if complete:
+        missing = get_discounted_games_missing(items)
+        alerts = detect_disappeared(missing)
+        record_sales_ended(missing, alerts)
+        count_alerts(stats, alerts)
+        print(f"减价页消失的打折游戏: {len(missing)} 个")
+    else:
+        print("⚠️ 减价页未完整爬取，跳过折扣结束检测")
+
+    print_summary(stats, "折扣商品数")
+
+
+def run_targeted(page, due):
+    """只复查折扣窗口刚切换的游戏详情页（价格 + sale_start/sale_end）"""
+    stats = new_stats()
+    total = len(due)
+
+    for i, game in enumerate(due):
+        print(f"  [{i+1}/{total}] {game['name']} ({game['recheck_reason']}) ...", end=" ", flush=True)
+
+        details = scrape_detail_page(page, game['url'])
+        prices = scrape_detail_price(page) if details is not None else None
+        current_price = parse_price(prices.get('finalPrice')) if prices else None
+        original_price = parse_price(prices.get('oldPrice')) if prices else None
+
+        if current_price is None:
+            print("FAILED")
+        else:
+            alerts = detect_changes(game['id'], current_price, original_price)
+            insert_price(game['id'], current_price, original_price)
+            save_alerts(alerts)
+            # 价格来自详情页，列表指纹已过期：清空后下次全量扫描重新比对价格
+            clear_listing_hash([game['id']])
+            if details:
+                insert_game_details(game['id'], details)
 
             stats['total'] += 1
-            for a in alerts:
-                t = a['alert_type']
-                if t in stats:
-                    stats[t] += 1
+            count_alerts(stats, alerts)
+            print(f"HKD{current_price}")
+
+        if i < total - 1:
+            time.sleep(random.uniform(MIN_DELAY, MAX_DELAY))
 
-        # 打印摘要
-        price_changes = stats['new_sale'] + stats['sale_ended'] + stats['price_drop'] + stats['price_increase']
-        print(f"\n减价页监控完成")
-        print(f"折扣商品数: {stats['total']}")
-        print(f"价格变动: {price_changes} ({stats['new_sale']}个新折扣, {stats['sale_ended']}个折扣结束, {stats['price_drop'] + stats['price_increase']}个价格变动)")
+    print_summary(stats, "复查游戏数")
 
+
+def main():
+    parser = argparse.ArgumentParser(description='HK eShop 减价页监控')
+    parser.add_argument('--mode', choices=['full', 'targeted'], default='full',
+                        help='full=爬取整个减价页；targeted=只复查折扣开始/结束前后的游戏详情页')
+    args = parser.parse_args()
+
+    init_db()
+
+    due = None
+    if args.mode == 'targeted':
+        due, next_at = plan_sale_recheck()
+        next_info = f"，下一次折扣切换约在 {next_at:%Y-%m-%d %H:%M} UTC" if next_at else ""
+        if not due:
+            print(f"没有到期需要复查的游戏{next_info}。")
+            return
+        print(f"到期复查: {len(due)} 个游戏{next_info}")
+        if len(due) > SALE_TARGETED_MAX_PAGES:
+            print(f"复查数量超过 {SALE_TARGETED_MAX_PAGES}，改为全量扫描减价页")
+            due = None
+
+    print("启动浏览器...")
+    browser, page = create_browser(headless=True)
+
+    try:
+        if due is None:
+            run_full(page)
+        else:
+            run_targeted(page, due)
+        bump_data_version()
     finally:
         close_browser()
 
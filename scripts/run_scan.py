@@ -10,12 +10,13 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 from src.database import (
-    init_db, upsert_game, insert_price,
-    get_latest_price_by_eshop_id, save_alerts,
+    init_db, upsert_game, insert_price, mark_prices_checked,
+    get_latest_price_by_eshop_id, save_alerts, bump_data_version,
 )
 from src.browser import create_browser, close_browser
 from src.scraper import scrape_all_pages
 from src.price_tracker import detect_changes
+from src.spool import prepare_spool, sync_spool
 
 
 def parse_price(value):
@@ -36,11 +37,15 @@ def main():
                         help='有头模式运行（调试用）')
     parser.add_argument('--pages', type=int, default=None,
                         help='限制爬取页数（调试用）')
+    parser.add_argument('--spool', metavar='PATH', default=None,
+                        help='spool模式：扫描只写本地SQLite文件，结束后批量同步到PostgreSQL（需DATABASE_URL）')
     args = parser.parse_args()
 
     headless = not args.no_headless
 
-    # 1. 初始化数据库
+    # 1. 初始化数据库（spool模式下先从PG拉取基线，之后读写都走本地SQLite）
+    if args.spool:
+        prepare_spool(args.spool)
     init_db()
 
     # 2. 启动浏览器
@@ -58,7 +63,8 @@ def main():
 
         # 4. 处理每个游戏
         stats = {'total': 0, 'new': 0, 'new_sale': 0, 'sale_ended': 0,
-                 'price_drop': 0, 'price_increase': 0}
+                 'price_drop': 0, 'price_increase': 0, 'changed': 0, 'unchanged': 0}
+        unchanged_ids = []
 
         for game in all_games:
             current_price = parse_price(game.get('finalPrice'))
@@ -72,20 +78,21 @@ def main():
             eshop_id = match.group(1) if match else None
             is_new = (eshop_id and get_latest_price_by_eshop_id(eshop_id) is None)
 
-            # b. upsert游戏信息
-            game_id = upsert_game(game)
+            # b. upsert游戏信息（列表项指纹未变化时跳过写入）
+            game_id, changed = upsert_game(game, return_changed=True)
 
-            # c. 检测价格变动
-            alerts = detect_changes(game_id, current_price, original_price)
-
-            # d. 插入价格记录
-            insert_price(game_id, current_price, original_price)
-
-            # e. 保存alerts
-            save_alerts(alerts)
+            # c. 指纹未变化说明价格与上次相同：不比对、不写价格记录，扫描结束后统一记录检查时间
+            alerts = []
+            if changed:
+                alerts = detect_changes(game_id, current_price, original_price)
+                insert_price(game_id, current_price, original_price)
+                save_alerts(alerts)
+            else:
+                unchanged_ids.append(game_id)
 
             # 统计
             stats['total'] += 1
+            stats['changed' if changed else 'unchanged'] += 1
             if is_new:
                 stats['new'] += 1
             for a in alerts:
@@ -93,15 +100,24 @@ def main():
                 if t in stats:
                     stats[t] += 1
 
+        mark_prices_checked(unchanged_ids)
+
         # 5. 打印统计
         price_changes = stats['new_sale'] + stats['sale_ended'] + stats['price_drop'] + stats['price_increase']
         print(f"\n扫描完成")
         print(f"总游戏数: {stats['total']}")
         print(f"新增游戏: {stats['new']}")
+        print(f"列表项: {stats['changed']} 个变化, {stats['unchanged']} 个未变化（跳过写入）")
         print(f"价格变动: {price_changes} ({stats['new_sale']}个新折扣, {stats['sale_ended']}个折扣结束, {stats['price_drop'] + stats['price_increase']}个价格变动)")
 
+        # 6. spool模式：一次性同步到PG（同一事务内提升数据版本）；否则直接提升数据版本使查询缓存失效
+        if args.spool:
+            sync_spool(args.spool)
+        else:
+            bump_data_version()
+
     finally:
-        # 6. 关闭浏览器
+        # 7. 关闭浏览器
         close_browser()
 
 
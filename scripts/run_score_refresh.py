@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Metacritic评分批量预取 - 打折游戏优先，其次从未查过/已过期的，结果写入game_scores供Agent直接读取"""
+
+import argparse
+import sys
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.config import METACRITIC_BATCH_LIMIT, METACRITIC_PROVIDER
+from src.database import init_db
+from src.scores import get_score_provider, refresh_scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量预取Metacritic评分")
+    parser.add_argument("--limit", type=int, default=METACRITIC_BATCH_LIMIT,
+                        help=f"本次最多查询的游戏数（默认{METACRITIC_BATCH_LIMIT}）")
+    parser.add_argument("--provider", default=METACRITIC_PROVIDER, choices=['ddgs', 'local'],
+                        help="评分来源：ddgs=DuckDuckGo搜索，local=本地JSON替身")
+    args = parser.parse_args()
+
+    init_db()
+
+    provider = get_score_provider(args.provider)
+    print(f"评分来源: {provider.name}, 最多查询 {args.limit} 个游戏")
+    total, found, failed = refresh_scores(limit=args.limit, provider=provider)
+    print()
+    print(f"完成: 查询 {total} 个, {found} 个有评分, {failed} 个失败")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""HK eShop 折扣助手 HTTP API 服务"""
+
+import argparse
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.config import AGENT_MEMORY_PATH, API_MAX_CONCURRENT_ASKS, API_MAX_PENDING_ASKS, API_ASK_TIMEOUT
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HK eShop 折扣助手 HTTP API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--memory-path', default=AGENT_MEMORY_PATH,
+                        help='对话记忆SQLite文件（传空字符串则只存内存）')
+    parser.add_argument('--max-concurrent', type=int, default=API_MAX_CONCURRENT_ASKS,
+                        help=f'同时执行的Agent提问数（默认{API_MAX_CONCURRENT_ASKS}）')
+    parser.add_argument('--max-pending', type=int, default=API_MAX_PENDING_ASKS,
+                        help=f'排队提问数上限，超过返回503（默认{API_MAX_PENDING_ASKS}）')
+    parser.add_argument('--timeout', type=float, default=API_ASK_TIMEOUT,
+                        help=f'单次提问超时秒数（默认{API_ASK_TIMEOUT}）')
+    parser.add_argument('--stub-llm', action='store_true', help='使用替身模型（不调用Claude，用于压测）')
+    parser.add_argument('--stub-latency', type=float, default=0.2, help='替身模型每次调用的模拟延迟（秒）')
+    args = parser.parse_args()
+
+    if not args.stub_llm and not os.environ.get('ANTHROPIC_API_KEY'):
+        print("错误：请设置 ANTHROPIC_API_KEY 环境变量（或使用 --stub-llm）")
+        sys.exit(1)
+
+    from aiohttp import web
+    from src.agent.stub_llm import StubChatModel
+    from src.server import create_app
+
+    llm = StubChatModel(latency=args.stub_latency) if args.stub_llm else None
+    app = create_app(llm=llm, memory_path=args.memory_path, max_concurrent=args.max_concurrent,
+                     max_pending=args.max_pending, timeout=args.timeout)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
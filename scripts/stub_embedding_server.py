@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""本地embedding替身服务 - 兼容OpenAI /v1/embeddings 接口，用于测试embedding流水线
+
+返回由文本sha256决定的确定性向量，可模拟延迟和429限流：
+    python scripts/stub_embedding_server.py --port 8765 --latency 0.2 --rate-limit-every 5
+    OPENAI_API_KEY=stub python scripts/run_embedding.py --base-url http://127.0.0.1:8765/v1
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIMENSIONS = 1536
+
+
+def fake_embedding(text):
+    """由文本决定的单位长度伪向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big')
+    rng = random.Random(seed)
+    vec = [rng.gauss(0, 1) for _ in range(DIMENSIONS)]
+    norm = sum(x * x for x in vec) ** 0.5
+    return [x / norm for x in vec]
+
+
+def make_handler(latency, rate_limit_every):
+    counter = {'requests': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/embeddings'):
+                self._send(404, {'error': {'message': 'not found'}})
+                return
+
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            inputs = request.get('input', [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+
+            with lock:
+                counter['requests'] += 1
+                n = counter['requests']
+            if rate_limit_every and n % rate_limit_every == 0:
+                self._send(429, {'error': {'message': 'rate limited (stub)', 'type': 'rate_limit_error'}},
+                           headers={'Retry-After': '0.5'})
+                return
+
+            if latency:
+                time.sleep(latency)
+
+            tokens = sum(len(t) for t in inputs)
+            self._send(200, {
+                'object': 'list',
+                'data': [{'object': 'embedding', 'index': i, 'embedding': fake_embedding(t)}
+                         for i, t in enumerate(inputs)],
+                'model': request.get('model', 'stub'),
+                'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地embedding替身服务')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟延迟（秒）')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='每N个请求返回一次429（0=不模拟）')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), make_handler(args.latency, args.rate_limit_every))
+    print(f"stub embedding server: http://127.0.0.1:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
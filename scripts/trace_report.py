@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""追踪报告 - 汇总JSONL追踪文件：最慢的工具/数据库函数、模型调用的耗时和token、最慢和最贵的提问
+
+    AGENT_TRACE_PATH=data/agent_traces.jsonl python scripts/run_agent.py
+    python scripts/trace_report.py data/agent_traces.jsonl --top 10
+"""
+
+import argparse
+import sys
+import os
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.config import AGENT_TRACE_PATH
+from src.tracing import load_spans
+
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def _tokens(span):
+    attrs = span['attrs']
+    return (attrs.get('input_tokens') or 0) + (attrs.get('output_tokens') or 0)
+
+
+def summarize_turns(spans):
+    """每个trace（一轮提问）的汇总：耗时、模型/工具/数据库次数和耗时、token数"""
+    turns = {}
+    for s in spans:
+        if s['kind'] == 'turn':
+            turns[s['trace_id']] = {
+                'question': s['attrs'].get('question', ''), 'thread_id': s['attrs'].get('thread_id'),
+                'start': s['start'], 'duration_ms': s['duration_ms'] or 0.0,
+                'fast_path': s['attrs'].get('fast_path'), 'error': s['error'],
+                'model_calls': 0, 'model_ms': 0.0, 'tool_calls': 0, 'tool_ms': 0.0, 'db_calls': 0,
+                'input_tokens': 0, 'output_tokens': 0,
+            }
+    for s in spans:
+        turn = turns.get(s['trace_id'])
+        if turn is None:
+            continue
+        if s['kind'] == 'model':
+            turn['model_calls'] += 1
+            turn['model_ms'] += s['duration_ms'] or 0.0
+            turn['input_tokens'] += s['attrs'].get('input_tokens') or 0
+            turn['output_tokens'] += s['attrs'].get('output_tokens') or 0
+        elif s['kind'] == 'tool':
+            turn['tool_calls'] += 1
+            turn['tool_ms'] += s['duration_ms'] or 0.0
+        elif s['kind'] == 'db':
+            turn['db_calls'] += 1
+    return list(turns.values())
+
+
+def group_stats(spans, kind):
+    """按名称汇总某类span：次数、出错数、平均/p95/最大耗时，按总耗时降序"""
+    groups = defaultdict(list)
+    errors = defaultdict(int)
+    for s in spans:
+        if s['kind'] == kind and s['duration_ms'] is not None:
+            groups[s['name']].append(s['duration_ms'])
+            if s['error']:
+                errors[s['name']] += 1
+    rows = []
+    for name, values in groups.items():
+        values.sort()
+        rows.append({'name': name, 'count': len(values), 'errors': errors[name], 'total_ms': sum(values),
+                     'avg_ms': sum(values) / len(values), 'p95_ms': percentile(values, 95), 'max_ms': values[-1]})
+    return sorted(rows, key=lambda r: r['total_ms'], reverse=True)
+
+
+def print_group(title, rows, top):
+    if not rows:
+        return
+    print(f"\n{title}")
+    print(f"  {'名称':<26}{'次数':>6}{'出错':>6}{'平均ms':>10}{'p95 ms':>10}{'最大ms':>10}{'合计ms':>11}")
+    for r in rows[:top]:
+        print(f"  {r['name']:<26}{r['count']:>6}{r['errors']:>6}{r['avg_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['max_ms']:>10.1f}{r['total_ms']:>11.1f}")
+
+
+def print_turns(title, turns):
+    if not turns:
+        return
+    print(f"\n{title}")
+    for t in turns:
+        question = t['question'] if len(t['question']) <= 30 else t['question'][:29] + '…'
+        route = f"快速路径:{t['fast_path']}" if t['fast_path'] else (
+            f"模型 {t['model_calls']}次/{t['model_ms']:.0f}ms, 工具 {t['tool_calls']}次/{t['tool_ms']:.0f}ms, "
+            f"DB {t['db_calls']}次")
+        print(f"  {t['duration_ms']:>8.0f}ms  {t['input_tokens']:>6}+{t['output_tokens']:<5} tokens  "
+              f"{question}  （{route}）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='汇总Agent追踪文件')
+    parser.add_argument('path', nargs='?', default=AGENT_TRACE_PATH or 'data/agent_traces.jsonl',
+                        help='JSONL追踪文件（默认 AGENT_TRACE_PATH）')
+    parser.add_argument('--top', type=int, default=10, help='每个列表显示的条数')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"找不到追踪文件 {args.path}（运行Agent前设置 AGENT_TRACE_PATH 或使用 run_agent.py --trace）")
+        sys.exit(1)
+    spans = load_spans(args.path)
+    turns = summarize_turns(spans)
+
+    fast = sum(1 for t in turns if t['fast_path'])
+    input_tokens = sum(t['input_tokens'] for t in turns)
+    output_tokens = sum(t['output_tokens'] for t in turns)
+    print(f"{args.path}: {len(spans)} 个span, {len(turns)} 轮提问（快速路径 {fast} 轮）, "
+          f"输入 {input_tokens} / 输出 {output_tokens} tokens")
+    if turns:
+        durations = sorted(t['duration_ms'] for t in turns)
+        print(f"每轮耗时: p50 {percentile(durations, 50):.0f}ms, p95 {percentile(durations, 95):.0f}ms, "
+              f"最大 {durations[-1]:.0f}ms")
+
+    print_group("模型调用", group_stats(spans, 'model'), args.top)
+    print_group("最慢的工具（按总耗时）", group_stats(spans, 'tool'), args.top)
+    print_group("最慢的数据库函数（按总耗时）", group_stats(spans, 'db'), args.top)
+    print_group("embedding", group_stats(spans, 'embedding'), args.top)
+
+    print_turns("最慢的提问", sorted(turns, key=lambda t: t['duration_ms'], reverse=True)[:args.top])
+    expensive = [t for t in turns if t['input_tokens'] or t['output_tokens']]
+    print_turns("token最多的提问", sorted(expensive, key=lambda t: t['input_tokens'] + t['output_tokens'],
+                                         reverse=True)[:args.top])
+
+
+if __name__ == '__main__':
+    main()
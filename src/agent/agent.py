@@ -1,15 +1,25 @@
+import asyncio
+import contextvars
 import os
+import time
 from langchain_anthropic import ChatAnthropic
 from langgraph.prebuilt import create_react_agent
 from langgraph.checkpoint.memory import MemorySaver
-from src.agent.tools import ALL_TOOLS
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage
+from src.agent.memory import PROMPT_TOKENS, bound_history, model_input_tokens, open_checkpointer
+from src.agent.router import try_fast_path
+from src.agent.tools import ALL_TOOLS, SEARCH_TIMINGS, TOOL_TIMINGS
+from src.config import AGENT_MEMORY_PATH
+from src.tracing import current_span, end_span, span as trace_span, start_span
 
 SYSTEM_PROMPT = """你是香港Nintendo eShop的折扣分析师。你可以：
 - 搜索游戏（支持中文简繁体、英文、发行商名等关键词）
 - 查看游戏详情（类型、发行商、语言、发售日、折扣时间）
 - 查看价格历史和统计
 - 按游戏类型推荐（如角色扮演、动作、模擬）
-- 获取当前折扣列表
+- 获取当前折扣列表（可按最低折扣、最高价格筛选，结果分页，需要更多时用cursor翻页）
+- 按条件组合筛选游戏（支持的语言、游戏人数、类型、价格上限、折扣），如「支持中文的双人游戏，100元以下打折的」
 - 搜索Metacritic评分
 
 回答时用中文。价格单位是HKD（港币）。
@@ -19,37 +29,202 @@ SYSTEM_PROMPT = """你是香港Nintendo eShop的折扣分析师。你可以：
 关于历史对话和Tool调用的规则：
 - 每轮先判断用户是否在引用上文（如"这个"、"它"、"刚才那个"、"历史最低吗"）。如果是，使用历史context中的信息。如果是全新的问题，独立判断该调用什么Tool，不要重复调用历史中已有的搜索。
 - 一个问题通常只需要1-3次Tool调用就够了。不要用相同参数重复调用同一个Tool。
+- 互相独立的Tool调用（如同时查数据库和Metacritic评分）请在同一轮一起发出，它们会并发执行。
 - 只调用和当前问题直接相关的Tool，不要发散搜索不相关的内容。"""
 
 
-def create_agent(debug=False):
-    """创建并返回 ReAct Agent（带对话记忆）"""
+# 命令行的ask共用一个事件循环：SQLite checkpointer绑定创建它的事件循环
+_runner = None
+_checkpointers = []
+
+
+def _get_runner():
+    global _runner
+    if _runner is None:
+        _runner = asyncio.Runner()
+    return _runner
+
+
+def close_agent():
+    """关闭SQLite checkpointer连接和共用的事件循环（连接的后台线程不关闭会阻止进程退出）"""
+    global _runner
+    if _runner is None:
+        return
+    for saver in _checkpointers:
+        _runner.run(saver.conn.close())
+    _checkpointers.clear()
+    _runner.close()
+    _runner = None
+
+
+def create_llm():
+    """Agent使用的Claude模型"""
     api_key = os.environ.get('ANTHROPIC_API_KEY')
     if not api_key:
         raise ValueError("请设置 ANTHROPIC_API_KEY 环境变量")
 
-    if debug:
-        import langchain
-        langchain.debug = True
-
-    llm = ChatAnthropic(
+    return ChatAnthropic(
         model="claude-sonnet-4-20250514",
         anthropic_api_key=api_key,
         temperature=0,
     )
 
-    memory = MemorySaver()
-    agent = create_react_agent(llm, ALL_TOOLS, prompt=SYSTEM_PROMPT, checkpointer=memory)
-    return agent
 
+def build_agent(llm, checkpointer):
+    """用给定的模型和checkpointer组装 ReAct Agent（每次调用模型前由 bound_history 限制上下文）"""
+    return create_react_agent(llm, ALL_TOOLS, prompt=SYSTEM_PROMPT, checkpointer=checkpointer,
+                              pre_model_hook=bound_history)
+
+
+def create_agent(debug=False, memory_path=AGENT_MEMORY_PATH, llm=None):
+    """创建并返回 ReAct Agent（带对话记忆），供命令行的 ask 使用。
+
+    memory_path 为SQLite文件时对话记忆持久化到磁盘，为空时只存内存；
+    llm 默认为 create_llm()，测试时可传入替身模型。
+    """
+    if debug:
+        import langchain
+        langchain.debug = True
+
+    llm = llm or create_llm()
+
+    if memory_path:
+        memory = _get_runner().run(open_checkpointer(memory_path))
+        _checkpointers.append(memory)
+    else:
+        memory = MemorySaver()
+    return build_agent(llm, memory)
+
+
+# 本轮的耗时：墙钟时间 vs 工具耗时之和（毫秒），以及每次模型调用的输入token数；
+# 由 aask/astream_ask 在每轮开始时设置新dict（或调用方传入的 timing），并发的提问互不覆盖
+TURN_TIMING = contextvars.ContextVar('turn_timing', default=None)
 
-def ask(agent, question, verbose=True, thread_id="default"):
-    """向Agent提问，返回回答文本。通过 thread_id 维持对话记忆。"""
+
+def _set_turn_timing(values):
+    timing = TURN_TIMING.get()
+    if timing is not None:
+        timing.clear()
+        timing.update(values)
+
+
+def _print_prompt_tokens(estimated, reported):
+    """打印本轮每次模型调用的输入token数，用于确认长对话中上下文不再线性增长"""
+    line = f"  📏 输入token: 估算 {estimated}"
+    if reported:
+        line += f", 模型报告 {reported}"
+    print(line)
+
+
+class _ModelTraceHandler(BaseCallbackHandler):
+    """把每次模型调用记录为model span（token用量取自模型返回的usage_metadata）"""
+
+    run_inline = True  # 在调用方的上下文中执行，span才能挂到当前这一轮下
+
+    def __init__(self):
+        self._spans = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        s, _ = start_span('chat_model', 'model', {'model': metadata.get('ls_model_name'),
+                                                 'messages': len(messages[0]) if messages else 0},
+                          activate=False)
+        if s is not None:
+            self._spans[run_id] = s
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        s = self._spans.pop(run_id, None)
+        if s is None:
+            return
+        generations = response.generations[0] if response.generations else []
+        message = getattr(generations[0], 'message', None) if generations else None
+        usage = getattr(message, 'usage_metadata', None) or {}
+        details = usage.get('input_token_details') or {}
+        s.attrs.update({
+            'input_tokens': usage.get('input_tokens'),
+            'output_tokens': usage.get('output_tokens'),
+            'cache_read_tokens': details.get('cache_read'),
+            'cache_creation_tokens': details.get('cache_creation'),
+            'tool_calls': [tc['name'] for tc in getattr(message, 'tool_calls', None) or []],
+        })
+        end_span(s)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        end_span(self._spans.pop(run_id, None), error=error)
+
+
+_model_tracer = _ModelTraceHandler()
+
+
+def _run_config(thread_id):
+    """Agent调用的config；在追踪中时挂上模型span的回调"""
     config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 20}
+    if current_span() is not None:
+        config["callbacks"] = [_model_tracer]
+    return config
+
+
+def ask(agent, question, verbose=True, thread_id="default", stream=False, fast_path=True, timing=None):
+    """向Agent提问，返回回答文本。通过 thread_id 维持对话记忆。同一轮的多个工具调用并发执行。
+
+    stream=True 时边生成边打印工具调用和回答token（回答已打印，调用方不必再打印返回值）。
+    fast_path=True 时常见的简单问题由 router 直接查库回答，不调用LLM。
+    timing 为dict时写入本轮的耗时（见 TURN_TIMING）。
+    """
+    if stream:
+        return _get_runner().run(astream_ask(agent, question, verbose=verbose, thread_id=thread_id,
+                                             fast_path=fast_path, timing=timing))
+    return _get_runner().run(aask(agent, question, verbose=verbose, thread_id=thread_id, fast_path=fast_path,
+                                  timing=timing))
+
+
+async def _answer_fast(agent, question, config, verbose, stream):
+    """尝试快速路径；命中时把问答写入对话记忆（后续追问能引用），返回回答，否则返回None"""
+    t0 = time.perf_counter()
+    intent, answer = await asyncio.to_thread(try_fast_path, question)
+    if answer is None:
+        return None
+
+    await agent.aupdate_state(config, {"messages": [HumanMessage(question), AIMessage(answer)]},
+                              as_node="agent")
+    turn = current_span()
+    if turn is not None:
+        turn.attrs['fast_path'] = intent
+    wall_ms = (time.perf_counter() - t0) * 1000
+    _set_turn_timing({'wall_ms': round(wall_ms, 1), 'tool_ms': 0.0, 'tool_calls': [], 'fast_path': intent})
+
+    if verbose:
+        print(f"\n===== 新问题: {question} =====")
+        print(f"  ⚡ 快速路径（{intent}），{wall_ms:.0f}ms，未调用LLM")
+    if stream:
+        print(f"\n{answer}")
+    return answer
+
+
+async def aask(agent, question, verbose=True, thread_id="default", fast_path=True, timing=None):
+    """ask 的异步版本（在已有事件循环中调用）。开启追踪时每轮记录为一个turn trace"""
+    timing_token = TURN_TIMING.set({} if timing is None else timing)
+    try:
+        with trace_span('turn', 'turn', root=True, question=question, thread_id=thread_id) as turn:
+            answer = await _aask(agent, question, verbose, thread_id, fast_path)
+            if turn is not None:
+                turn.attrs['answer_chars'] = len(answer)
+            return answer
+    finally:
+        TURN_TIMING.reset(timing_token)
+
+
+async def _aask(agent, question, verbose, thread_id, fast_path):
+    config = _run_config(thread_id)
+
+    if fast_path:
+        answer = await _answer_fast(agent, question, config, verbose, stream=False)
+        if answer is not None:
+            return answer
 
     # 记录invoke前的历史消息数量，用于只打印本轮新增的消息
     try:
-        state = agent.get_state(config)
+        state = await agent.aget_state(config)
         prev_count = len(state.values.get("messages", []))
     except Exception:
         prev_count = 0
@@ -57,24 +232,169 @@ def ask(agent, question, verbose=True, thread_id="default"):
     if verbose:
         print(f"\n===== 新问题: {question} =====")
 
-    result = agent.invoke({"messages": [("human", question)]}, config=config)
+    timings, search_timings, prompt_tokens = [], [], []
+    token = TOOL_TIMINGS.set(timings)
+    search_token = SEARCH_TIMINGS.set(search_timings)
+    prompt_token = PROMPT_TOKENS.set(prompt_tokens)
+    t0 = time.perf_counter()
+    try:
+        result = await agent.ainvoke({"messages": [("human", question)]}, config=config)
+    finally:
+        TOOL_TIMINGS.reset(token)
+        SEARCH_TIMINGS.reset(search_token)
+        PROMPT_TOKENS.reset(prompt_token)
+    wall_ms = (time.perf_counter() - t0) * 1000
+
+    tool_ms = sum(ms for _, ms in timings)
+    reported = model_input_tokens(result["messages"][prev_count:])
+    _set_turn_timing({'wall_ms': round(wall_ms, 1), 'tool_ms': round(tool_ms, 1),
+                      'tool_calls': [(name, round(ms, 1)) for name, ms in timings],
+                      'search_timings': search_timings, 'prompt_tokens': prompt_tokens, 'input_tokens': reported})
 
     if verbose:
         # 只打印本轮新增的消息（跳过历史）
         new_messages = result["messages"][prev_count:]
+        call_args = {}  # tool_call_id -> 参数，用于找到每个search_games结果对应的耗时
+        search_by_query = {s['query']: s for s in search_timings}
         for msg in new_messages:
             if msg.type == "ai" and hasattr(msg, "tool_calls") and msg.tool_calls:
                 for tc in msg.tool_calls:
+                    call_args[tc['id']] = tc['args']
                     print(f"  🔧 调用 {tc['name']}({tc['args']})")
             elif msg.type == "tool":
                 content = msg.content if len(msg.content) <= 200 else msg.content[:200] + "..."
                 print(f"  📋 {msg.name} 返回: {content}")
+                search = (search_by_query.get(call_args.get(msg.tool_call_id, {}).get('query'))
+                          if msg.name == "search_games" else None)
+                if search:
+                    print(f"  ⏱ embedding {search['embedding_ms']}ms, DB {search['db_ms']}ms")
+        if timings:
+            calls = ", ".join(f"{name} {ms:.0f}ms" for name, ms in timings)
+            print(f"  ⏱ 本轮: 墙钟 {wall_ms:.0f}ms, 工具合计 {tool_ms:.0f}ms（{calls}）")
+        _print_prompt_tokens(prompt_tokens, reported)
+
+    return _final_answer(result["messages"])
+
 
-    # 取最后一条 AI 消息
-    for msg in reversed(result["messages"]):
+def _final_answer(messages):
+    """取最后一条有内容的 AI 消息文本"""
+    for msg in reversed(messages):
         if msg.type == "ai" and msg.content:
             if isinstance(msg.content, list):
                 texts = [b["text"] for b in msg.content if b.get("type") == "text"]
                 return "\n".join(texts) if texts else str(msg.content)
             return msg.content
-    return "没有得到回答。"
\ No newline at end of file
+    return "没有得到回答。"
+
+
+def _chunk_text(chunk):
+    """AIMessageChunk中的文本（Anthropic的content可能是内容块列表）"""
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(b.get("text", "") for b in chunk.content if isinstance(b, dict) and b.get("type") == "text")
+
+
+async def astream_ask(agent, question, verbose=True, thread_id="default", fast_path=True, timing=None):
+    """流式提问：工具调用、工具结果和回答token到达即打印，返回最终回答文本。
+
+    verbose 模式下额外报告首token时间（TTFT）和首个工具结果时间。
+    """
+    turn_timing = {} if timing is None else timing
+    timing_token = TURN_TIMING.set(turn_timing)
+    try:
+        with trace_span('turn', 'turn', root=True, question=question, thread_id=thread_id, stream=True) as turn:
+            answer = await _astream_ask(agent, question, verbose, thread_id, fast_path)
+            if turn is not None:
+                turn.attrs['answer_chars'] = len(answer)
+                turn.attrs['first_token_ms'] = turn_timing.get('first_token_ms')
+            return answer
+    finally:
+        TURN_TIMING.reset(timing_token)
+
+
+async def _astream_ask(agent, question, verbose, thread_id, fast_path):
+    config = _run_config(thread_id)
+
+    if fast_path:
+        answer = await _answer_fast(agent, question, config, verbose, stream=True)
+        if answer is not None:
+            return answer
+
+    try:
+        state = await agent.aget_state(config)
+        prev_count = len(state.values.get("messages", []))
+    except Exception:
+        prev_count = 0
+
+    if verbose:
+        print(f"\n===== 新问题: {question} =====")
+
+    timings, prompt_tokens = [], []
+    token = TOOL_TIMINGS.set(timings)
+    prompt_token = PROMPT_TOKENS.set(prompt_tokens)
+    t0 = time.perf_counter()
+    first_token_ms = first_tool_result_ms = None
+    in_text = False  # 当前是否正在输出回答文本（工具事件前先换行）
+
+    try:
+        async for mode, payload in agent.astream({"messages": [("human", question)]}, config=config,
+                                                 stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") != "agent" or chunk.type != "AIMessageChunk":
+                    continue
+                text = _chunk_text(chunk)
+                if text:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - t0) * 1000
+                        print()
+                    print(text, end="", flush=True)
+                    in_text = True
+                continue
+
+            # updates: 节点完成后的完整消息（完整的tool_calls参数 / 工具结果）
+            for node, update in payload.items():
+                for msg in (update or {}).get("messages", []):
+                    if node == "agent" and getattr(msg, "tool_calls", None):
+                        if in_text:
+                            print()
+                            in_text = False
+                        for tc in msg.tool_calls:
+                            print(f"  🔧 调用 {tc['name']}({tc['args']})", flush=True)
+                    elif node == "tools" and msg.type == "tool":
+                        if first_tool_result_ms is None:
+                            first_tool_result_ms = (time.perf_counter() - t0) * 1000
+                        if in_text:
+                            print()
+                            in_text = False
+                        if verbose:
+                            content = msg.content if len(msg.content) <= 200 else msg.content[:200] + "..."
+                            print(f"  📋 {msg.name} 返回: {content}")
+                        else:
+                            print(f"  📋 {msg.name} 已返回", flush=True)
+    finally:
+        TOOL_TIMINGS.reset(token)
+        PROMPT_TOKENS.reset(prompt_token)
+    wall_ms = (time.perf_counter() - t0) * 1000
+    print()
+
+    state = await agent.aget_state(config)
+    messages = state.values.get("messages", [])
+    reported = model_input_tokens(messages[prev_count:])
+
+    tool_ms = sum(ms for _, ms in timings)
+    _set_turn_timing({
+        'wall_ms': round(wall_ms, 1), 'tool_ms': round(tool_ms, 1),
+        'tool_calls': [(name, round(ms, 1)) for name, ms in timings],
+        'first_token_ms': round(first_token_ms, 1) if first_token_ms is not None else None,
+        'first_tool_result_ms': round(first_tool_result_ms, 1) if first_tool_result_ms is not None else None,
+        'prompt_tokens': prompt_tokens, 'input_tokens': reported,
+    })
+
+    if verbose:
+        ttft = f"{first_token_ms:.0f}ms" if first_token_ms is not None else "-"
+        ttfr = f"{first_tool_result_ms:.0f}ms" if first_tool_result_ms is not None else "-"
+        print(f"  ⏱ 首token {ttft}, 首个工具结果 {ttfr}, 墙钟 {wall_ms:.0f}ms, 工具合计 {tool_ms:.0f}ms")
+        _print_prompt_tokens(prompt_tokens, reported)
+
+    return _final_answer(messages)
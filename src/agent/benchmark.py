@@ -0,0 +1,315 @@
+"""Agent基准测试 - 用回放模型在合成数据库上跑固定问题集，统计工具调用、数据库查询和非模型耗时
+
+- build_synthetic_db: 按随机种子生成确定的SQLite数据库（游戏、价格记录、详情、筛选维度、评分）
+- 问题集：[{"question", "thread"?, "steps"}]，steps 为录制的工具调用计划（见 ReplayChatModel），
+  同一 thread 的问题按顺序在同一对话中提问（用于检查追问时是否重复调用历史中的工具）
+- run_benchmark: 每个问题统计 工具调用数 / 模型调用数 / SQL语句数 / 端到端耗时 / 模型耗时 / 非模型耗时，
+  并按 SYSTEM_PROMPT 中的工具调用规则检查计划（调用次数、重复参数、重复历史调用）
+- record_plans: 用真实模型跑同一问题集，把实际的工具调用和回答录制成可回放的计划
+"""
+
+import json
+import random
+import statistics
+import threading
+import time
+from datetime import timedelta
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import src.database as database
+from src.agent.agent import ask
+from src.agent.cache import clear_tool_cache
+from src.refresh_scheduler import utcnow
+
+MAX_TOOL_CALLS = 3  # SYSTEM_PROMPT：一个问题通常只需要1-3次Tool调用
+
+# 合成数据中固定的游戏（id 依次为 1..N），默认问题集的计划引用这些 id
+FIXED_GAMES = [
+    ("薩爾達傳說 王國之淚", "動作, 冒險", "Nintendo"),
+    ("超級瑪利歐兄弟 驚奇", "動作, 平台", "Nintendo"),
+    ("Splatoon 3", "射擊", "Nintendo"),
+    ("寶可夢 朱", "角色扮演", "The Pokémon Company"),
+    ("集合啦！動物森友會", "模擬", "Nintendo"),
+    ("瑪利歐賽車8 豪華版", "競速", "Nintendo"),
+    ("Hades", "動作, 角色扮演", "Supergiant Games"),
+    ("Stardew Valley", "模擬, 角色扮演", "ConcernedApe"),
+]
+_NAME_PARTS = (["星之", "迷宮", "幻想", "機械", "海島", "忍者", "像素", "魔法", "銀河", "古堡"],
+               ["冒險", "傳說", "物語", "大亂鬥", "工坊", "派對", "戰記", "農場", "賽車", "探險"])
+_GENRES = ["動作", "冒險", "角色扮演", "模擬", "策略", "益智", "派對", "射擊", "競速", "運動", "平台"]
+_PUBLISHERS = ["Nintendo", "SEGA", "Capcom", "Square Enix", "Bandai Namco", "Annapurna", "Devolver Digital"]
+_LANGUAGES = ["繁體中文", "簡體中文", "英文", "日文", "韓文"]
+_PRICES = [38, 78, 148, 238, 328, 468]
+
+DEFAULT_SCENARIO = [
+    {"question": "现在有什么折扣游戏值得买",
+     "steps": [{"tool_calls": [{"name": "get_current_deals", "args": {}}]},
+               {"answer": "当前折扣中推荐以下几款……"}]},
+    {"question": "50%以上折扣、200元以内的有哪些",
+     "steps": [{"tool_calls": [{"name": "get_current_deals", "args": {"min_discount": 50, "max_price": 200}}]},
+               {"answer": "符合条件的折扣游戏有……"}]},
+    {"question": "王国之泪现在多少钱，值得入手吗", "thread": "zelda",
+     "steps": [{"tool_calls": [{"name": "search_games", "args": {"query": "王国之泪"}}]},
+               {"tool_calls": [{"name": "get_game_detail", "args": {"game_id": 1}},
+                               {"name": "search_metacritic", "args": {"game_name": "薩爾達傳說 王國之淚",
+                                                                      "game_id": 1}}]},
+               {"answer": "【薩爾達傳說 王國之淚】当前价格……"}]},
+    {"question": "它是历史最低吗", "thread": "zelda",
+     "steps": [{"answer": "根据刚才的价格记录，当前价格……"}]},
+    {"question": "它过去的价格变化是怎样的", "thread": "zelda",
+     "steps": [{"tool_calls": [{"name": "get_price_history", "args": {"game_id": 1}}]},
+               {"answer": "【薩爾達傳說 王國之淚】的价格记录……"}]},
+    {"question": "马力欧惊奇和宝可梦朱哪个更便宜",
+     "steps": [{"tool_calls": [{"name": "get_game_detail", "args": {"game_id": 2}},
+                               {"name": "get_game_detail", "args": {"game_id": 4}}]},
+               {"answer": "两款游戏当前价格对比……"}]},
+    {"question": "Splatoon 3 评分怎么样",
+     "steps": [{"tool_calls": [{"name": "search_metacritic", "args": {"game_name": "Splatoon 3",
+                                                                      "game_id": 3}}]},
+               {"answer": "Splatoon 3 的 Metascore 是……"}]},
+    {"question": "支持中文的双人游戏，100元以下打折的",
+     "steps": [{"tool_calls": [{"name": "filter_games", "args": {"language": "中文", "players": 2,
+                                                                "max_price": 100, "on_sale": True}}]},
+               {"answer": "符合条件的游戏有……"}]},
+    {"question": "推荐几个模拟类游戏",
+     "steps": [{"tool_calls": [{"name": "search_by_genre", "args": {"genre": "模拟"}}]},
+               {"answer": "模拟类游戏推荐……"}]},
+    {"question": "有没有像星露谷物语那样的农场游戏",
+     "steps": [{"tool_calls": [{"name": "search_games", "args": {"query": "Stardew Valley"}},
+                               {"name": "search_games", "args": {"query": "農場"}}]},
+               {"answer": "类似的游戏有……"}]},
+]
+
+
+def build_synthetic_db(path, n_games=500, history_len=12, seed=0):
+    """在 path 生成确定的合成数据库并切换到该SQLite（同一 seed 生成的内容相同，时间相对当前时间）"""
+    rng = random.Random(seed)
+    database.use_sqlite(path)
+    database.init_db()
+    now = utcnow().replace(microsecond=0)
+
+    games = list(FIXED_GAMES)
+    for i in range(len(games), n_games):
+        name = f"{rng.choice(_NAME_PARTS[0])}{rng.choice(_NAME_PARTS[1])} {i}"
+        genres = ", ".join(rng.sample(_GENRES, rng.randint(1, 2)))
+        games.append((name, genres, rng.choice(_PUBLISHERS)))
+
+    conn = database._get_conn()
+    for game_id, (name, genre, publisher) in enumerate(games, 1):
+        eshop_id = f"7001{game_id:010d}"
+        conn.execute("INSERT INTO games (id, eshop_id, name, url) VALUES (?, ?, ?, ?)",
+                     (game_id, eshop_id, name, f"https://store.nintendo.com.hk/{eshop_id}"))
+        price = rng.choice(_PRICES)
+        rows = []
+        for k in range(history_len):
+            discount = rng.choice([0, 0, 0, 10, 20, 30, 50, 70])
+            current = round(price * (100 - discount) / 100, 1)
+            scanned_at = now - timedelta(days=7 * (history_len - 1 - k))
+            rows.append((game_id, current, price if discount else None, discount or None,
+                         scanned_at.strftime('%Y-%m-%d %H:%M:%S')))
+        conn.executemany("""
+            INSERT INTO price_history (game_id, current_price, original_price, discount_percent, scanned_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, rows)
+        sale_end = (now + timedelta(days=rng.randint(-3, 14))).strftime('%Y-%m-%d %H:%M:%S')
+        conn.execute("""
+            INSERT INTO game_details (game_id, description, genre, publisher, release_date, languages, players,
+                                      sale_end, search_text)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (game_id, f"{name}的游戏介绍。", genre, publisher,
+              f"{rng.randint(2017, 2025)}-{rng.randint(1, 12):02d}-01",
+              ", ".join(rng.sample(_LANGUAGES, rng.randint(1, 4))),
+              f"1 ~ {rng.choice([1, 2, 4, 8])}", sale_end, f"{name} {genre} {publisher}"))
+        if game_id <= len(FIXED_GAMES) or rng.random() < 0.5:
+            conn.execute("INSERT INTO game_scores (game_id, metascore, user_score, source) VALUES (?, ?, ?, ?)",
+                         (game_id, rng.randint(60, 96), round(rng.uniform(5, 9.5), 1), 'synthetic'))
+    conn.commit()
+    conn.close()
+    database.rebuild_facets()
+    database.rebuild_current_prices()
+    return len(games)
+
+
+def load_scenario(path):
+    """读取问题集JSON（格式同 DEFAULT_SCENARIO）"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def scenario_plans(scenario):
+    """问题集 → ReplayChatModel 的 plans"""
+    return {item['question']: item['steps'] for item in scenario}
+
+
+class QueryCounter:
+    """统计执行的SQL语句数（作为 database.set_query_listener 的回调，PRAGMA/事务语句不计）"""
+
+    _COUNTED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, sql):
+        if sql.lstrip().upper().startswith(self._COUNTED):
+            with self._lock:
+                self.count += 1
+
+
+class ModelTimer(BaseCallbackHandler):
+    """累计模型调用的耗时和次数（挂在模型的 callbacks 上，run_inline 保证计时不受线程调度影响）"""
+
+    run_inline = True
+
+    def __init__(self):
+        self.total_ms = 0.0
+        self.calls = 0
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def _finish(self, run_id):
+        t0 = self._started.pop(run_id, None)
+        if t0 is not None:
+            self.total_ms += (time.perf_counter() - t0) * 1000
+            self.calls += 1
+
+
+def _call_key(call):
+    return call['name'], json.dumps(call['args'], sort_keys=True, ensure_ascii=False)
+
+
+def check_rules(calls, history_calls):
+    """按 SYSTEM_PROMPT 的工具调用规则检查本轮调用，返回违规说明列表"""
+    problems = []
+    if len(calls) > MAX_TOOL_CALLS:
+        problems.append(f"工具调用 {len(calls)} 次（>{MAX_TOOL_CALLS}）")
+    seen = set()
+    for call in calls:
+        key = _call_key(call)
+        if key in seen:
+            problems.append(f"重复调用 {call['name']}{call['args']}")
+        elif key in history_calls:
+            problems.append(f"重复历史中的调用 {call['name']}{call['args']}")
+        seen.add(key)
+    return problems
+
+
+def _turn_messages(agent, thread_id, prev_count):
+    state = agent.get_state({"configurable": {"thread_id": thread_id}})
+    return state.values.get("messages", [])[prev_count:]
+
+
+def _turn_calls(messages):
+    return [{'name': tc['name'], 'args': tc['args']}
+            for m in messages if m.type == 'ai' for tc in (m.tool_calls or [])]
+
+
+def run_benchmark(agent, timer, scenario, repeat=3, cold_cache=True, fast_path=False):
+    """跑 repeat 遍问题集，返回每个问题的结果列表（计数取第一遍，耗时取各遍中位数）"""
+    counter = QueryCounter()
+    database.set_query_listener(counter)
+    results = [{'question': item['question'], 'thread': item.get('thread'), 'e2e_ms': [], 'model_ms': [],
+                'tool_ms': []} for item in scenario]
+    try:
+        for run in range(repeat):
+            history = {}  # thread -> 历史中的调用
+            lengths = {}  # thread -> 历史消息数
+            for i, item in enumerate(scenario):
+                thread = f"bench{run}:{item.get('thread') or i}"
+                if cold_cache:
+                    clear_tool_cache()
+                queries_before, model_before, calls_before = counter.count, timer.total_ms, timer.calls
+
+                timing = {}
+                t0 = time.perf_counter()
+                answer = ask(agent, item['question'], verbose=False, thread_id=thread, fast_path=fast_path,
+                             timing=timing)
+                e2e_ms = (time.perf_counter() - t0) * 1000
+
+                messages = _turn_messages(agent, thread, lengths.get(thread, 0))
+                lengths[thread] = lengths.get(thread, 0) + len(messages)
+                calls = _turn_calls(messages)
+                history_calls = history.setdefault(thread, set())
+
+                r = results[i]
+                model_ms = timer.total_ms - model_before
+                r['e2e_ms'].append(e2e_ms)
+                r['model_ms'].append(model_ms)
+                r['tool_ms'].append(sum(ms for _, ms in timing.get('tool_calls', [])))
+                if run == 0:
+                    r.update({
+                        'tool_calls': len(calls),
+                        'tools': [c['name'] for c in calls],
+                        'model_calls': timer.calls - calls_before,
+                        'db_queries': counter.count - queries_before,
+                        'tool_errors': sum(1 for m in messages if m.type == 'tool' and m.status == 'error'),
+                        'violations': check_rules(calls, history_calls),
+                        'answer': answer,
+                    })
+                history_calls.update(_call_key(c) for c in calls)
+    finally:
+        database.set_query_listener(None)
+
+    for r in results:
+        e2e, model = r.pop('e2e_ms'), r.pop('model_ms')
+        r['e2e_ms'] = round(statistics.median(e2e), 1)
+        r['model_ms'] = round(statistics.median(model), 1)
+        r['non_model_ms'] = round(statistics.median(e - m for e, m in zip(e2e, model)), 1)
+        r['tool_ms'] = round(statistics.median(r['tool_ms']), 1)
+    return results
+
+
+def record_plans(agent, scenario, fast_path=False):
+    """用真实模型跑问题集，返回录制了实际工具调用和回答的新问题集"""
+    recorded = []
+    lengths = {}
+    for i, item in enumerate(scenario):
+        thread = f"record:{item.get('thread') or i}"
+        answer = ask(agent, item['question'], verbose=False, thread_id=thread, fast_path=fast_path)
+        messages = _turn_messages(agent, thread, lengths.get(thread, 0))
+        lengths[thread] = lengths.get(thread, 0) + len(messages)
+
+        steps = [{'tool_calls': [{'name': tc['name'], 'args': tc['args']} for tc in m.tool_calls]}
+                 for m in messages if m.type == 'ai' and m.tool_calls]
+        steps.append({'answer': answer})
+        entry = {'question': item['question'], 'steps': steps}
+        if item.get('thread'):
+            entry['thread'] = item['thread']
+        recorded.append(entry)
+    return recorded
+
+
+def summarize(results):
+    """整体汇总：问题数、工具调用/SQL总数、非模型耗时中位数、违规数"""
+    return {
+        'questions': len(results),
+        'tool_calls': sum(r['tool_calls'] for r in results),
+        'db_queries': sum(r['db_queries'] for r in results),
+        'non_model_ms_median': round(statistics.median(r['non_model_ms'] for r in results), 1) if results else 0.0,
+        'non_model_ms_total': round(sum(r['non_model_ms'] for r in results), 1),
+        'violations': sum(len(r['violations']) for r in results),
+        'tool_errors': sum(r['tool_errors'] for r in results),
+    }
+
+
+def compare(results, baseline):
+    """与基线结果对比，返回工具调用数或SQL语句数增加的问题说明"""
+    old = {r['question']: r for r in baseline}
+    regressions = []
+    for r in results:
+        b = old.get(r['question'])
+        if b is None:
+            continue
+        for key in ('tool_calls', 'db_queries'):
+            if r[key] > b[key]:
+                regressions.append(f"{r['question']}: {key} {b[key]} → {r[key]}")
+    return regressions
@@ -0,0 +1,138 @@
+"""Agent工具结果缓存 - 数据只在扫描提交后变化，按 (工具名, 归一化参数) 缓存工具输出
+
+扫描/爬取脚本写完数据后调用 database.bump_data_version()，
+缓存最多每 TOOL_CACHE_VERSION_CHECK_SECONDS 秒查一次版本号，版本变化时清空全部条目。
+"""
+
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+from src.config import TOOL_CACHE_SIZE, TOOL_CACHE_VERSION_CHECK_SECONDS
+from src.database import get_data_version
+
+
+def _normalize_arg(value):
+    """字符串参数归一化（空白、大小写、简繁体），使等价的提问共享缓存"""
+    if isinstance(value, str):
+        from src.embedding import normalize_query
+        return normalize_query(value)
+    return value
+
+
+class ToolResultCache:
+    """工具输出的LRU缓存，以数据版本号整体失效，并统计命中率和耗时"""
+
+    def __init__(self, max_size=TOOL_CACHE_SIZE, check_interval=TOOL_CACHE_VERSION_CHECK_SECONDS):
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self._data = OrderedDict()  # (tool, args) -> result
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.stats = {}  # tool -> {'hits', 'misses', 'hit_ms', 'miss_ms'}
+        self.invalidations = 0
+
+    def _sync_version(self):
+        """到期时查询数据版本号，变化则清空缓存"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        try:
+            version = get_data_version()
+        except Exception:
+            return  # 查不到版本号时沿用旧缓存，下次再试
+        with self._lock:
+            self._checked_at = now
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self._data.clear()
+                self._version = version
+
+    def _record(self, tool, hit, elapsed_ms):
+        with self._lock:
+            s = self.stats.setdefault(tool, {'hits': 0, 'misses': 0, 'hit_ms': 0.0, 'miss_ms': 0.0})
+            if hit:
+                s['hits'] += 1
+                s['hit_ms'] += elapsed_ms
+            else:
+                s['misses'] += 1
+                s['miss_ms'] += elapsed_ms
+
+    def call(self, tool, func, args, kwargs):
+        t0 = time.perf_counter()
+        self._sync_version()
+        key = (tool, tuple(_normalize_arg(a) for a in args),
+               tuple(sorted((k, _normalize_arg(v)) for k, v in kwargs.items())))
+
+        with self._lock:
+            hit = key in self._data
+            if hit:
+                self._data.move_to_end(key)
+                result = self._data[key]
+        if not hit:
+            result = func(*args, **kwargs)
+            with self._lock:
+                self._data[key] = result
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_size:
+                    self._data.popitem(last=False)
+
+        self._record(tool, hit, (time.perf_counter() - t0) * 1000)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._version = None
+            self._checked_at = 0.0
+
+    def get_stats(self):
+        """各工具的命中次数、命中率和平均耗时"""
+        with self._lock:
+            result = {}
+            for tool, s in self.stats.items():
+                total = s['hits'] + s['misses']
+                result[tool] = {
+                    'hits': s['hits'],
+                    'misses': s['misses'],
+                    'hit_rate': round(s['hits'] / total, 3) if total else 0.0,
+                    'avg_hit_ms': round(s['hit_ms'] / s['hits'], 2) if s['hits'] else None,
+                    'avg_miss_ms': round(s['miss_ms'] / s['misses'], 1) if s['misses'] else None,
+                }
+            return {'size': len(self._data), 'version': self._version,
+                    'invalidations': self.invalidations, 'tools': result}
+
+
+_cache = ToolResultCache()
+
+
+def cached_tool(func):
+    """工具函数的缓存装饰器（放在 @tool 之下，functools.wraps 保留签名和docstring）"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return _cache.call(func.__name__, func, args, kwargs)
+    return wrapper
+
+
+def clear_tool_cache():
+    """清空缓存的工具结果（基准测试测冷启动时使用）"""
+    _cache.clear()
+
+
+def get_tool_cache_stats():
+    return _cache.get_stats()
+
+
+def format_tool_cache_stats():
+    """缓存统计的可读文本，供命令行退出时打印"""
+    stats = get_tool_cache_stats()
+    lines = [f"工具缓存: {stats['size']} 条, 数据版本 {stats['version']}, 失效 {stats['invalidations']} 次"]
+    for tool, s in stats['tools'].items():
+        hit_ms = f"{s['avg_hit_ms']}ms" if s['avg_hit_ms'] is not None else "-"
+        miss_ms = f"{s['avg_miss_ms']}ms" if s['avg_miss_ms'] is not None else "-"
+        lines.append(f"  {tool}: 命中 {s['hits']}/{s['hits'] + s['misses']} ({s['hit_rate']:.0%}), "
+                     f"命中耗时 {hit_ms}, 未命中耗时 {miss_ms}")
+    return "\n".join(lines)
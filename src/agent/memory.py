@@ -0,0 +1,79 @@
+"""Agent对话记忆 - 磁盘checkpointer + 有界的历史消息策略
+
+- open_checkpointer: SQLite持久化的checkpointer（进程重启后按thread_id继续对话）
+- bound_history: 作为 pre_model_hook 在每次调用模型前执行：
+  1. 之前轮次的长工具输出（如30行的折扣列表）截断后写回state，历史不再无限增长
+  2. 按估算token数只保留最近的消息（从human消息开始），送给模型的上下文有上限
+"""
+
+import contextvars
+import os
+
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+
+from src.config import AGENT_CONTEXT_MAX_TOKENS, AGENT_OLD_TOOL_OUTPUT_CHARS
+
+# 本轮每次调用模型前估算的输入token数（不含system prompt），由 ask 在每轮开始时设置新列表
+PROMPT_TOKENS = contextvars.ContextVar('prompt_tokens', default=None)
+
+
+async def open_checkpointer(path):
+    """打开SQLite checkpointer（必须在之后运行Agent的同一个事件循环里调用）"""
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = await aiosqlite.connect(path)
+    saver = AsyncSqliteSaver(conn)
+    await saver.setup()
+    return saver
+
+
+def _truncate(msg, max_chars):
+    content = msg.content
+    if not isinstance(content, str) or len(content) <= max_chars:
+        return None
+    note = f"\n...（旧工具输出已截断，原 {len(content)} 字）"
+    return msg.model_copy(update={'content': content[:max_chars] + note})
+
+
+def bound_history(state):
+    """pre_model_hook：截断旧工具输出（写回state），并把送给模型的历史限制在 AGENT_CONTEXT_MAX_TOKENS 内"""
+    messages = list(state['messages'])
+    last_human = max((i for i, m in enumerate(messages) if m.type == 'human'), default=0)
+
+    # 本轮之前的工具输出：截断并按id替换state中的原消息
+    updates = []
+    for i, msg in enumerate(messages[:last_human]):
+        if msg.type == 'tool':
+            short = _truncate(msg, AGENT_OLD_TOOL_OUTPUT_CHARS)
+            if short is not None:
+                messages[i] = short
+                updates.append(short)
+
+    llm_input = trim_messages(
+        messages,
+        max_tokens=AGENT_CONTEXT_MAX_TOKENS,
+        token_counter=count_tokens_approximately,
+        strategy='last',
+        start_on='human',
+        allow_partial=False,
+    )
+    if not llm_input:
+        # 本轮本身已超过上限时至少保留本轮的消息
+        llm_input = messages[last_human:]
+
+    prompt_tokens = PROMPT_TOKENS.get()
+    if prompt_tokens is not None:
+        prompt_tokens.append(count_tokens_approximately(llm_input))
+
+    result = {'llm_input_messages': llm_input}
+    if updates:
+        result['messages'] = updates
+    return result
+
+
+def model_input_tokens(messages):
+    """模型实际报告的每次调用的输入token数（usage_metadata，包含system prompt和工具定义）"""
+    return [m.usage_metadata['input_tokens'] for m in messages
+            if m.type == 'ai' and getattr(m, 'usage_metadata', None)]
@@ -0,0 +1,173 @@
+"""意图路由 - 常见的简单问题不经过LLM，直接查库并用模板回答
+
+只处理高置信度的三类问题，其余（含指代上文的"它"、"这个"）都交给ReAct Agent：
+- 折扣列表：「现在有什么折扣」「有哪些游戏在打折」
+- 价格：「塞尔达多少钱」「XX现在什么价格」
+- 历史最低：「XX是历史最低吗」「XX现在是史低吗」
+游戏名用名称子串匹配（原文/繁体/简体）找候选，只有恰好一个游戏的名称与问题完全一致时才直接回答，否则交给Agent。
+"""
+
+import re
+import threading
+import time
+
+from src.database import count_deals, get_deals_page, get_price_stats, search_games_by_name
+
+FAST_DEALS_LIMIT = 10  # 折扣列表回答展示的游戏数
+
+_PUNCT = r'[\s?？!！。，,~～]*'
+_DEALS_RE = re.compile(
+    r'^(请问)?(现在|目前|当前|最近|今天)?(有)?(什么|哪些|啥)(游戏)?(在)?(打折|折扣|减价|特价|优惠)'
+    r'(游戏)?(吗|呢|呀)?' + _PUNCT + '$'
+    r'|^(当前|现在|目前)?(的)?(折扣|打折|减价)(游戏)?(列表|有哪些)' + _PUNCT + '$'
+)
+_PRICE_RE = re.compile(
+    r'^(?P<name>.+?)(现在|目前)?(的)?(多少钱|卖多少|什么价格?|几多钱|价格是?多少|售价)(呢|呀)?' + _PUNCT + '$'
+)
+_LOWEST_RE = re.compile(
+    r'^(?P<name>.+?)(现在|目前)?(是不是|是)(历史最低|史低|最低价)(价格?)?(吗|呢|了吗)?' + _PUNCT + '$'
+)
+_PRONOUNS = ('它', '这个', '那个', '这款', '那款', '刚才', '上面', '这些', '那些')
+
+
+class _RouterStats:
+    """快速路径命中率和耗时统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.fast = {}  # intent -> [次数, 总耗时ms]
+
+    def record(self, intent, elapsed_ms):
+        with self.lock:
+            self.total += 1
+            if intent is not None:
+                entry = self.fast.setdefault(intent, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed_ms
+
+
+_stats = _RouterStats()
+
+
+def _simplify(text):
+    from src.embedding import convert_to_simplified
+    return convert_to_simplified(text)
+
+
+def _clean_name(name):
+    name = re.sub(r'^(请问|那|那么)', '', name.strip())
+    name = re.sub(r'(这个游戏|这款游戏|游戏)$', '', name).strip(' 「」『』"\'')
+    return name
+
+
+def classify(question):
+    """返回 (intent, name)，intent 为 'deals' / 'price' / 'lowest'，不确定时返回 (None, None)"""
+    text = _simplify(question.strip())
+    if _DEALS_RE.match(text):
+        return 'deals', None
+
+    for intent, pattern in (('lowest', _LOWEST_RE), ('price', _PRICE_RE)):
+        m = pattern.match(text)
+        if m:
+            name = _clean_name(m.group('name'))
+            if len(name) < 2 or any(p in name for p in _PRONOUNS):
+                return None, None
+            return intent, name
+    return None, None
+
+
+def _find_games(name):
+    """按名称子串匹配（原文/繁体/简体），返回去重后的游戏列表"""
+    from src.embedding import convert_to_traditional
+
+    results = {}
+    for q in dict.fromkeys([name, convert_to_traditional(name), _simplify(name)]):
+        for r in search_games_by_name(q):
+            results.setdefault(r['id'], r)
+    return list(results.values())
+
+
+def _price_text(r):
+    if r.get('current_price') is None:
+        return "暂无价格记录"
+    text = f"HKD{r['current_price']}"
+    if r.get('discount_percent'):
+        text += f"（原价 HKD{r['original_price']}，{r['discount_percent']}% off）"
+    return text
+
+
+def _answer_deals():
+    deals, _ = get_deals_page(limit=FAST_DEALS_LIMIT)
+    if not deals:
+        return "当前没有打折游戏。"
+    total = count_deals()
+    lines = [f"当前共有 {total} 个游戏在打折，折扣力度最大的 {len(deals)} 个："]
+    for i, d in enumerate(deals, 1):
+        lines.append(f"{i}. {d['name']} - HKD{d['current_price']}"
+                     f"（原价 HKD{d['original_price']}，{d['discount_percent']}% off）")
+    if total > len(deals):
+        lines.append(f"\n还有 {total - len(deals)} 个折扣游戏，可以按类型或价格进一步筛选。")
+    return "\n".join(lines)
+
+
+def _answer_price(game):
+    return f"【{game['name']}】当前价格 {_price_text(game)}。"
+
+
+def _answer_lowest(game):
+    stats = get_price_stats(game['id'])
+    if not stats or not stats.get('total_records'):
+        return None
+    name = game['name']
+    if stats['is_lowest']:
+        return (f"是的，【{name}】当前价格 HKD{stats['current_price']} 就是历史最低价"
+                f"（共 {stats['total_records']} 条价格记录，打折过 {stats['discount_count']} 次）。")
+    return (f"不是，【{name}】当前价格 HKD{stats['current_price']}，"
+            f"历史最低价是 HKD{stats['min_price']}（共 {stats['total_records']} 条价格记录）。")
+
+
+def _pick_one(games, name):
+    """只接受名称（简体、忽略大小写）与问题完全一致的那一个游戏；唯一的子串匹配（如 Hades → Hades II）也不算"""
+    key = _simplify(name).lower()
+    exact = [g for g in games if _simplify(g['name']).lower() == key]
+    return exact[0] if len(exact) == 1 else None
+
+
+def try_fast_path(question):
+    """高置信度的简单问题直接返回 (intent, 回答文本)；否则返回 (None, None)，由Agent处理"""
+    t0 = time.perf_counter()
+    intent, name = classify(question)
+    answer = None
+
+    if intent == 'deals':
+        answer = _answer_deals()
+    elif intent in ('price', 'lowest'):
+        game = _pick_one(_find_games(name), name)
+        if game is not None:
+            answer = _answer_price(game) if intent == 'price' else _answer_lowest(game)
+
+    if answer is None:
+        intent = None
+    _stats.record(intent, (time.perf_counter() - t0) * 1000)
+    return intent, answer
+
+
+def get_router_stats():
+    """快速路径占比和平均耗时"""
+    with _stats.lock:
+        fast_count = sum(n for n, _ in _stats.fast.values())
+        return {
+            'total': _stats.total,
+            'fast': fast_count,
+            'fast_share': round(fast_count / _stats.total, 3) if _stats.total else 0.0,
+            'intents': {k: {'count': n, 'avg_ms': round(ms / n, 1)} for k, (n, ms) in _stats.fast.items()},
+        }
+
+
+def format_router_stats():
+    stats = get_router_stats()
+    lines = [f"快速路径: {stats['fast']}/{stats['total']} 个问题 ({stats['fast_share']:.0%})"]
+    for intent, s in stats['intents'].items():
+        lines.append(f"  {intent}: {s['count']} 次, 平均 {s['avg_ms']}ms")
+    return "\n".join(lines)
@@ -0,0 +1,100 @@
+"""替身聊天模型 - 不调用Claude，用于HTTP服务压测、Agent基准测试和离线调试
+
+- StubChatModel: 最后一条是用户问题时发出一次工具调用（问折扣→get_current_deals，否则→search_games），
+  收到工具结果后用结果的前几行拼出回答。每次调用按 latency 秒模拟模型延迟。
+- ReplayChatModel: 按录制的计划逐步回放每个问题的工具调用和最终回答，结果完全确定。
+"""
+
+import asyncio
+import time
+import uuid
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+_DEAL_WORDS = ('折扣', '打折', '减价', '減價', '特价', '优惠', 'deal', 'sale')
+
+
+class StubChatModel(BaseChatModel):
+    """规则驱动的替身模型（支持 bind_tools，延迟可配置）"""
+
+    latency: float = 0.2  # 每次模型调用的模拟延迟（秒）
+    answer_lines: int = 3  # 回答中引用的工具结果行数
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages):
+        last = messages[-1]
+        usage = {'input_tokens': count_tokens_approximately(messages), 'output_tokens': 20,
+                 'total_tokens': count_tokens_approximately(messages) + 20}
+
+        if last.type == 'tool':
+            # 本轮所有工具结果（最后一条AI消息之后的ToolMessage）
+            results = []
+            for msg in reversed(messages):
+                if msg.type != 'tool':
+                    break
+                results.insert(0, msg.content)
+            lines = [line for text in results for line in str(text).splitlines() if line.strip()]
+            answer = "根据查询结果：\n" + "\n".join(lines[:self.answer_lines])
+            return AIMessage(content=answer, usage_metadata=usage)
+
+        question = str(last.content)
+        if any(w in question.lower() for w in _DEAL_WORDS):
+            call = {'name': 'get_current_deals', 'args': {}}
+        else:
+            call = {'name': 'search_games', 'args': {'query': question}}
+        call['id'] = f"call_{uuid.uuid4().hex[:12]}"
+        return AIMessage(content='', tool_calls=[call], usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
+
+
+class ReplayChatModel(BaseChatModel):
+    """回放录制的计划：plans = {问题: [步骤, ...]}，步骤为 {"tool_calls": [{"name", "args"}, ...]} 或 {"answer": 文本}
+
+    本轮问题取最后一条human消息，第几步取该消息之后的AI消息数；计划用完或没有录制该问题时直接回答。
+    """
+
+    plans: dict
+
+    @property
+    def _llm_type(self):
+        return "replay"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _respond(self, messages):
+        last_human = max((i for i, m in enumerate(messages) if m.type == 'human'), default=0)
+        steps = self.plans.get(str(messages[last_human].content))
+        usage = {'input_tokens': count_tokens_approximately(messages), 'output_tokens': 20,
+                 'total_tokens': count_tokens_approximately(messages) + 20}
+        if not steps:
+            return AIMessage(content="（没有录制这个问题的计划）", usage_metadata=usage)
+
+        step_no = sum(1 for m in messages[last_human + 1:] if m.type == 'ai')
+        step = steps[min(step_no, len(steps) - 1)]
+        if step_no < len(steps) and step.get('tool_calls'):
+            calls = [{'name': c['name'], 'args': dict(c.get('args') or {}),
+                      'id': f"call_{uuid.uuid4().hex[:12]}"} for c in step['tool_calls']]
+            return AIMessage(content='', tool_calls=calls, usage_metadata=usage)
+        return AIMessage(content=step.get('answer') or "（计划中没有最终回答）", usage_metadata=usage)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=self._respond(messages))])
@@ -1,46 +1,71 @@
-from langchain_core.tools import tool
+import asyncio
+import contextvars
+import functools
+import re
+import time
+from langchain_core.tools import StructuredTool, tool
 from src.database import (
     search_games_by_name,
-    get_price_history as db_get_price_history,
-    get_price_stats,
-    get_current_deals as db_get_current_deals,
-    get_game_details_by_id,
-    vector_search as db_vector_search,
+    count_deals,
+    count_price_history,
+    filter_games as db_filter_games,
+    get_deals_page,
+    get_game_overview,
+    get_genre_names,
+    get_price_history_page,
+    hybrid_search as db_hybrid_search,
+    is_postgres,
     search_by_genre as db_search_by_genre,
 )
+from src.agent.cache import cached_tool
+from src.tracing import span as trace_span
+
+# 本轮对话中每次search_games的耗时拆分（毫秒），供ask的verbose输出，由 ask 在每轮开始时设置新列表
+SEARCH_TIMINGS = contextvars.ContextVar('search_timings', default=None)
+
+# 本轮对话中每次工具调用的 (工具名, 耗时ms)，由 ask 在每轮开始时设置新列表
+TOOL_TIMINGS = contextvars.ContextVar('tool_timings', default=None)
 
 
 @tool
 def search_games(query: str) -> str:
     """搜索数据库中的游戏，输入游戏名称关键词。支持中文简繁体、英文、发行商名等关键词。"""
-    from src.embedding import convert_to_traditional, convert_to_simplified, generate_embedding
-    import os
-
-    results_map = {}  # id -> result dict, 保持去重
-
-    # 1. 向量搜索（如果有OPENAI_API_KEY）
-    if os.environ.get('OPENAI_API_KEY'):
-        try:
-            query_embedding = generate_embedding(query)
-            vector_results = db_vector_search(query_embedding, limit=10)
-            for r in vector_results:
-                r['_source'] = 'vector'
-                r['_similarity'] = r.get('similarity', 0)
-                results_map[r['id']] = r
-        except Exception as e:
-            pass  # 向量搜索失败时回退到文本搜索
+    from src.embedding import convert_to_traditional, convert_to_simplified, embed_query, get_backend
 
-    # 2. 文本搜索（简体+繁体+原文）
+    embed_ms = db_ms = 0.0
     traditional = convert_to_traditional(query)
     simplified = convert_to_simplified(query)
 
-    for q in set([query, traditional, simplified]):
-        for r in search_games_by_name(q):
-            if r['id'] not in results_map:
-                r['_source'] = 'text'
-                results_map[r['id']] = r
+    # 1. 查询embedding（embedding后端可用时，如OpenAI需要OPENAI_API_KEY，本地后端总是可用）
+    backend = get_backend()
+    query_embedding = None
+    if is_postgres() and backend.available():
+        try:
+            t0 = time.perf_counter()
+            with trace_span('embed_query', 'embedding', backend=backend.name):
+                query_embedding = embed_query(query, backend)
+            embed_ms = (time.perf_counter() - t0) * 1000
+        except Exception as e:
+            pass  # embedding失败时只做文本搜索
+
+    t0 = time.perf_counter()
+    if is_postgres():
+        # 2. 一条SQL完成向量+文本（原文/繁体/简体）检索和RRF融合，同时带出最新价格
+        results = db_hybrid_search(query_embedding, [query, traditional, simplified], limit=20,
+                                   model=backend.name)
+    else:
+        # SQLite没有向量，只做文本搜索（简体+繁体+原文）
+        results_map = {}  # id -> result dict, 保持去重
+        for q in set([query, traditional, simplified]):
+            for r in search_games_by_name(q):
+                results_map.setdefault(r['id'], r)
+        results = list(results_map.values())
+    db_ms = (time.perf_counter() - t0) * 1000
+
+    search_timings = SEARCH_TIMINGS.get()
+    if search_timings is not None:
+        search_timings.append({'query': query, 'embedding_ms': round(embed_ms, 1), 'db_ms': round(db_ms, 1)})
 
-    results = list(results_map.values())
     if not results:
         return f"没有找到包含「{query}」的游戏。建议尝试英文名或其他关键词。"
 
@@ -60,14 +85,15 @@ def search_games(query: str) -> str:
 
 
 @tool
+@cached_tool
 def get_game_detail(game_id: int) -> str:
     """获取某个游戏的详细信息（类型、发行商、语言、折扣时间、价格历史），输入game_id。"""
-    game = get_game_details_by_id(game_id)
+    game = get_game_overview(game_id, history_limit=10)
     if not game:
         return f"找不到 game_id={game_id} 的游戏。"
 
-    history = db_get_price_history(game_id)
-    stats = get_price_stats(game_id)
+    history = game['history']
+    stats = game['stats']
 
     lines = [f"【{game['name']}】\n"]
 
@@ -102,54 +128,84 @@ def get_game_detail(game_id: int) -> str:
 
     # 价格历史
     lines.append("价格记录：")
-    for h in history[:10]:
+    for h in history:
         entry = f"  {h['scanned_at']} - HKD{h['current_price']}"
         if h['discount_percent']:
             entry += f"（原价 HKD{h['original_price']}，{h['discount_percent']}% off）"
         lines.append(entry)
 
-    if len(history) > 10:
-        lines.append(f"  ...还有 {len(history) - 10} 条更早记录")
+    if game['history_count'] > len(history):
+        lines.append(f"  ...还有 {game['history_count'] - len(history)} 条更早记录（可用 get_price_history 翻页查看）")
 
     return "\n".join(lines)
 
 
 @tool
-def get_current_deals() -> str:
-    """获取当前所有打折游戏列表，按折扣力度排序。"""
-    deals = db_get_current_deals()
+@cached_tool
+def get_current_deals(min_discount: int = 0, max_price: float = 0, cursor: str = "") -> str:
+    """获取当前打折游戏列表，按折扣力度排序，每页30个。可选 min_discount（最低折扣%）、max_price（最高现价HKD）；
+    翻页时传入上一页末尾给出的 cursor。"""
+    try:
+        deals, next_cursor = get_deals_page(limit=30, cursor=cursor or None,
+                                            min_discount=min_discount, max_price=max_price)
+    except ValueError as e:
+        return f"{e}。不传 cursor 可从第一页开始。"
     if not deals:
-        return "当前没有打折游戏。"
+        return "没有更多折扣游戏了。" if cursor else "当前没有符合条件的打折游戏。"
 
-    lines = [f"当前共 {len(deals)} 个折扣游戏（按折扣力度排序）：\n"]
-    for i, d in enumerate(deals[:30]):
+    lines = []
+    if not cursor:
+        total = count_deals(min_discount=min_discount, max_price=max_price)
+        lines.append(f"当前共 {total} 个折扣游戏（按折扣力度排序）：\n")
+    for d in deals:
         lines.append(
-            f"{i+1}. {d['name']} - HKD{d['current_price']}"
+            f"- [ID:{d['id']}] {d['name']} - HKD{d['current_price']}"
             f"（原价 HKD{d['original_price']}，{d['discount_percent']}% off）"
         )
 
-    if len(deals) > 30:
-        lines.append(f"\n...还有 {len(deals) - 30} 个折扣游戏")
+    if next_cursor:
+        lines.append(f"\n还有更多折扣游戏，下一页 cursor=\"{next_cursor}\"")
 
     return "\n".join(lines)
 
 
 @tool
-def search_by_genre(genre: str) -> str:
-    """按游戏类型搜索，如角色扮演、动作、模擬、益智、冒險、派對等。"""
-    from src.embedding import convert_to_traditional
+@cached_tool
+def get_price_history(game_id: int, cursor: str = "") -> str:
+    """分页查看某个游戏的完整价格记录（每页20条，从新到旧），输入game_id；翻页时传入上一页给出的 cursor。"""
+    try:
+        history, next_cursor = get_price_history_page(game_id, limit=20, cursor=cursor or None)
+    except ValueError as e:
+        return f"{e}。不传 cursor 可从最新记录开始。"
+    if not history:
+        return "没有更早的价格记录了。" if cursor else f"game_id={game_id} 没有价格记录。"
+
+    lines = []
+    if not cursor:
+        lines.append(f"共 {count_price_history(game_id)} 条价格记录：")
+    for h in history:
+        entry = f"  {h['scanned_at']} - HKD{h['current_price']}"
+        if h['discount_percent']:
+            entry += f"（原价 HKD{h['original_price']}，{h['discount_percent']}% off）"
+        lines.append(entry)
+
+    if next_cursor:
+        lines.append(f"还有更早记录，下一页 cursor=\"{next_cursor}\"")
 
-    # 简→繁转换（数据库中类型是繁体）
-    genre_t = convert_to_traditional(genre)
+    return "\n".join(lines)
 
-    results = []
-    for q in set([genre, genre_t]):
-        for r in db_search_by_genre(q):
-            if not any(x['id'] == r['id'] for x in results):
-                results.append(r)
+
+@tool
+@cached_tool
+def search_by_genre(genre: str) -> str:
+    """按游戏类型搜索，如角色扮演、动作、模擬、益智、冒險、派對等，也接受类型名的开头或带后缀的写法（如"角色"、"RPG游戏"）。"""
+    # 类型字典已包含简体/繁体/英文写法，不完整的写法在别名表里按前缀/包含匹配，一次查询即可
+    results = db_search_by_genre(genre)
 
     if not results:
-        return f"没有找到类型包含「{genre}」的游戏。"
+        names = get_genre_names()
+        hint = f"已有的类型：{'、'.join(names[:30])}" if names else "类型数据还没有建立。"
+        return f"没有找到「{genre}」类型的游戏。{hint}"
 
     lines = [f"找到 {len(results)} 个「{genre}」类游戏：\n"]
     for r in results:
@@ -162,28 +218,115 @@ def search_by_genre(genre: str) -> str:
 
 
 @tool
-def search_metacritic(game_name: str) -> str:
-    """搜索游戏的Metacritic评分，输入游戏英文名。"""
-    from ddgs import DDGS
-
-    query = f"metacritic {game_name} nintendo switch score"
+@cached_tool
+def filter_games(language: str = "", players: int = 0, max_price: float = 0, min_discount: int = 0,
+                 on_sale: bool = False, genre: str = "") -> str:
+    """按条件筛选游戏（条件可任意组合）：language 支持的语言（如"中文"、"中文,英文"），players 支持的人数（如双人=2），
+    max_price 最高现价HKD，min_discount 最低折扣%，on_sale 只看打折中的，genre 类型（如角色扮演、派對）。"""
+    languages = [x.strip() for x in re.split(r'[,，、/]', language) if x.strip()]
+    genres = [genre.strip()] if genre.strip() else []
     try:
-        with DDGS() as ddgs:
-            results = list(ddgs.text(query, max_results=3))
-    except Exception as e:
-        return f"搜索失败: {e}"
+        results = db_filter_games(languages=languages, players=players or None, max_price=max_price or None,
+                                  min_discount=min_discount or None, on_sale=on_sale, genres=genres, limit=20)
+    except ValueError as e:
+        return f"{e}。可用的语言如：中文、繁體中文、简体中文、英文、日文、韓文。"
 
     if not results:
-        return f"没有找到「{game_name}」的Metacritic评分信息。"
+        return "没有找到符合条件的游戏，可以放宽部分条件再试。"
 
-    lines = [f"Metacritic搜索结果（{game_name}）：\n"]
+    lines = [f"找到 {len(results)} 个符合条件的游戏（折扣大的优先，最多20个）：\n"]
     for r in results:
-        lines.append(f"- {r['title']}")
-        lines.append(f"  {r['body']}")
-        lines.append(f"  链接: {r['href']}")
-        lines.append("")
+        price_info = f"HKD{r['current_price']}"
+        if r.get('discount_percent'):
+            price_info += f"（原价 HKD{r['original_price']}，{r['discount_percent']}% off）"
+        lines.append(f"- [ID:{r['id']}] {r['name']} [{r.get('genre') or ''}] {r.get('players') or '?'}人"
+                     f" - {price_info}")
+    return "\n".join(lines)
+
 
+@tool
+def search_metacritic(game_name: str, game_id: int = 0) -> str:
+    """查询游戏的Metacritic评分，输入游戏名（英文名更准确），已知game_id时一并传入。优先读取评分缓存。"""
+    from src.scores import cached_score, fetch_and_save, get_score_provider
+
+    # 没给game_id时，只有名称与库中某个游戏完全一致才走缓存；子串匹配（如 Hades → Hades II）不算，直接实时查询且不写缓存
+    if not game_id:
+        exact = [m for m in search_games_by_name(game_name)
+                 if m['name'].strip().lower() == game_name.strip().lower()]
+        if len(exact) == 1:
+            game_id = exact[0]['id']
+
+    # 缓存的"没有分数"在较短的有效期（METACRITIC_EMPTY_TTL_DAYS）内直接返回，过期后才用模型给的名称重新查
+    score = cached_score(game_id) if game_id else None
+    if score is None:
+        score = fetch_and_save(game_id, game_name) if game_id else get_score_provider().lookup(game_name)
+    if score is None:
+        return f"评分查询失败，请稍后再试（{game_name}）。"
+
+    if score.get('metascore') is None and score.get('user_score') is None:
+        if score.get('snippet'):
+            return f"没有解析到「{game_name}」的Metacritic评分，搜索摘要：\n{score['snippet']}\n链接: {score['url']}"
+        return f"没有找到「{game_name}」的Metacritic评分信息。"
+
+    lines = [f"Metacritic评分（{game_name}）："]
+    if score.get('metascore') is not None:
+        lines.append(f"- Metascore（媒体评分）: {score['metascore']}/100")
+    if score.get('user_score') is not None:
+        lines.append(f"- 用户评分: {score['user_score']}/10")
+    if score.get('url'):
+        lines.append(f"- 链接: {score['url']}")
+    if score.get('fetched_at'):
+        lines.append(f"- 数据时间: {str(score['fetched_at'])[:10]}")
     return "\n".join(lines)
 
 
-ALL_TOOLS = [search_games, get_game_detail, get_current_deals, search_by_genre, search_metacritic]
+def _record_timing(name, t0):
+    timings = TOOL_TIMINGS.get()
+    if timings is not None:
+        timings.append((name, (time.perf_counter() - t0) * 1000))
+
+
+def _run_traced(name, func, *args, **kwargs):
+    """执行工具函数，在trace内时记录tool span（参数和输出长度），其中的数据库函数成为子span"""
+    with trace_span(name, 'tool', args=kwargs) as s:
+        result = func(*args, **kwargs)
+        if s is not None:
+            s.attrs['output_chars'] = len(str(result))
+        return result
+
+
+def with_async(sync_tool):
+    """给同步工具加上协程版本，使ReAct Agent能并发执行同一轮的多个工具调用。
+
+    数据库驱动（psycopg2/sqlite3）是同步的，且每个查询函数自己开连接，
+    所以协程版本把工具函数放到线程池执行，不阻塞事件循环。两个版本都记录耗时到 TOOL_TIMINGS。
+    """
+    func = sync_tool.func
+    name = sync_tool.name
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return _run_traced(name, func, *args, **kwargs)
+        finally:
+            _record_timing(name, t0)
+
+    async def coroutine(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await asyncio.to_thread(_run_traced, name, func, *args, **kwargs)
+        finally:
+            _record_timing(name, t0)
+
+    return StructuredTool.from_function(
+        func=timed,
+        coroutine=coroutine,
+        name=name,
+        description=sync_tool.description,
+        args_schema=sync_tool.args_schema,
+    )
+
+
+ALL_TOOLS = [with_async(t) for t in (search_games, get_game_detail, get_current_deals, get_price_history,
+                                     search_by_genre, filter_games, search_metacritic)]
@@ -1,6 +1,65 @@
+import os
+
 BASE_URL = "https://store.nintendo.com.hk"
 LIST_URL_TEMPLATE = "/download-code?label_platform=4580&p={page}&product_list_limit=48"
 SALE_URL = "/download-code/sale"
 DB_PATH = "data/eshop.db"
 MIN_DELAY = 3  # 秒
 MAX_DELAY = 5
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIMENSIONS = 1536  # 与game_details.name_embedding的vector(1536)一致
+EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'openai')  # openai | local（本地n-gram哈希，无需网络）
+QUERY_EMBEDDING_CACHE_SIZE = 512  # 查询embedding LRU缓存条数
+QUERY_EMBEDDING_CACHE_TTL = 7 * 24 * 3600  # 秒
+QUERY_EMBEDDING_CACHE_PATH = os.environ.get('QUERY_EMBEDDING_CACHE_PATH')  # 设置后进程退出时持久化到该JSON文件
+EMBEDDING_BATCH_TOKENS = 50000  # 每个请求的估算token上限（API上限30万）
+EMBEDDING_BATCH_MAX_ITEMS = 2048  # 每个请求的input条数上限（API上限）
+EMBEDDING_CONCURRENCY = 4  # 同时在途的请求数
+EMBEDDING_RPM = 3000  # 每分钟请求数预算
+EMBEDDING_TPM = 1000000  # 每分钟token预算
+# 低精度向量 + 两阶段搜索：none | halfvec（float16）| binary（符号位）
+EMBEDDING_QUANTIZATION = os.environ.get('EMBEDDING_QUANTIZATION', 'none')
+EMBEDDING_SEARCH_DIMS = int(os.environ.get('EMBEDDING_SEARCH_DIMS', '0')) or None  # 第一阶段截断到前N维（None=不截断）
+EMBEDDING_RERANK_OVERSAMPLE = 4  # 第一阶段取 limit*该倍数 个候选，再用完整向量精排
+SEARCH_TEXT_PARALLEL_THRESHOLD = 5000  # 超过该数量时用进程池构建search_text
+SEARCH_TEXT_CHUNK_SIZE = 1000  # 进程池每个任务的游戏数
+HYBRID_RRF_K = 60  # 混合搜索倒数排名融合常数：score = Σ 1/(k + rank)
+HYBRID_CANDIDATES = 50  # 向量/文本各自取多少个候选参与融合
+
+# 详情页刷新调度
+DETAIL_REFRESH_BUDGET = 100  # 每次运行最多爬取的详情页数（新游戏+刷新）
+DETAIL_STALE_DAYS = 30  # updated_at超过该天数视为完全过期
+DETAIL_MIN_REFRESH_HOURS = 24  # 距上次刷新不足该小时数的游戏不参与刷新
+SALE_END_URGENT_HOURS = 48  # sale_end在该小时数内视为即将结束
+HKT_OFFSET_HOURS = 8  # 网站显示的sale_start/sale_end为香港时间
+
+# 折扣窗口定向复查
+SALE_RECHECK_SETTLE_MINUTES = 10  # sale_start/sale_end过后等待该分钟数再复查（网站切换有延迟）
+SALE_TARGETED_MAX_PAGES = 40  # 定向复查超过该页数时退回全量扫描减价页
+
+# Agent工具结果缓存（数据版本号变化时整体失效）
+TOOL_CACHE_SIZE = 256  # 缓存条数
+TOOL_CACHE_VERSION_CHECK_SECONDS = 30  # 最多每隔这么久查一次数据版本号
+
+# Agent对话记忆
+AGENT_MEMORY_PATH = os.environ.get('AGENT_MEMORY_PATH', 'data/agent_memory.db')  # SQLite checkpointer文件，设为空则只存内存
+AGENT_CONTEXT_MAX_TOKENS = 8000  # 每轮送给模型的历史消息上限（估算token，不含system prompt）
+AGENT_OLD_TOOL_OUTPUT_CHARS = 500  # 之前轮次的工具输出截断到该字数
+
+# Agent追踪（模型/工具/数据库函数的耗时和token用量）
+AGENT_TRACE_EXPORTER = os.environ.get('AGENT_TRACE_EXPORTER', 'jsonl')  # jsonl | otel
+AGENT_TRACE_PATH = os.environ.get('AGENT_TRACE_PATH', '')  # jsonl追踪文件，为空则不记录（otel时不需要）
+
+# Metacritic评分缓存
+METACRITIC_PROVIDER = os.environ.get('METACRITIC_PROVIDER', 'ddgs')  # ddgs（DuckDuckGo搜索）| local（本地JSON替身）
+METACRITIC_LOCAL_PATH = os.environ.get('METACRITIC_LOCAL_PATH', 'data/metacritic_scores.json')  # local替身的数据文件
+METACRITIC_SCORE_TTL_DAYS = 14  # 评分缓存有效期
+METACRITIC_EMPTY_TTL_DAYS = 3  # 没查到分数的缓存有效期，过期后才重新查询
+METACRITIC_RPM = 20  # 评分查询每分钟请求上限
+METACRITIC_BATCH_LIMIT = 200  # 批量任务每次最多查询的游戏数
+
+# HTTP API
+API_MAX_CONCURRENT_ASKS = 8  # 同时执行的Agent提问数（LLM调用并发上限）
+API_MAX_PENDING_ASKS = 32  # 排队等待的提问数上限，超过直接返回503
+API_ASK_TIMEOUT = 60  # 单次提问超时（秒），超时返回504
+API_DB_POOL_SIZE = 10  # PG连接池大小，也是数据库查询线程数
@@ -1,29 +1,133 @@
+import json
 import os
 import re
 import sqlite3
-from src.config import DB_PATH
+import threading
+from src.config import (
+    DB_PATH, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS,
+    EMBEDDING_QUANTIZATION, EMBEDDING_SEARCH_DIMS, EMBEDDING_RERANK_OVERSAMPLE,
+    HYBRID_RRF_K, HYBRID_CANDIDATES,
+)
+from src.facets import canonical_genre, game_facets, genre_aliases, genre_key, language_query_masks
+from src.fingerprint import DETAIL_FIELDS, detail_hash, listing_hash
+from src.tracing import traced
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 _use_pg = bool(DATABASE_URL)
+_db_path = DB_PATH
+_pool = None  # enable_pool() 之后PG连接从连接池借用
 
 if _use_pg:
     import psycopg2
     import psycopg2.extras
 
 
+class _PooledConnection:
+    """从连接池借出的连接：close() 时回滚未提交的事务并归还连接池，其余属性透传"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        self._pool.release(conn, broken)
+
+
+class _BlockingPool:
+    """线程安全的PG连接池，连接用完时阻塞等待（psycopg2自带的池会直接报错）"""
+
+    def __init__(self, minconn, maxconn):
+        import psycopg2.pool
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, DATABASE_URL)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self.maxconn = maxconn
+
+    def acquire(self):
+        self._slots.acquire()
+        try:
+            return _PooledConnection(self, self._pool.getconn())
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        try:
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._pool.closeall()
+
+
+def enable_pool(minconn=1, maxconn=10):
+    """长驻的多线程进程（如HTTP服务）调用：PG连接改为从共享连接池借用，不再每次查询新建连接。
+
+    SQLite本地文件连接开销很小，不使用连接池。
+    """
+    global _pool
+    if _use_pg and _pool is None:
+        _pool = _BlockingPool(minconn, maxconn)
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+_query_listener = None  # SQLite每条语句的回调（基准测试统计查询数），见 set_query_listener
+
+
+def set_query_listener(listener):
+    """设置SQLite语句回调 listener(sql)，之后新开的连接执行的每条语句都会回调；None取消"""
+    global _query_listener
+    _query_listener = listener
+
+
 def _get_conn():
     if _use_pg:
+        if _pool is not None:
+            return _pool.acquire()
         conn = psycopg2.connect(DATABASE_URL)
         return conn
     else:
-        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        conn = sqlite3.connect(DB_PATH)
+        os.makedirs(os.path.dirname(_db_path) or '.', exist_ok=True)
+        conn = sqlite3.connect(_db_path)
         conn.row_factory = sqlite3.Row
         conn.execute("PRAGMA journal_mode=WAL")
         conn.execute("PRAGMA foreign_keys=ON")
+        if _query_listener is not None:
+            conn.set_trace_callback(_query_listener)
         return conn
 
 
+def use_sqlite(path):
+    """切换到指定路径的SQLite（即使设置了DATABASE_URL），用于本地spool扫描"""
+    global _use_pg, _db_path
+    _use_pg = False
+    _db_path = path
+
+
+def is_postgres():
+    """当前是否使用PostgreSQL后端（向量相关功能只在PG上可用）"""
+    return _use_pg
+
+
 def _placeholder():
     """返回当前后端的参数占位符"""
     return '%s' if _use_pg else '?'
@@ -56,6 +160,13 @@ def _fetchall_dict(cursor):
         return [dict(row) for row in cursor.fetchall()]
 
 
+def _ensure_sqlite_column(conn, table, column, decl):
+    """SQLite不支持 ADD COLUMN IF NOT EXISTS，先查表结构再补列"""
+    cols = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column not in cols:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
 def init_db():
     """创建三张表（如不存在）"""
     conn = _get_conn()
@@ -122,6 +233,114 @@ def init_db():
                 updated_at TIMESTAMP DEFAULT NOW()
             )
         """)
+        # 内容指纹：未变化的列表项/详情跳过写入
+        cur.execute("ALTER TABLE games ADD COLUMN IF NOT EXISTS listing_hash TEXT")
+        cur.execute("ALTER TABLE game_details ADD COLUMN IF NOT EXISTS content_hash TEXT")
+        cur.execute("ALTER TABLE game_details ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP")
+        # 生成name_embedding的后端/模型（NULL为最初的OpenAI模型）
+        cur.execute("ALTER TABLE game_details ADD COLUMN IF NOT EXISTS embedding_model TEXT")
+        # 数据版本号：扫描脚本提交后+1，查询缓存据此失效
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        cur.execute("INSERT INTO data_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING")
+        # Metacritic评分缓存（批量任务预取，工具优先读表）
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS game_scores (
+                game_id INTEGER PRIMARY KEY REFERENCES games(id),
+                metascore INTEGER,
+                user_score REAL,
+                source TEXT,
+                url TEXT,
+                fetched_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        # checked_at: 最近一次查询时间（没查到分数时只更新它）；query_name: 查到分数时使用的查询名
+        cur.execute("""
+            ALTER TABLE game_scores
+            ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP,
+            ADD COLUMN IF NOT EXISTS query_name TEXT
+        """)
+        # 筛选维度：从 languages/players/genre 文本解析（见 src/facets.py），供 filter_games 使用
+        cur.execute("""
+            ALTER TABLE game_details
+            ADD COLUMN IF NOT EXISTS language_mask INTEGER,
+            ADD COLUMN IF NOT EXISTS min_players INTEGER,
+            ADD COLUMN IF NOT EXISTS max_players INTEGER
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_game_details_players ON game_details(max_players, min_players)
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS game_genres (
+                game_id INTEGER NOT NULL REFERENCES games(id),
+                genre TEXT NOT NULL,
+                PRIMARY KEY (game_id, genre)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_game_genres_genre ON game_genres(genre, game_id)")
+        # 每个游戏的当前价格（price_history最新一条），写价格时同步维护，折扣计数不必扫描整个价格历史；
+        # checked_at 为最近一次确认该价格的时间（同一天同价格不重复写价格记录时也会更新）
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS current_prices (
+                game_id INTEGER PRIMARY KEY REFERENCES games(id),
+                current_price REAL NOT NULL,
+                original_price REAL,
+                discount_percent INTEGER,
+                checked_at TIMESTAMP
+            )
+        """)
+        cur.execute("ALTER TABLE current_prices ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_current_prices_deals ON current_prices(discount_percent DESC, game_id)
+        """)
+        # 类型字典：规范类型名 + 各种写法（简体/繁体/英文）的别名，类型查询先按别名找到规范名再走 game_genres 索引
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS genres (
+                name TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS genre_aliases (
+                alias TEXT PRIMARY KEY,
+                genre TEXT NOT NULL REFERENCES genres(name)
+            )
+        """)
+        # 混合搜索的文本部分：trigram索引同时加速 ILIKE '%x%' 和相似度排序
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_games_name_trgm ON games USING gin (name gin_trgm_ops)
+        """)
+        # 低精度向量（pgvector >= 0.7），用于两阶段搜索的第一阶段
+        if EMBEDDING_QUANTIZATION != 'none':
+            cur.execute(f"""
+                ALTER TABLE game_details
+                ADD COLUMN IF NOT EXISTS name_embedding_half halfvec({EMBEDDING_DIMENSIONS}),
+                ADD COLUMN IF NOT EXISTS name_embedding_bin bit({EMBEDDING_DIMENSIONS})
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_game_details_embedding_half ON game_details
+                USING hnsw (name_embedding_half halfvec_cosine_ops)
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_game_details_embedding_bin ON game_details
+                USING hnsw (name_embedding_bin bit_hamming_ops)
+            """)
+        # embedding缓存：相同模型+相同文本不再重复请求API
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                model TEXT NOT NULL,
+                text_hash CHAR(64) NOT NULL,
+                embedding vector(1536) NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (model, text_hash)
+            )
+        """)
         conn.commit()
     else:
         conn.executescript("""
@@ -157,8 +376,86 @@ def init_db():
             );
             CREATE INDEX IF NOT EXISTS idx_alerts_created ON price_alerts(created_at DESC);
         """)
+        _ensure_sqlite_column(conn, 'games', 'listing_hash', 'TEXT')
+        # game_details（无向量列），供本地开发和Agent查询函数使用
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS game_details (
+                game_id INTEGER PRIMARY KEY REFERENCES games(id),
+                description TEXT,
+                genre TEXT,
+                publisher TEXT,
+                release_date DATE,
+                languages TEXT,
+                players TEXT,
+                sale_start TIMESTAMP,
+                sale_end TIMESTAMP,
+                search_text TEXT,
+                content_hash TEXT,
+                checked_at TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        for column in ('language_mask', 'min_players', 'max_players'):
+            _ensure_sqlite_column(conn, 'game_details', column, 'INTEGER')
+        conn.executescript("""
+            CREATE INDEX IF NOT EXISTS idx_game_details_players ON game_details(max_players, min_players);
+
+            CREATE TABLE IF NOT EXISTS game_genres (
+                game_id INTEGER NOT NULL REFERENCES games(id),
+                genre TEXT NOT NULL,
+                PRIMARY KEY (game_id, genre)
+            );
+            CREATE INDEX IF NOT EXISTS idx_game_genres_genre ON game_genres(genre, game_id);
+
+            CREATE TABLE IF NOT EXISTS current_prices (
+                game_id INTEGER PRIMARY KEY REFERENCES games(id),
+                current_price REAL NOT NULL,
+                original_price REAL,
+                discount_percent INTEGER,
+                checked_at TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_current_prices_deals ON current_prices(discount_percent DESC, game_id);
+
+            CREATE TABLE IF NOT EXISTS genres (
+                name TEXT PRIMARY KEY,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE TABLE IF NOT EXISTS genre_aliases (
+                alias TEXT PRIMARY KEY,
+                genre TEXT NOT NULL REFERENCES genres(name)
+            );
+        """)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0);
+
+            CREATE TABLE IF NOT EXISTS game_scores (
+                game_id INTEGER PRIMARY KEY REFERENCES games(id),
+                metascore INTEGER,
+                user_score REAL,
+                source TEXT,
+                url TEXT,
+                fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        _ensure_sqlite_column(conn, 'game_scores', 'checked_at', 'TIMESTAMP')
+        _ensure_sqlite_column(conn, 'current_prices', 'checked_at', 'TIMESTAMP')
+        _ensure_sqlite_column(conn, 'game_scores', 'query_name', 'TEXT')
         conn.commit()
 
+    # 旧库刚加上 current_prices 时从 price_history 补齐
+    cur.execute("SELECT 1 FROM current_prices LIMIT 1")
+    if cur.fetchone() is None:
+        cur.execute("SELECT 1 FROM price_history LIMIT 1")
+        if cur.fetchone() is not None:
+            _refresh_current_prices(cur)
+            conn.commit()
+
     cur.close()
     conn.close()
 
@@ -177,31 +474,49 @@ def _extract_product_id(pid):
     return match.group(1) if match else pid
 
 
-def upsert_game(game_data):
-    """插入或更新游戏信息，返回game_id"""
+def upsert_game(game_data, return_changed=False):
+    """插入或更新游戏信息，返回game_id。
+
+    列表项指纹（名称/链接/图片/价格）未变化时跳过UPDATE。
+    return_changed=True 时返回 (game_id, changed)，新游戏视为changed；changed=False 说明价格与上次写入时相同，
+    调用方跳过 detect_changes/insert_price，改为用 mark_prices_checked 记录检查时间。
+    """
     conn = _get_conn()
     cur = conn.cursor()
     p = _placeholder()
     eshop_id = _extract_eshop_id(game_data['url'])
     product_id = _extract_product_id(game_data.get('pid'))
+    item_hash = listing_hash(game_data)
+    changed = True
 
     # 检查是否已存在
-    cur.execute(f"SELECT id FROM games WHERE eshop_id = {p}", (eshop_id,))
-    row = cur.fetchone()
+    cur.execute(f"SELECT id, name, listing_hash FROM games WHERE eshop_id = {p}", (eshop_id,))
+    row = _fetchone_dict(cur)
 
     if row:
-        game_id = row[0] if _use_pg else row['id']
-        cur.execute(f"""
-            UPDATE games SET name = {p}, image_url = {p}, updated_at = CURRENT_TIMESTAMP
-            WHERE eshop_id = {p}
-        """, (game_data['name'], game_data.get('img'), eshop_id))
-        conn.commit()
+        game_id = row['id']
+        if row['listing_hash'] == item_hash:
+            changed = False
+        else:
+            cur.execute(f"""
+                UPDATE games SET name = {p}, image_url = {p}, listing_hash = {p},
+                       updated_at = CURRENT_TIMESTAMP
+                WHERE eshop_id = {p}
+            """, (game_data['name'], game_data.get('img'), item_hash, eshop_id))
+            if _use_pg and row['name'] != game_data['name']:
+                # 改名后search_text/embedding需要重建
+                cur.execute(f"""
+                    UPDATE game_details SET search_text = NULL, {embedding_reset_sql()}
+                    WHERE game_id = {p}
+                """, (game_id,))
+            conn.commit()
     else:
         cur.execute(f"""
-            INSERT INTO games (eshop_id, name, url, image_url, magento_product_id)
-            VALUES ({p}, {p}, {p}, {p}, {p})
+            INSERT INTO games (eshop_id, name, url, image_url, magento_product_id, listing_hash)
+            VALUES ({p}, {p}, {p}, {p}, {p}, {p})
             {'RETURNING id' if _use_pg else ''}
-        """, (eshop_id, game_data['name'], game_data['url'], game_data.get('img'), product_id))
+        """, (eshop_id, game_data['name'], game_data['url'], game_data.get('img'),
+              product_id, item_hash))
         conn.commit()
         if _use_pg:
             game_id = cur.fetchone()[0]
@@ -210,11 +525,13 @@ def upsert_game(game_data):
 
     cur.close()
     conn.close()
+    if return_changed:
+        return game_id, changed
     return game_id
 
 
 def insert_price(game_id, current_price, original_price):
-    """插入价格记录（同一天同一价格不重复）"""
+    """插入价格记录（同一天同一价格不重复，只更新 current_prices.checked_at）"""
     conn = _get_conn()
     cur = conn.cursor()
     p = _placeholder()
@@ -234,6 +551,9 @@ def insert_price(game_id, current_price, original_price):
 
     existing = cur.fetchone()
     if existing:
+        # 价格没变也记下这次检查，定向复查据此判断折扣切换后已经看过
+        cur.execute(f"UPDATE current_prices SET checked_at = CURRENT_TIMESTAMP WHERE game_id = {p}", (game_id,))
+        conn.commit()
         cur.close()
         conn.close()
         return
@@ -246,6 +566,21 @@ def insert_price(game_id, current_price, original_price):
         INSERT INTO price_history (game_id, current_price, original_price, discount_percent)
         VALUES ({p}, {p}, {p}, {p})
     """, (game_id, current_price, original_price, discount_percent))
+    _refresh_current_prices(cur, [game_id])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def mark_prices_checked(game_ids):
+    """批量记录这些游戏的价格已确认未变（更新 current_prices.checked_at），不写价格记录"""
+    if not game_ids:
+        return
+    conn = _get_conn()
+    cur = conn.cursor()
+    p = _placeholder()
+    cur.executemany(f"UPDATE current_prices SET checked_at = CURRENT_TIMESTAMP WHERE game_id = {p}",
+                    [(game_id,) for game_id in game_ids])
     conn.commit()
     cur.close()
     conn.close()
@@ -305,8 +640,119 @@ def save_alerts(alerts):
     conn.close()
 
 
+def get_discounted_games_missing(items):
+    """集合差：最新价格仍为打折、但不在本次扫描列表项中的游戏（一次查询）"""
+    eshop_ids = sorted({_extract_eshop_id(item['url']) for item in items})
+    conn = _get_conn()
+    cur = conn.cursor()
+
+    if _use_pg:
+        cur.execute("""
+            SELECT g.id, g.eshop_id, g.name, ph.current_price, ph.original_price
+            FROM games g
+            JOIN LATERAL (
+                SELECT current_price, original_price, discount_percent
+                FROM price_history
+                WHERE game_id = g.id
+                ORDER BY scanned_at DESC
+                LIMIT 1
+            ) ph ON true
+            WHERE ph.original_price IS NOT NULL AND ph.discount_percent IS NOT NULL
+              AND NOT (g.eshop_id = ANY(%s))
+        """, (eshop_ids,))
+    else:
+        cur.execute("""
+            SELECT g.id, g.eshop_id, g.name, ph.current_price, ph.original_price
+            FROM games g
+            JOIN price_history ph ON ph.id = (
+                SELECT id FROM price_history
+                WHERE game_id = g.id
+                ORDER BY scanned_at DESC
+                LIMIT 1
+            )
+            WHERE ph.original_price IS NOT NULL AND ph.discount_percent IS NOT NULL
+              AND g.eshop_id NOT IN (SELECT value FROM json_each(?))
+        """, (json.dumps(eshop_ids),))
+
+    results = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+    return results
+
+
+def record_sales_ended(games, alerts):
+    """批量写入折扣结束的价格记录（恢复原价）和alerts，一个事务完成。
+
+    同时清空这些游戏的listing_hash，下次在列表中出现时重新比对价格。
+    """
+    if not games:
+        return
+    conn = _get_conn()
+    cur = conn.cursor()
+    p = _placeholder()
+
+    cur.executemany(f"""
+        INSERT INTO price_history (game_id, current_price, original_price, discount_percent)
+        VALUES ({p}, {p}, NULL, NULL)
+    """, [(g['id'], g['original_price']) for g in games])
+    cur.executemany(f"""
+        INSERT INTO price_alerts (game_id, alert_type, old_price, new_price)
+        VALUES ({p}, {p}, {p}, {p})
+    """, [(a['game_id'], a['alert_type'], a['old_price'], a['new_price']) for a in alerts])
+    cur.executemany(f"UPDATE games SET listing_hash = NULL WHERE id = {p}",
+                    [(g['id'],) for g in games])
+    _refresh_current_prices(cur, [g['id'] for g in games])
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def clear_listing_hash(game_ids):
+    """清空游戏的listing_hash（价格不是从列表页写入时调用），下次在列表中出现时重新比对价格"""
+    if not game_ids:
+        return
+    conn = _get_conn()
+    cur = conn.cursor()
+    p = _placeholder()
+    cur.executemany(f"UPDATE games SET listing_hash = NULL WHERE id = {p}",
+                    [(game_id,) for game_id in game_ids])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def bump_data_version():
+    """扫描/爬取写入完成后调用：数据版本号+1，使查询缓存失效。返回新版本号"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE data_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+    """)
+    conn.commit()
+    cur.execute("SELECT version FROM data_version WHERE id = 1")
+    version = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return version
+
+
+@traced('db')
+def get_data_version():
+    """当前数据版本号"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT version FROM data_version WHERE id = 1")
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    return row[0] if row else 0
+
+
 # === Agent 查询函数 ===
 
+@traced('db')
 def search_games_by_name(query):
     """模糊搜索游戏名称，返回匹配的游戏列表（含最新价格和折扣信息）"""
     conn = _get_conn()
@@ -407,6 +853,182 @@ def get_current_deals():
     return results
 
 
+def _latest_price_join(left=False):
+    """每个游戏最新一条价格记录的JOIN子句（别名ph）；left=True 时保留没有价格记录的游戏"""
+    join = 'LEFT JOIN' if left else 'JOIN'
+    if _use_pg:
+        return f"""
+            {join} LATERAL (
+                SELECT current_price, original_price, discount_percent, scanned_at
+                FROM price_history
+                WHERE game_id = g.id
+                ORDER BY scanned_at DESC
+                LIMIT 1
+            ) ph ON true
+        """
+    return f"""
+            {join} price_history ph ON ph.id = (
+                SELECT id FROM price_history
+                WHERE game_id = g.id
+                ORDER BY scanned_at DESC
+                LIMIT 1
+            )
+        """
+
+
+def _refresh_current_prices(cur, game_ids=None):
+    """按 price_history 最新一条重写 current_prices（game_ids为None时全部）"""
+    p = _placeholder()
+    select = f"""
+        INSERT INTO current_prices (game_id, current_price, original_price, discount_percent, checked_at)
+        SELECT g.id, ph.current_price, ph.original_price, ph.discount_percent, ph.scanned_at
+        FROM games g
+        {_latest_price_join()}
+    """
+    if game_ids is None:
+        cur.execute("DELETE FROM current_prices")
+        cur.execute(select)
+        return
+    ids = [(game_id,) for game_id in game_ids]
+    cur.executemany(f"DELETE FROM current_prices WHERE game_id = {p}", ids)
+    cur.executemany(select + f" WHERE g.id = {p}", ids)
+
+
+def rebuild_current_prices():
+    """全量重建 current_prices（绕过 insert_price 直接写入 price_history 后运行）"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    _refresh_current_prices(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def _deal_filters(min_discount=None, max_price=None):
+    """折扣查询的WHERE条件和参数"""
+    p = _placeholder()
+    conditions = ["ph.original_price IS NOT NULL", "ph.discount_percent IS NOT NULL"]
+    params = []
+    if min_discount:
+        conditions.append(f"ph.discount_percent >= {p}")
+        params.append(min_discount)
+    if max_price:
+        conditions.append(f"ph.current_price <= {p}")
+        params.append(max_price)
+    return conditions, params
+
+
+def _parse_cursor(cursor, sep, types):
+    """解析 "a<sep>b" 形式的分页cursor，格式不对时抛 ValueError"""
+    parts = cursor.rsplit(sep, len(types) - 1)
+    try:
+        if len(parts) != len(types):
+            raise ValueError
+        return [t(x) for t, x in zip(types, parts)]
+    except ValueError:
+        raise ValueError(f"无效的cursor: {cursor!r}（请使用上一页返回的 next_cursor）") from None
+
+
+@traced('db')
+def get_deals_page(limit=30, cursor=None, min_discount=None, max_price=None):
+    """分页获取当前打折游戏（读 current_prices，与 count_deals 同一数据源），
+    按 (折扣力度降序, id) 做keyset分页，排序和LIMIT都在SQL里完成，走 idx_current_prices_deals。
+
+    cursor 为上一页返回的 next_cursor（"折扣:id"），返回 (rows, next_cursor)，没有下一页时 next_cursor 为None。
+    cursor 格式不对时抛 ValueError。
+    """
+    p = _placeholder()
+    conditions, params = _deal_filters(min_discount, max_price)
+    if cursor:
+        discount, last_id = _parse_cursor(cursor, ':', (int, int))
+        conditions.append(f"(ph.discount_percent < {p} OR (ph.discount_percent = {p} AND ph.game_id > {p}))")
+        params.extend([discount, discount, last_id])
+
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT g.id, g.name, ph.current_price, ph.original_price, ph.discount_percent
+        FROM current_prices ph
+        JOIN games g ON g.id = ph.game_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY ph.discount_percent DESC, ph.game_id
+        LIMIT {p}
+    """, params + [limit + 1])
+    rows = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['discount_percent']}:{rows[-1]['id']}"
+    return rows, next_cursor
+
+
+@traced('db')
+def count_deals(min_discount=None, max_price=None):
+    """当前打折游戏总数（与 get_deals_page 同样的筛选条件），从 current_prices 计数，不扫描价格历史"""
+    conditions, params = _deal_filters(min_discount, max_price)
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COUNT(*)
+        FROM current_prices ph
+        WHERE {' AND '.join(conditions)}
+    """, params)
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return count
+
+
+@traced('db')
+def get_price_history_page(game_id, limit=20, cursor=None):
+    """分页获取某游戏的价格记录，按 (scanned_at, id) 倒序做keyset分页。
+
+    cursor 为上一页返回的 next_cursor（"scanned_at|id"），返回 (rows, next_cursor)。cursor 格式不对时抛 ValueError。
+    """
+    p = _placeholder()
+    conditions = [f"game_id = {p}"]
+    params = [game_id]
+    if cursor:
+        scanned_at, last_id = _parse_cursor(cursor, '|', (str, int))
+        conditions.append(f"(scanned_at < {p} OR (scanned_at = {p} AND id < {p}))")
+        params.extend([scanned_at, scanned_at, last_id])
+
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT id, current_price, original_price, discount_percent, scanned_at
+        FROM price_history
+        WHERE {' AND '.join(conditions)}
+        ORDER BY scanned_at DESC, id DESC
+        LIMIT {p}
+    """, params + [limit + 1])
+    rows = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1]['scanned_at']}|{rows[-1]['id']}"
+    return rows, next_cursor
+
+
+@traced('db')
+def count_price_history(game_id):
+    """某游戏的价格记录总数（走 idx_price_history_game 索引）"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"SELECT COUNT(*) FROM price_history WHERE game_id = {_placeholder()}", (game_id,))
+    count = cur.fetchone()[0]
+    cur.close()
+    conn.close()
+    return count
+
+
+@traced('db')
 def get_price_stats(game_id):
     """获取某游戏的价格统计：历史最低/最高/平均价、打折次数、是否历史最低"""
     conn = _get_conn()
@@ -459,23 +1081,39 @@ def get_price_stats(game_id):
 # === Phase 4: game_details 函数 ===
 
 def insert_game_details(game_id, details):
-    """插入或更新game_details记录（只更新非None字段）"""
+    """插入或更新game_details记录（只更新非None字段，sale_start/sale_end 缺失时清空）。
+
+    详情字段指纹与已存记录相同时只记录checked_at，返回False；写入返回True。
+    description/genre/publisher 变化时清空search_text和embedding，交给下游重建。
+    """
     conn = _get_conn()
     cur = conn.cursor()
 
     # 构建动态字段列表（只包含非None值）
-    fields = ['game_id']
-    values = [game_id]
-    update_parts = []
+    fields = ['game_id', 'content_hash']
+    values = [game_id, detail_hash(details)]
+    update_parts = ["content_hash = EXCLUDED.content_hash"]
+    search_inputs = []
 
-    for key in ('description', 'genre', 'publisher', 'release_date',
-                'languages', 'players', 'sale_start', 'sale_end'):
+    for key in DETAIL_FIELDS:
         if details.get(key) is not None:
             fields.append(key)
             values.append(details[key])
             update_parts.append(f"{key} = EXCLUDED.{key}")
-
+            if key in ('description', 'genre', 'publisher'):
+                search_inputs.append(f"game_details.{key} IS DISTINCT FROM EXCLUDED.{key}")
+        elif key in ('sale_start', 'sale_end'):
+            # 页面不再显示优惠期间：清空旧值（否则过期的sale_end会一直占用刷新预算）
+            update_parts.append(f"{key} = NULL")
+
+    if search_inputs:
+        inputs_changed = ' OR '.join(search_inputs)
+        update_parts.append(
+            f"search_text = CASE WHEN {inputs_changed} THEN NULL ELSE game_details.search_text END")
+        update_parts.append(
+            f"name_embedding = CASE WHEN {inputs_changed} THEN NULL ELSE game_details.name_embedding END")
     update_parts.append("updated_at = NOW()")
+    update_parts.append("checked_at = NOW()")
 
     placeholders = ', '.join(['%s'] * len(values))
     field_names = ', '.join(fields)
@@ -485,11 +1123,19 @@ def insert_game_details(game_id, details):
         INSERT INTO game_details ({field_names})
         VALUES ({placeholders})
         ON CONFLICT (game_id) DO UPDATE SET {update_sql}
+        WHERE game_details.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+        RETURNING game_id
     """, values)
+    written = cur.fetchone() is not None
+    if written:
+        _refresh_facets(cur, game_id)
+    else:
+        cur.execute("UPDATE game_details SET checked_at = NOW() WHERE game_id = %s", (game_id,))
 
     conn.commit()
     cur.close()
     conn.close()
+    return written
 
 
 def get_games_without_details():
@@ -509,15 +1155,66 @@ def get_games_without_details():
     return results
 
 
-def get_details_without_search_text():
-    """获取有description但没有search_text的游戏"""
+def get_detail_refresh_candidates():
+    """获取已有详情的游戏及刷新评分所需的字段（上次爬取时间、折扣状态、sale_end、价格变动次数）"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT g.id, g.eshop_id, g.name, g.url,
+               COALESCE(gd.checked_at, gd.updated_at) AS updated_at, gd.sale_end,
+               ph.discount_percent,
+               COALESCE(pa.alert_count, 0) AS alert_count
+        FROM games g
+        JOIN game_details gd ON g.id = gd.game_id
+        LEFT JOIN LATERAL (
+            SELECT discount_percent
+            FROM price_history
+            WHERE game_id = g.id
+            ORDER BY scanned_at DESC
+            LIMIT 1
+        ) ph ON true
+        LEFT JOIN (
+            SELECT game_id, COUNT(*) AS alert_count
+            FROM price_alerts
+            GROUP BY game_id
+        ) pa ON pa.game_id = g.id
+        ORDER BY g.id
+    """)
+    results = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+    return results
+
+
+def get_sale_window_games():
+    """获取有sale_start/sale_end的游戏，附带最近一次确认价格的时间（current_prices.checked_at）和折扣状态"""
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute("""
-        SELECT gd.game_id, g.name, gd.description, gd.genre, gd.publisher
+        SELECT g.id, g.eshop_id, g.name, g.url,
+               gd.sale_start, gd.sale_end,
+               cp.checked_at AS last_scanned_at, cp.discount_percent
         FROM game_details gd
         JOIN games g ON g.id = gd.game_id
-        WHERE gd.description IS NOT NULL AND gd.search_text IS NULL
+        LEFT JOIN current_prices cp ON cp.game_id = g.id
+        WHERE gd.sale_start IS NOT NULL OR gd.sale_end IS NOT NULL
+        ORDER BY g.id
+    """)
+    results = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+    return results
+
+
+def get_details_without_search_text(include_existing=False):
+    """获取有description但没有search_text的游戏；include_existing=True 时返回全部（含当前search_text，用于全量重建）"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT gd.game_id, g.name, gd.description, gd.genre, gd.publisher, gd.search_text
+        FROM game_details gd
+        JOIN games g ON g.id = gd.game_id
+        WHERE gd.description IS NOT NULL {'' if include_existing else 'AND gd.search_text IS NULL'}
         ORDER BY gd.game_id
     """)
     results = _fetchall_dict(cur)
@@ -539,58 +1236,300 @@ def update_search_text(game_id, search_text):
     conn.close()
 
 
-def update_embedding(game_id, embedding):
+def update_search_texts_bulk(rows):
+    """批量更新search_text，rows为 [(game_id, search_text)]，一条 UPDATE ... FROM (VALUES ...)。
+
+    只更新内容确实变化的行，并清空其embedding等待重新生成。返回实际更新行数。
+    """
+    if not rows:
+        return 0
+    conn = _get_conn()
+    cur = conn.cursor()
+    updated = psycopg2.extras.execute_values(cur, f"""
+        UPDATE game_details gd
+        SET search_text = v.search_text, {embedding_reset_sql()}, updated_at = NOW()
+        FROM (VALUES %s) AS v(game_id, search_text)
+        WHERE gd.game_id = v.game_id AND gd.search_text IS DISTINCT FROM v.search_text
+        RETURNING gd.game_id
+    """, rows, page_size=1000, fetch=True)
+    count = len(updated)
+    conn.commit()
+    cur.close()
+    conn.close()
+    return count
+
+
+def _vector_literal(embedding):
+    return '[' + ','.join(str(x) for x in embedding) + ']'
+
+
+def _quantized_set_sql(expr):
+    """按EMBEDDING_QUANTIZATION生成同步写入低精度列的SET子句，expr为完整向量的SQL表达式"""
+    if EMBEDDING_QUANTIZATION == 'halfvec':
+        return f", name_embedding_half = ({expr})::halfvec({EMBEDDING_DIMENSIONS})"
+    if EMBEDDING_QUANTIZATION == 'binary':
+        return f", name_embedding_bin = binary_quantize({expr})::bit({EMBEDDING_DIMENSIONS})"
+    return ""
+
+
+def embedding_reset_sql():
+    """清空向量的SET子句：完整向量、低精度列（已启用量化时）和embedding_model一起清空"""
+    columns = ['name_embedding', 'embedding_model']
+    if EMBEDDING_QUANTIZATION != 'none':
+        columns += ['name_embedding_half', 'name_embedding_bin']
+    return ', '.join(f"{c} = NULL" for c in columns)
+
+
+def update_embedding(game_id, embedding, model=EMBEDDING_MODEL):
     """更新name_embedding向量字段"""
     conn = _get_conn()
     cur = conn.cursor()
-    embedding_str = '[' + ','.join(str(x) for x in embedding) + ']'
+    embedding_str = _vector_literal(embedding)
     cur.execute(
-        "UPDATE game_details SET name_embedding = %s::vector, updated_at = NOW() WHERE game_id = %s",
-        (embedding_str, game_id)
+        "UPDATE game_details SET name_embedding = %s::vector, embedding_model = %s, updated_at = NOW()"
+        + _quantized_set_sql("%s::vector") + " WHERE game_id = %s",
+        (embedding_str, model) + ((embedding_str,) if EMBEDDING_QUANTIZATION != 'none' else ()) + (game_id,)
     )
     conn.commit()
     cur.close()
     conn.close()
 
 
-def get_games_without_embedding():
-    """获取有search_text但没有embedding的游戏"""
+def update_embeddings_bulk(rows, model=EMBEDDING_MODEL):
+    """批量更新name_embedding，rows为 [(game_id, embedding)]，一条 UPDATE ... FROM (VALUES ...)"""
+    if not rows:
+        return
+    conn = _get_conn()
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(cur, f"""
+        UPDATE game_details gd
+        SET name_embedding = v.embedding::vector, embedding_model = v.model, updated_at = NOW()
+            {_quantized_set_sql("v.embedding::vector")}
+        FROM (VALUES %s) AS v(game_id, embedding, model)
+        WHERE gd.game_id = v.game_id
+    """, [(game_id, _vector_literal(e), model) for game_id, e in rows])
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def _parse_vector(value):
+    """pgvector未注册类型时返回 '[0.1,0.2,...]' 字符串，转为list[float]"""
+    if isinstance(value, str):
+        return [float(x) for x in value.strip('[]').split(',')]
+    return list(value)
+
+
+def get_cached_embeddings(model, text_hashes):
+    """按 (model, text_hash) 批量查embedding缓存，返回 {text_hash: embedding}"""
+    if not text_hashes:
+        return {}
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT text_hash, embedding::text
+        FROM embedding_cache
+        WHERE model = %s AND text_hash = ANY(%s)
+    """, (model, list(text_hashes)))
+    results = {row[0]: _parse_vector(row[1]) for row in cur.fetchall()}
+    cur.close()
+    conn.close()
+    return results
+
+
+def save_cached_embeddings(model, items):
+    """批量写入embedding缓存，items为 [(text_hash, embedding)]，已存在的跳过"""
+    if not items:
+        return
+    conn = _get_conn()
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO embedding_cache (model, text_hash, embedding)
+        VALUES %s
+        ON CONFLICT (model, text_hash) DO NOTHING
+    """, [(model, h, _vector_literal(e)) for h, e in items],
+        template="(%s, %s, %s::vector)")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+
+def get_games_without_embedding(model=EMBEDDING_MODEL):
+    """获取有search_text但没有embedding（或embedding不是由model生成）的游戏"""
     conn = _get_conn()
     cur = conn.cursor()
     cur.execute("""
         SELECT game_id, search_text
         FROM game_details
-        WHERE name_embedding IS NULL AND search_text IS NOT NULL
+        WHERE search_text IS NOT NULL
+          AND (name_embedding IS NULL OR COALESCE(embedding_model, %s) <> %s)
         ORDER BY game_id
-    """)
+    """, (EMBEDDING_MODEL, model))
     results = _fetchall_dict(cur)
     cur.close()
     conn.close()
     return results
 
 
-def vector_search(query_embedding, limit=10):
-    """向量相似度搜索"""
+def backfill_quantized_embeddings():
+    """为已有完整向量但缺少低精度列的记录补齐（EMBEDDING_QUANTIZATION为none时不处理），返回更新数量"""
+    column = {'halfvec': 'name_embedding_half', 'binary': 'name_embedding_bin'}.get(EMBEDDING_QUANTIZATION)
+    if column is None:
+        return 0
     conn = _get_conn()
     cur = conn.cursor()
-    embedding_str = '[' + ','.join(str(x) for x in query_embedding) + ']'
-    cur.execute("""
+    cur.execute(f"""
+        UPDATE game_details SET updated_at = updated_at {_quantized_set_sql("name_embedding")}
+        WHERE name_embedding IS NOT NULL AND {column} IS NULL
+    """)
+    count = cur.rowcount
+    conn.commit()
+    cur.close()
+    conn.close()
+    return count
+
+
+def _first_stage_distance(embedding_param):
+    """两阶段搜索第一阶段的距离表达式（embedding_param为查询向量参数的占位符），按配置可截断维度"""
+    dims = EMBEDDING_SEARCH_DIMS
+    q = embedding_param
+    if EMBEDDING_QUANTIZATION == 'halfvec':
+        if dims:
+            return (f"subvector(gd.name_embedding_half, 1, {dims}) "
+                    f"<=> subvector({q}::vector::halfvec({EMBEDDING_DIMENSIONS}), 1, {dims})")
+        return f"gd.name_embedding_half <=> {q}::vector::halfvec({EMBEDDING_DIMENSIONS})"
+    if dims:
+        return (f"substring(gd.name_embedding_bin from 1 for {dims})::bit({dims}) "
+                f"<~> substring(binary_quantize({q}::vector)::bit({EMBEDDING_DIMENSIONS}) from 1 for {dims})::bit({dims})")
+    return f"gd.name_embedding_bin <~> binary_quantize({q}::vector)::bit({EMBEDDING_DIMENSIONS})"
+
+
+def _vector_candidates_sql():
+    """hybrid_search 中向量部分的CTE（vec：game_id, rank, similarity）。
+
+    EMBEDDING_QUANTIZATION不为none时两阶段：先用低精度向量（HNSW索引）取 candidates*EMBEDDING_RERANK_OVERSAMPLE 个，
+    再用完整向量精确重排取前 candidates 个。
+    """
+    if EMBEDDING_QUANTIZATION == 'none':
+        return """
+        vec AS (
+            SELECT gd.game_id,
+                   ROW_NUMBER() OVER (ORDER BY gd.name_embedding <=> %(embedding)s::vector) AS rank,
+                   1 - (gd.name_embedding <=> %(embedding)s::vector) AS similarity
+            FROM game_details gd
+            WHERE %(embedding)s::vector IS NOT NULL
+              AND gd.name_embedding IS NOT NULL
+              AND COALESCE(gd.embedding_model, %(default_model)s) = %(model)s
+            ORDER BY gd.name_embedding <=> %(embedding)s::vector
+            LIMIT %(candidates)s
+        )"""
+    return f"""
+        shortlist AS (
+            SELECT gd.game_id
+            FROM game_details gd
+            WHERE %(embedding)s::vector IS NOT NULL
+              AND gd.name_embedding IS NOT NULL
+              AND COALESCE(gd.embedding_model, %(default_model)s) = %(model)s
+            ORDER BY {_first_stage_distance('%(embedding)s')}
+            LIMIT %(shortlist)s
+        ),
+        vec AS (
+            SELECT gd.game_id,
+                   ROW_NUMBER() OVER (ORDER BY gd.name_embedding <=> %(embedding)s::vector) AS rank,
+                   1 - (gd.name_embedding <=> %(embedding)s::vector) AS similarity
+            FROM shortlist s
+            JOIN game_details gd ON gd.game_id = s.game_id
+            ORDER BY gd.name_embedding <=> %(embedding)s::vector
+            LIMIT %(candidates)s
+        )"""
+
+
+@traced('db')
+def hybrid_search(query_embedding, queries, limit=20, model=EMBEDDING_MODEL):
+    """混合搜索（一条SQL）：向量相似度 + 名称文本/trigram匹配，用倒数排名融合(RRF)合并，同一行返回最新价格。
+
+    queries为查询的多种写法（原文/简体/繁体），query_embedding为None时只做文本部分。
+    """
+    conn = _get_conn()
+    cur = conn.cursor()
+    params = {
+        'terms': list(dict.fromkeys(q for q in queries if q)),
+        'embedding': _vector_literal(query_embedding) if query_embedding is not None else None,
+        'default_model': EMBEDDING_MODEL,
+        'model': model,
+        'candidates': HYBRID_CANDIDATES,
+        'shortlist': HYBRID_CANDIDATES * EMBEDDING_RERANK_OVERSAMPLE,
+        'rrf_k': HYBRID_RRF_K,
+        'limit': limit,
+    }
+    cur.execute(f"""
+        WITH terms AS (
+            SELECT unnest(%(terms)s::text[]) AS term
+        ),{_vector_candidates_sql()},
+        txt AS (
+            SELECT g.id AS game_id,
+                   ROW_NUMBER() OVER (
+                       ORDER BY BOOL_OR(g.name ILIKE '%%' || t.term || '%%') DESC,
+                                MAX(similarity(g.name, t.term)) DESC, g.name
+                   ) AS rank
+            FROM games g
+            JOIN terms t ON g.name ILIKE '%%' || t.term || '%%' OR g.name %% t.term
+            GROUP BY g.id, g.name
+            ORDER BY rank
+            LIMIT %(candidates)s
+        ),
+        fused AS (
+            SELECT game_id,
+                   SUM(1.0 / (%(rrf_k)s + rank)) AS score,
+                   ARRAY_AGG(source ORDER BY source) AS sources
+            FROM (
+                SELECT game_id, rank, 'text' AS source FROM txt
+                UNION ALL
+                SELECT game_id, rank, 'vector' AS source FROM vec
+            ) ranked
+            GROUP BY game_id
+        )
         SELECT g.id, g.name, g.eshop_id, g.url,
                gd.genre, gd.publisher, gd.languages, gd.players,
                gd.release_date, gd.sale_start, gd.sale_end,
-               1 - (gd.name_embedding <=> %s::vector) AS similarity
-        FROM game_details gd
-        JOIN games g ON g.id = gd.game_id
-        WHERE gd.name_embedding IS NOT NULL
-        ORDER BY gd.name_embedding <=> %s::vector
-        LIMIT %s
-    """, (embedding_str, embedding_str, limit))
+               ph.current_price, ph.original_price, ph.discount_percent,
+               v.similarity, f.score, f.sources
+        FROM fused f
+        JOIN games g ON g.id = f.game_id
+        LEFT JOIN game_details gd ON gd.game_id = g.id
+        LEFT JOIN vec v ON v.game_id = g.id
+        LEFT JOIN LATERAL (
+            SELECT current_price, original_price, discount_percent
+            FROM price_history
+            WHERE game_id = g.id
+            ORDER BY scanned_at DESC
+            LIMIT 1
+        ) ph ON true
+        ORDER BY f.score DESC, g.name
+        LIMIT %(limit)s
+    """, params)
     results = _fetchall_dict(cur)
     cur.close()
     conn.close()
     return results
 
 
+def get_all_embeddings(model=EMBEDDING_MODEL):
+    """取出某模型生成的全部完整向量，返回 [(game_id, embedding)]（用于量化评估）"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT game_id, name_embedding::text
+        FROM game_details
+        WHERE name_embedding IS NOT NULL AND COALESCE(embedding_model, %s) = %s
+        ORDER BY game_id
+    """, (EMBEDDING_MODEL, model))
+    results = [(row[0], _parse_vector(row[1])) for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+    return results
+
+
 def get_game_details_by_id(game_id):
     """获取单个游戏的详情信息（含game_details元数据）"""
     conn = _get_conn()
@@ -609,26 +1548,338 @@ def get_game_details_by_id(game_id):
     return result
 
 
+@traced('db')
+def get_game_overview(game_id, history_limit=10):
+    """一次查询取出游戏详情页所需的全部数据：元数据、最近history_limit条价格、价格记录总数和统计。
+
+    返回dict（游戏不存在返回None），其中 history 为按时间倒序的价格记录列表，
+    stats 含 min/max/avg_price、discount_count、total_records、current_price、is_lowest（无价格记录时为None）。
+    """
+    conn = _get_conn()
+    cur = conn.cursor()
+    params = {'game_id': game_id, 'history_limit': history_limit}
+
+    if _use_pg:
+        cur.execute("""
+            SELECT g.id, g.name, g.url,
+                   gd.genre, gd.publisher, gd.languages, gd.players,
+                   gd.release_date, gd.sale_start, gd.sale_end, gd.description,
+                   (SELECT COALESCE(json_agg(h), '[]'::json) FROM (
+                        SELECT current_price, original_price, discount_percent, scanned_at::text AS scanned_at
+                        FROM price_history
+                        WHERE game_id = g.id
+                        ORDER BY scanned_at DESC
+                        LIMIT %(history_limit)s
+                   ) h) AS history,
+                   s.min_price, s.max_price, s.avg_price, s.discount_count, s.total_records, s.current_price
+            FROM games g
+            LEFT JOIN game_details gd ON gd.game_id = g.id
+            CROSS JOIN LATERAL (
+                SELECT MIN(current_price) AS min_price,
+                       MAX(current_price) AS max_price,
+                       AVG(current_price) AS avg_price,
+                       COUNT(*) FILTER (WHERE discount_percent IS NOT NULL) AS discount_count,
+                       COUNT(*) AS total_records,
+                       (array_agg(current_price ORDER BY scanned_at DESC))[1] AS current_price
+                FROM price_history
+                WHERE game_id = g.id
+            ) s
+            WHERE g.id = %(game_id)s
+        """, params)
+    else:
+        cur.execute("""
+            SELECT g.id, g.name, g.url,
+                   gd.genre, gd.publisher, gd.languages, gd.players,
+                   gd.release_date, gd.sale_start, gd.sale_end, gd.description,
+                   (SELECT json_group_array(json_object(
+                        'current_price', current_price, 'original_price', original_price,
+                        'discount_percent', discount_percent, 'scanned_at', scanned_at))
+                    FROM (
+                        SELECT current_price, original_price, discount_percent, scanned_at
+                        FROM price_history
+                        WHERE game_id = :game_id
+                        ORDER BY scanned_at DESC
+                        LIMIT :history_limit
+                    )) AS history,
+                   s.min_price, s.max_price, s.avg_price, s.discount_count, s.total_records, s.current_price
+            FROM games g
+            LEFT JOIN game_details gd ON gd.game_id = g.id
+            CROSS JOIN (
+                SELECT MIN(current_price) AS min_price,
+                       MAX(current_price) AS max_price,
+                       AVG(current_price) AS avg_price,
+                       SUM(CASE WHEN discount_percent IS NOT NULL THEN 1 ELSE 0 END) AS discount_count,
+                       COUNT(*) AS total_records,
+                       (SELECT current_price FROM price_history WHERE game_id = :game_id
+                        ORDER BY scanned_at DESC LIMIT 1) AS current_price
+                FROM price_history
+                WHERE game_id = :game_id
+            ) s
+            WHERE g.id = :game_id
+        """, params)
+    row = _fetchone_dict(cur)
+    cur.close()
+    conn.close()
+
+    if row is None:
+        return None
+
+    history = row.pop('history')
+    row['history'] = json.loads(history) if isinstance(history, str) else history
+    stat_keys = ('min_price', 'max_price', 'avg_price', 'discount_count', 'total_records', 'current_price')
+    stats = {k: row.pop(k) for k in stat_keys}
+    if stats['total_records']:
+        stats['is_lowest'] = stats['current_price'] <= stats['min_price']
+        stats['avg_price'] = round(stats['avg_price'], 1)
+        row['stats'] = stats
+    else:
+        row['stats'] = None
+    row['history_count'] = stats['total_records'] or 0
+    return row
+
+
+@traced('db')
 def search_by_genre(genre_keyword, limit=20):
-    """按游戏类型搜索，返回带最新价格的列表"""
+    """按游戏类型搜索，返回带当前价格（current_prices）的列表，一条SQL走索引。
+
+    类型写法（简体/繁体/英文）经别名表解析为规范类型：优先完全一致的别名，其次以关键词开头的最短别名
+    （「角色」→ 角色扮演），再次关键词中包含的最长别名（「RPG游戏」→ rpg）。
+    """
+    key = genre_key(genre_keyword)
+    if not key:
+        return []
+    p = _placeholder()
     conn = _get_conn()
     cur = conn.cursor()
-    cur.execute("""
+    cur.execute(f"""
         SELECT g.id, g.name, gd.genre, gd.publisher,
                ph.current_price, ph.original_price, ph.discount_percent
-        FROM game_details gd
-        JOIN games g ON g.id = gd.game_id
-        LEFT JOIN LATERAL (
-            SELECT current_price, original_price, discount_percent
-            FROM price_history
-            WHERE game_id = g.id
-            ORDER BY scanned_at DESC
+        FROM game_genres gg
+        JOIN games g ON g.id = gg.game_id
+        LEFT JOIN game_details gd ON gd.game_id = g.id
+        LEFT JOIN current_prices ph ON ph.game_id = g.id
+        WHERE gg.genre = (
+            SELECT genre FROM genre_aliases
+            WHERE alias = {p} OR substr(alias, 1, length({p})) = {p} OR {p} LIKE '%%' || alias || '%%'
+            ORDER BY alias = {p} DESC,
+                     substr(alias, 1, length({p})) = {p} DESC,
+                     CASE WHEN substr(alias, 1, length({p})) = {p} THEN length(alias) ELSE -length(alias) END,
+                     alias
             LIMIT 1
-        ) ph ON true
-        WHERE gd.genre ILIKE %s
+        )
         ORDER BY ph.discount_percent DESC NULLS LAST, g.name
-        LIMIT %s
-    """, (f'%{genre_keyword}%', limit))
+        LIMIT {p}
+    """, (key,) * 9 + (limit,))
+    results = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+    return results
+
+
+@traced('db')
+def get_genre_names():
+    """所有规范类型名，按游戏数降序"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT genre FROM game_genres GROUP BY genre ORDER BY COUNT(*) DESC, genre")
+    names = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+    return names
+
+
+# === 筛选维度（语言/人数/类型） ===
+
+def _ensure_genres(cur, tags):
+    """把类型标签映射到规范类型名；新类型连同各种写法的别名写入类型字典。返回 {标签: 规范名}"""
+    p = _placeholder()
+    keys = {tag: genre_key(tag) for tag in tags}
+    mapping = {}
+    if keys:
+        cur.execute(f"""
+            SELECT alias, genre FROM genre_aliases
+            WHERE alias IN ({', '.join([p] * len(keys))})
+        """, list(keys.values()))
+        known = {row[0]: row[1] for row in cur.fetchall()}
+        mapping = {tag: known[key] for tag, key in keys.items() if key in known}
+
+    for tag in tags:
+        if tag in mapping:
+            continue
+        canonical = canonical_genre(tag)
+        cur.execute(f"INSERT INTO genres (name) VALUES ({p}) ON CONFLICT (name) DO NOTHING", (canonical,))
+        cur.executemany(f"""
+            INSERT INTO genre_aliases (alias, genre) VALUES ({p}, {p})
+            ON CONFLICT (alias) DO NOTHING
+        """, [(alias, canonical) for alias in genre_aliases(canonical, tag)])
+        mapping[tag] = canonical
+    return mapping
+
+
+def _refresh_facets(cur, game_id=None):
+    """从 game_details 的文本字段重新解析筛选值（game_id为None时全部），返回处理的游戏数"""
+    p = _placeholder()
+    where = f"WHERE game_id = {p}" if game_id is not None else ""
+    cur.execute(f"SELECT game_id, languages, players, genre FROM game_details {where}",
+                (game_id,) if game_id is not None else ())
+    rows = _fetchall_dict(cur)
+
+    updates, tags = [], {}
+    for row in rows:
+        f = game_facets(row)
+        updates.append((f['language_mask'], f['min_players'], f['max_players'], row['game_id']))
+        tags[row['game_id']] = f['genres']
+
+    canonical = _ensure_genres(cur, list(dict.fromkeys(t for game_tags in tags.values() for t in game_tags)))
+    genres = [(gid, genre) for gid, game_tags in tags.items()
+              for genre in dict.fromkeys(canonical[t] for t in game_tags)]
+
+    cur.executemany(f"""
+        UPDATE game_details SET language_mask = {p}, min_players = {p}, max_players = {p}
+        WHERE game_id = {p}
+    """, updates)
+    if game_id is not None:
+        cur.execute(f"DELETE FROM game_genres WHERE game_id = {p}", (game_id,))
+    else:
+        cur.execute("DELETE FROM game_genres")
+    cur.executemany(f"INSERT INTO game_genres (game_id, genre) VALUES ({p}, {p})", genres)
+    return len(rows)
+
+
+def rebuild_facets():
+    """全量重建筛选值、类型字典和 game_genres（解析规则变化或补齐旧数据时运行），返回游戏数"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    count = _refresh_facets(cur)
+    conn.commit()
+    cur.close()
+    conn.close()
+    return count
+
+
+@traced('db')
+def filter_games(languages=None, players=None, max_price=None, min_discount=None, on_sale=False,
+                 genres=None, limit=20):
+    """按筛选维度和当前价格/折扣（current_prices）一条SQL查询游戏，折扣大的优先、同折扣便宜的优先。
+
+    languages: 语言名称列表（每种都要支持，「中文」繁简任一即可）；players: 支持该人数；
+    genres: 类型列表（每个都要有，任意写法经别名表解析）。语言无法识别时抛 ValueError。
+    """
+    p = _placeholder()
+    conditions, params = [], []
+    for mask in language_query_masks(languages or []):
+        conditions.append(f"(gd.language_mask & {p}) <> 0")
+        params.append(mask)
+    if players:
+        conditions.append(f"gd.min_players <= {p} AND gd.max_players >= {p}")
+        params.extend([players, players])
+    if on_sale or min_discount:
+        conditions.append("ph.original_price IS NOT NULL AND ph.discount_percent IS NOT NULL")
+    if min_discount:
+        conditions.append(f"ph.discount_percent >= {p}")
+        params.append(min_discount)
+    if max_price:
+        conditions.append(f"ph.current_price <= {p}")
+        params.append(max_price)
+    for genre in genres or []:
+        conditions.append(f"""EXISTS (SELECT 1 FROM game_genres gg WHERE gg.game_id = g.id
+                                      AND gg.genre = (SELECT genre FROM genre_aliases WHERE alias = {p}))""")
+        params.append(genre_key(genre))
+
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT g.id, g.name, gd.genre, gd.languages, gd.players,
+               ph.current_price, ph.original_price, ph.discount_percent
+        FROM games g
+        JOIN game_details gd ON gd.game_id = g.id
+        JOIN current_prices ph ON ph.game_id = g.id
+        {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+        ORDER BY COALESCE(ph.discount_percent, 0) DESC, ph.current_price, g.id
+        LIMIT {p}
+    """, params + [limit])
+    rows = _fetchall_dict(cur)
+    cur.close()
+    conn.close()
+    return rows
+
+
+# === Metacritic评分缓存 ===
+
+@traced('db')
+def get_game_score(game_id):
+    """按主键读取缓存的评分（含fetched_at、checked_at），没有记录返回None"""
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT game_id, metascore, user_score, source, url, query_name, fetched_at,
+               COALESCE(checked_at, fetched_at) AS checked_at
+        FROM game_scores
+        WHERE game_id = {_placeholder()}
+    """, (game_id,))
+    result = _fetchone_dict(cur)
+    cur.close()
+    conn.close()
+    return result
+
+
+@traced('db')
+def save_game_scores(rows):
+    """批量写入评分。rows: [{'game_id', 'metascore', 'user_score', 'source', 'url', 'query_name'}]，
+    没查到分数的游戏也写入（metascore为NULL），有效期内不再重复查询。
+    每次都更新 checked_at；没查到分数时保留已有的分数（查询偶尔失败不会覆盖之前的结果）。
+    """
+    if not rows:
+        return 0
+    p = _placeholder()
+    empty = "excluded.metascore IS NULL AND excluded.user_score IS NULL"
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.executemany(f"""
+        INSERT INTO game_scores (game_id, metascore, user_score, source, url, query_name, fetched_at, checked_at)
+        VALUES ({p}, {p}, {p}, {p}, {p}, {p}, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT (game_id) DO UPDATE SET
+            metascore = CASE WHEN {empty} THEN game_scores.metascore ELSE excluded.metascore END,
+            user_score = CASE WHEN {empty} THEN game_scores.user_score ELSE excluded.user_score END,
+            source = CASE WHEN {empty} THEN game_scores.source ELSE excluded.source END,
+            url = CASE WHEN {empty} THEN game_scores.url ELSE excluded.url END,
+            query_name = COALESCE(excluded.query_name, game_scores.query_name),
+            fetched_at = CASE WHEN {empty} THEN game_scores.fetched_at ELSE excluded.fetched_at END,
+            checked_at = excluded.checked_at
+    """, [(r['game_id'], r.get('metascore'), r.get('user_score'), r.get('source'), r.get('url'),
+           r.get('query_name')) for r in rows])
+    conn.commit()
+    cur.close()
+    conn.close()
+    return len(rows)
+
+
+def get_games_needing_scores(stale_before, limit, empty_stale_before=None):
+    """需要查询评分的游戏：没有评分记录，或上次查询（checked_at）早于 stale_before；
+    没查到分数的记录早于 empty_stale_before（默认同 stale_before）即重查。
+
+    打折中的游戏优先（折扣越大越优先），其次是从未查过的，再按上次查询时间从旧到新。
+    返回的 query_name 为之前查到分数时使用的查询名。
+    """
+    p = _placeholder()
+    empty_stale_before = empty_stale_before or stale_before
+    conn = _get_conn()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT g.id, g.name, ph.discount_percent, s.query_name, s.fetched_at
+        FROM games g
+        JOIN current_prices ph ON ph.game_id = g.id
+        LEFT JOIN game_scores s ON s.game_id = g.id
+        WHERE s.game_id IS NULL
+           OR COALESCE(s.checked_at, s.fetched_at) < {p}
+           OR (s.metascore IS NULL AND s.user_score IS NULL AND COALESCE(s.checked_at, s.fetched_at) < {p})
+        ORDER BY (ph.discount_percent IS NOT NULL) DESC,
+                 COALESCE(ph.discount_percent, 0) DESC,
+                 (s.game_id IS NULL) DESC,
+                 COALESCE(s.checked_at, s.fetched_at),
+                 g.id
+        LIMIT {p}
+    """, (stale_before.strftime('%Y-%m-%d %H:%M:%S'), empty_stale_before.strftime('%Y-%m-%d %H:%M:%S'), limit))
     results = _fetchall_dict(cur)
     cur.close()
     conn.close()
@@ -15,6 +15,16 @@ SELECTORS = {
     "sale_end": ".special-period-end",
 }
 
+JS_EXTRACT_PRICE = """
+(() => {
+    var box = document.querySelector('.product-info-main');
+    if (!box) return null;
+    var finalPrice = box.querySelector('.price-final_price [data-price-amount]')?.getAttribute('data-price-amount');
+    var oldPrice = box.querySelector('.old-price [data-price-amount]')?.getAttribute('data-price-amount');
+    return {finalPrice, oldPrice};
+})()
+"""
+
 
 def _clean_players(text):
     """清理players字段，去掉图标字符，只保留如 '1 ~ 2'"""
@@ -102,13 +112,23 @@ def scrape_detail_page(page, url):
         return None
 
 
+def scrape_detail_price(page):
+    """从当前已加载的详情页提取价格，返回 {finalPrice, oldPrice}（与列表页字段一致）或None"""
+    try:
+        return page.evaluate(JS_EXTRACT_PRICE)
+    except Exception as e:
+        print(f"    价格提取失败: {e}")
+        return None
+
+
 def scrape_all_details(page, games, delay_range=(3, 5)):
-    """批量爬取所有游戏详情页，逐条写入数据库。返回 (成功数, 失败数)。"""
+    """批量爬取所有游戏详情页，逐条写入数据库。返回 (写入数, 失败数, 未变化数)。"""
     from src.database import insert_game_details
 
     total = len(games)
     success = 0
     failed = 0
+    unchanged = 0
 
     for i, game in enumerate(games):
         name = game['name']
@@ -121,9 +141,12 @@ def scrape_all_details(page, games, delay_range=(3, 5)):
 
         if details:
             try:
-                insert_game_details(game_id, details)
-                print("OK")
-                success += 1
+                if insert_game_details(game_id, details):
+                    print("OK")
+                    success += 1
+                else:
+                    print("未变化")
+                    unchanged += 1
             except Exception as e:
                 print(f"DB写入失败: {e}")
                 failed += 1
@@ -136,4 +159,4 @@ def scrape_all_details(page, games, delay_range=(3, 5)):
             delay = random.uniform(*delay_range)
             time.sleep(delay)
 
-    return success, failed
+    return success, failed, unchanged
@@ -1,30 +1,240 @@
 """Embedding生成和简繁转换模块"""
 
+import asyncio
+import atexit
+import functools
+import json
+import math
 import os
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
 from opencc import OpenCC
+from src.config import (
+    EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_BACKEND,
+    QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_TTL, QUERY_EMBEDDING_CACHE_PATH,
+    SEARCH_TEXT_PARALLEL_THRESHOLD, SEARCH_TEXT_CHUNK_SIZE, EMBEDDING_BATCH_TOKENS, EMBEDDING_BATCH_MAX_ITEMS,
+    EMBEDDING_CONCURRENCY, EMBEDDING_RPM, EMBEDDING_TPM,
+)
+from src.fingerprint import text_hash
 
 _cc_t2s = OpenCC('t2s')  # 繁→简
 _cc_s2t = OpenCC('s2t')  # 简→繁
 
+# embedding缓存命中统计（进程内累计）
+_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def get_cache_stats():
+    """返回embedding缓存命中/未命中次数"""
+    return dict(_cache_stats)
+
+
+_openai_client = None
+
+
+def get_openai_client():
+    """进程内复用同一个OpenAI客户端（复用HTTP连接池）"""
+    global _openai_client
+    if _openai_client is None:
+        from openai import OpenAI
+        _openai_client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+    return _openai_client
+
+
+class QueryEmbeddingCache:
+    """查询embedding的LRU+TTL缓存，可选在进程退出时持久化到JSON文件"""
+
+    def __init__(self, max_size=QUERY_EMBEDDING_CACHE_SIZE, ttl=QUERY_EMBEDDING_CACHE_TTL, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # key -> (expires_at, embedding)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, embedding):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, embedding)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, expires_at, embedding in entries[-self.max_size:]:
+            if expires_at > now:
+                self._data[key] = (expires_at, embedding)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[k, exp, emb] for k, (exp, emb) in self._data.items()]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+
+
+_query_cache = QueryEmbeddingCache(path=QUERY_EMBEDDING_CACHE_PATH)
+if QUERY_EMBEDDING_CACHE_PATH:
+    atexit.register(_query_cache.save)
+
 
 def convert_to_simplified(text):
     """繁体转简体"""
     return _cc_t2s.convert(text)
 
 
+@functools.lru_cache(maxsize=8192)
+def convert_to_simplified_cached(text):
+    """带缓存的繁体转简体（游戏名等会重复转换的短文本）"""
+    return _cc_t2s.convert(text)
+
+
+def convert_names_to_simplified(names):
+    """批量繁体转简体：去重后拼成一段文本只调用一次OpenCC，再按行拆回"""
+    unique = list(dict.fromkeys(n.replace('\n', ' ') for n in names))
+    converted = _cc_t2s.convert('\n'.join(unique)).split('\n')
+    if len(converted) != len(unique):
+        converted = [convert_to_simplified_cached(n) for n in unique]
+    mapping = dict(zip(unique, converted))
+    return [mapping[n.replace('\n', ' ')] for n in names]
+
+
 def convert_to_traditional(text):
     """简体转繁体"""
     return _cc_s2t.convert(text)
 
 
-def build_search_text(game):
+def normalize_query(query):
+    """查询归一化：去首尾空白、合并空白、小写、统一为简体，使简繁体查询共享缓存"""
+    text = re.sub(r'\s+', ' ', query.strip()).lower()
+    return convert_to_simplified(text)
+
+
+_CJK_RE = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+class EmbeddingBackend:
+    """embedding后端接口。name 同时作为缓存key和 game_details.embedding_model 的值"""
+
+    name = None
+    dimensions = EMBEDDING_DIMENSIONS
+    cacheable = True  # 是否值得查embedding_cache（本地计算比查库还快时为False）
+
+    def available(self):
+        return True
+
+    def embed(self, texts):
+        """texts为list[str]，返回list[list[float]]"""
+        raise NotImplementedError
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """OpenAI embeddings API"""
+
+    def __init__(self, model=EMBEDDING_MODEL):
+        self.name = model
+
+    def available(self):
+        return bool(os.environ.get('OPENAI_API_KEY'))
+
+    def embed(self, texts):
+        response = get_openai_client().embeddings.create(model=self.name, input=texts)
+        return [d.embedding for d in response.data]
+
+
+class LocalHashBackend(EmbeddingBackend):
+    """CPU本地embedding：字符n-gram特征哈希投影到固定维度（NumPy），无需网络。
+
+    文本先统一为小写简体，简繁体标题得到相同特征；中日韩文字取1~3字n-gram，
+    英文/数字取整词和带边界的3字母n-gram。特征权重取 log(1+tf)，结果L2归一化。
+    """
+
+    name = 'local-ngram-hash-v1'
+    cacheable = False
+    CJK_NGRAM_WEIGHTS = {1: 0.5, 2: 1.0, 3: 1.0}
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _features(self, text):
+        feats = Counter()
+        for run in re.findall(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff]+|[a-z0-9]+', normalize_query(text)):
+            if _CJK_RE.match(run):
+                for n, weight in self.CJK_NGRAM_WEIGHTS.items():
+                    for i in range(len(run) - n + 1):
+                        feats[f'c{n}:{run[i:i + n]}'] += weight
+            else:
+                feats[f'w:{run}'] += 1.5
+                padded = f'#{run}#'
+                for i in range(len(padded) - 2):
+                    feats[f't:{padded[i:i + 3]}'] += 0.5
+        return feats
+
+    def embed(self, texts):
+        import numpy as np
+
+        out = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feat, tf in self._features(text).items():
+                h = zlib.crc32(feat.encode('utf-8'))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                out[row, h % self.dimensions] += sign * math.log1p(tf)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out /= np.maximum(norms, 1e-12)
+        return out.tolist()
+
+
+_backends = {}
+
+
+def get_backend(name=None):
+    """按名称（默认config.EMBEDDING_BACKEND）返回进程内复用的embedding后端"""
+    name = name or EMBEDDING_BACKEND
+    if name not in _backends:
+        if name == 'openai':
+            _backends[name] = OpenAIBackend()
+        elif name == 'local':
+            _backends[name] = LocalHashBackend()
+        else:
+            raise ValueError(f"未知的embedding后端: {name}（可选 openai / local）")
+    return _backends[name]
+
+
+def build_search_text(game, simplified_name=None):
     """构建search_text字段
 
-    game需包含: name, description, genre, publisher
+    game需包含: name, description, genre, publisher；simplified_name可传入批量转换好的简体名
     """
     parts = [game['name']]
     # 繁体名→简体名
-    simplified_name = convert_to_simplified(game['name'])
+    if simplified_name is None:
+        simplified_name = convert_to_simplified_cached(game['name'])
     if simplified_name != game['name']:
         parts.append(simplified_name)
     # 类型
@@ -40,67 +250,291 @@ def build_search_text(game):
     return '\n'.join(parts)
 
 
-def generate_embedding(text):
-    """调用OpenAI API生成embedding向量（1536维）"""
-    from openai import OpenAI
-    client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
-    response = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text,
-    )
-    return response.data[0].embedding
+def _lookup_cache(hashes, model):
+    """查embedding缓存表（只在PostgreSQL上可用），返回 {text_hash: embedding}"""
+    from src.database import is_postgres, get_cached_embeddings
+    if not is_postgres():
+        return {}
+    return get_cached_embeddings(model, hashes)
 
 
-def batch_build_search_text():
-    """批量构建search_text，返回处理数量"""
-    from src.database import get_details_without_search_text, update_search_text
+def _store_cache(items, model):
+    from src.database import is_postgres, save_cached_embeddings
+    if is_postgres():
+        save_cached_embeddings(model, items)
 
-    games = get_details_without_search_text()
+
+def generate_embedding(text, backend=None):
+    """用当前embedding后端生成向量（1536维）；可缓存的后端先查缓存，未命中再计算"""
+    backend = backend or get_backend()
+    if not backend.cacheable:
+        return backend.embed([text])[0]
+
+    h = text_hash(text)
+    cached = _lookup_cache([h], backend.name)
+    if h in cached:
+        _cache_stats['hits'] += 1
+        return cached[h]
+    _cache_stats['misses'] += 1
+
+    embedding = backend.embed([text])[0]
+    _store_cache([(h, embedding)], backend.name)
+    return embedding
+
+
+def embed_query(query, backend=None):
+    """用户查询的embedding：先查进程内LRU缓存（按后端+归一化后的查询），未命中再走generate_embedding"""
+    backend = backend or get_backend()
+    normalized = normalize_query(query)
+    key = f"{backend.name}:{normalized}"
+    embedding = _query_cache.get(key)
+    if embedding is None:
+        embedding = generate_embedding(normalized, backend)
+        _query_cache.put(key, embedding)
+    return embedding
+
+
+def get_query_cache_stats():
+    """返回查询embedding缓存的命中/未命中次数和当前条数"""
+    return {'hits': _query_cache.hits, 'misses': _query_cache.misses, 'size': len(_query_cache._data)}
+
+
+def build_search_texts(games):
+    """批量构建search_text（游戏名批量简繁转换），返回与games对应的列表"""
+    simplified = convert_names_to_simplified([g['name'] for g in games])
+    return [build_search_text(g, s) for g, s in zip(games, simplified)]
+
+
+def _build_search_texts_parallel(games):
+    """大目录用进程池分块构建search_text"""
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = [games[i:i + SEARCH_TEXT_CHUNK_SIZE] for i in range(0, len(games), SEARCH_TEXT_CHUNK_SIZE)]
+    # 只传构建需要的字段，减少进程间序列化
+    fields = ('name', 'description', 'genre', 'publisher')
+    payload = [[{k: g.get(k) for k in fields} for g in chunk] for chunk in chunks]
+    with ProcessPoolExecutor() as pool:
+        results = pool.map(build_search_texts, payload)
+    return [text for chunk in results for text in chunk]
+
+
+def batch_build_search_text(rebuild=False):
+    """批量构建search_text，返回实际更新数量。
+
+    rebuild=False 只处理没有search_text的游戏；rebuild=True 重新计算全部，只写回内容变化的行。
+    """
+    from src.database import get_details_without_search_text, update_search_texts_bulk
+
+    games = get_details_without_search_text(include_existing=rebuild)
     if not games:
         print("所有游戏已有search_text，无需处理。")
         return 0
 
     print(f"待构建search_text: {len(games)} 个")
-    for i, game in enumerate(games):
-        search_text = build_search_text(game)
-        update_search_text(game['game_id'], search_text)
-        if (i + 1) % 100 == 0:
-            print(f"  已处理 {i + 1}/{len(games)}")
+    start = time.perf_counter()
+    if len(games) > SEARCH_TEXT_PARALLEL_THRESHOLD:
+        texts = _build_search_texts_parallel(games)
+    else:
+        texts = build_search_texts(games)
 
-    print(f"search_text构建完成: {len(games)} 个")
-    return len(games)
+    changed = [(g['game_id'], t) for g, t in zip(games, texts) if t != g.get('search_text')]
+    updated = update_search_texts_bulk(changed)
 
+    print(f"search_text构建完成: {updated} 个更新, {len(games) - len(changed)} 个未变化，"
+          f"用时 {time.perf_counter() - start:.1f}s")
+    return updated
 
-def batch_generate_embeddings(batch_size=100):
-    """批量生成embedding，返回处理数量"""
-    from openai import OpenAI
-    from src.database import get_games_without_embedding, update_embedding
 
-    client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+def estimate_tokens(text):
+    """粗略估算token数：中日韩字符按1.5个token，其他字符按4个字符1个token"""
+    cjk = len(_CJK_RE.findall(text))
+    return int(cjk * 1.5 + (len(text) - cjk) / 4) + 1
 
-    games = get_games_without_embedding()
-    if not games:
-        print("所有游戏已有embedding，无需处理。")
-        return 0
 
-    print(f"待生成embedding: {len(games)} 个")
-    total_processed = 0
+def pack_batches(items, max_tokens=EMBEDDING_BATCH_TOKENS, max_items=EMBEDDING_BATCH_MAX_ITEMS):
+    """按估算token数装箱。items为 [(key, text)]，返回 [(batch, 估算tokens)]"""
+    batches = []
+    current, current_tokens = [], 0
+    for item in items:
+        tokens = estimate_tokens(item[1])
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append((current, current_tokens))
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        batches.append((current, current_tokens))
+    return batches
+
+
+class RateBudget:
+    """每分钟请求数/token数预算（令牌桶，按时间线性回填）"""
+
+    def __init__(self, rpm=EMBEDDING_RPM, tpm=EMBEDDING_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
 
-    for batch_start in range(0, len(games), batch_size):
-        batch = games[batch_start:batch_start + batch_size]
-        texts = [g['search_text'] for g in batch]
+    async def acquire(self, tokens):
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max((1 - self._requests) * 60 / self.rpm,
+                           (tokens - self._tokens) * 60 / self.tpm)
+                await asyncio.sleep(wait)
 
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=texts,
-        )
 
-        for j, embedding_data in enumerate(response.data):
-            game_id = batch[j]['game_id']
-            update_embedding(game_id, embedding_data.embedding)
+async def _request_embeddings(client, model, texts, tokens, budget, max_retries=6):
+    """发送一个embedding请求，429/连接错误/5xx时按Retry-After或指数退避重试。返回 (vectors, 实际tokens)"""
+    import openai
+
+    for attempt in range(max_retries):
+        await budget.acquire(tokens)
+        try:
+            response = await client.embeddings.create(model=model, input=texts)
+            return [d.embedding for d in response.data], response.usage.total_tokens
+        except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+            if attempt == max_retries - 1:
+                raise
+            response = getattr(e, 'response', None)
+            retry_after = response.headers.get('retry-after') if response is not None else None
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+            print(f"  请求失败（{e.__class__.__name__}），{delay:.1f}s后重试")
+            await asyncio.sleep(delay)
+
+
+async def _bulk_writer(queue, total, model, flush_size=200):
+    """从队列收 [(game_id, embedding)]，攒够flush_size条批量写库。返回写入数量"""
+    from src.database import update_embeddings_bulk
+
+    pending = []
+    written = 0
+    while True:
+        rows = await queue.get()
+        if rows is not None:
+            pending.extend(rows)
+        if pending and (rows is None or len(pending) >= flush_size):
+            await asyncio.to_thread(update_embeddings_bulk, pending, model)
+            written += len(pending)
+            pending = []
+            print(f"  已写入 {written}/{total}")
+        if rows is None:
+            return written
+
+
+async def embed_pipeline(games, concurrency=EMBEDDING_CONCURRENCY, rpm=EMBEDDING_RPM,
+                         tpm=EMBEDDING_TPM, base_url=None, model=EMBEDDING_MODEL):
+    """并发embedding流水线：缓存命中直接写库；未命中的文本按token装箱，
+    在速率预算内保持concurrency个请求在途，结果流式交给批量写入。
+
+    games为 [{'game_id', 'search_text'}]。base_url可指向本地替身服务（测试用）。
+    """
+    from openai import AsyncOpenAI
+
+    hashes = {g['game_id']: text_hash(g['search_text']) for g in games}
+    cached = await asyncio.to_thread(_lookup_cache, sorted(set(hashes.values())), model)
+
+    # 相同文本只请求一次
+    by_hash = {}  # text_hash -> (text, [game_id])
+    hits = []
+    for g in games:
+        h = hashes[g['game_id']]
+        if h in cached:
+            hits.append((g['game_id'], cached[h]))
+        else:
+            by_hash.setdefault(h, (g['search_text'], []))[1].append(g['game_id'])
+
+    queue = asyncio.Queue()
+    writer = asyncio.create_task(_bulk_writer(queue, len(games), model))
+    if hits:
+        await queue.put(hits)
+
+    batches = pack_batches([(h, text) for h, (text, _) in by_hash.items()])
+    client = AsyncOpenAI(api_key=os.environ.get('OPENAI_API_KEY'), base_url=base_url, max_retries=0)
+    budget = RateBudget(rpm, tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+    usage = {'tokens': 0}
+
+    async def run(batch, est_tokens):
+        async with semaphore:
+            vectors, used = await _request_embeddings(
+                client, model, [text for _, text in batch], est_tokens, budget)
+        usage['tokens'] += used
+        new_items = [(h, v) for (h, _), v in zip(batch, vectors)]
+        await asyncio.to_thread(_store_cache, new_items, model)
+        await queue.put([(game_id, v) for h, v in new_items for game_id in by_hash[h][1]])
+
+    try:
+        await asyncio.gather(*(run(batch, tokens) for batch, tokens in batches))
+    finally:
+        await queue.put(None)
+        written = await writer
+        await client.close()
+
+    return {
+        'written': written,
+        'hits': len(hits),
+        'misses': len(games) - len(hits),
+        'requests': len(batches),
+        'tokens': usage['tokens'],
+    }
+
+
+def _embed_locally(games, backend, chunk_size=500):
+    """本地后端：直接分块计算并批量写库，返回写入数量"""
+    from src.database import update_embeddings_bulk
+
+    written = 0
+    for start in range(0, len(games), chunk_size):
+        chunk = games[start:start + chunk_size]
+        vectors = backend.embed([g['search_text'] for g in chunk])
+        update_embeddings_bulk([(g['game_id'], v) for g, v in zip(chunk, vectors)], backend.name)
+        written += len(chunk)
+        print(f"  已写入 {written}/{len(games)}")
+    return written
+
+
+def batch_generate_embeddings(concurrency=EMBEDDING_CONCURRENCY, base_url=None):
+    """用当前embedding后端批量生成embedding（缺失或由其他后端生成的都会重算），返回处理数量"""
+    from src.database import get_games_without_embedding
+
+    backend = get_backend()
+    games = get_games_without_embedding(backend.name)
+    if not games:
+        print("所有游戏已有embedding，无需处理。")
+        return 0
 
-        total_processed += len(batch)
-        print(f"  已处理 {total_processed}/{len(games)} (tokens: ~{response.usage.total_tokens})")
+    start = time.perf_counter()
+    if isinstance(backend, OpenAIBackend):
+        print(f"待生成embedding: {len(games)} 个（{backend.name}，并发 {concurrency}）")
+        result = asyncio.run(embed_pipeline(games, concurrency=concurrency, base_url=base_url,
+                                            model=backend.name))
+        _cache_stats['hits'] += result['hits']
+        _cache_stats['misses'] += result['misses']
+        print(f"embedding生成完成: {result['written']} 个，用时 {time.perf_counter() - start:.1f}s"
+              f"（缓存命中 {result['hits']}, 未命中 {result['misses']}, "
+              f"请求 {result['requests']} 次, tokens: ~{result['tokens']}）")
+        return result['written']
 
-    print(f"embedding生成完成: {total_processed} 个")
-    return total_processed
+    print(f"待生成embedding: {len(games)} 个（{backend.name}，本地计算）")
+    written = _embed_locally(games, backend)
+    print(f"embedding生成完成: {written} 个，用时 {time.perf_counter() - start:.1f}s")
+    return written
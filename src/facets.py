@@ -0,0 +1,150 @@
+"""筛选维度 - 把详情页的自由文本（语言、人数、类型）解析成可索引的值
+
+- 语言：位掩码，每种语言一位；只写「中文」时繁体和简体两位都置上
+- 人数：'1 ~ 4' → (1, 4)，'1' → (1, 1)
+- 类型：'動作, 冒險' → ['動作', '冒險']；类型字典把简体/繁体/英文写法都映射到规范类型名（商店的繁体名）
+"""
+
+import re
+
+# (位, 代码, 名称, 匹配的写法)
+LANGUAGES = [
+    (0, 'zh_hant', '繁體中文', ('繁體', '繁体', '正體', 'traditional chinese', 'chinese (traditional)')),
+    (1, 'zh_hans', '简体中文', ('簡體', '简体', 'simplified chinese', 'chinese (simplified)')),
+    (2, 'en', '英文', ('英文', '英語', '英语', 'english')),
+    (3, 'ja', '日文', ('日文', '日語', '日语', '日本語', '日本语', 'japanese')),
+    (4, 'ko', '韓文', ('韓文', '韩文', '韓語', '韩语', 'korean')),
+    (5, 'fr', '法文', ('法文', '法語', '法语', 'french')),
+    (6, 'de', '德文', ('德文', '德語', '德语', 'german')),
+    (7, 'es', '西班牙文', ('西班牙', 'spanish')),
+    (8, 'it', '意大利文', ('意大利', '義大利', 'italian')),
+    (9, 'nl', '荷蘭文', ('荷蘭', '荷兰', 'dutch')),
+    (10, 'ru', '俄文', ('俄文', '俄語', '俄语', 'russian')),
+    (11, 'pt', '葡萄牙文', ('葡萄牙', 'portuguese')),
+]
+CHINESE_MASK = (1 << 0) | (1 << 1)
+_CHINESE_WORDS = ('中文', '華語', '华语', 'chinese')
+
+# 规范类型名 → 其他写法（简体/英文/常见说法）；不在表里的类型以商店原文为规范名，并自动加上繁简转换的写法
+GENRE_SYNONYMS = {
+    '動作': ('动作', 'action'),
+    '冒險': ('冒险', 'adventure'),
+    '角色扮演': ('rpg', 'role-playing', 'role playing', '角色扮演遊戲', '角色扮演游戏'),
+    '模擬': ('模拟', 'simulation'),
+    '策略': ('strategy', '戰略', '战略'),
+    '益智': ('puzzle', '解謎', '解谜'),
+    '派對': ('派对', 'party'),
+    '射擊': ('射击', 'shooter', 'shooting'),
+    '競速': ('竞速', 'racing', '賽車', '赛车'),
+    '運動': ('运动', 'sports', '體育', '体育'),
+    '平台': ('platformer', '平台跳躍', '平台跳跃'),
+    '格鬥': ('格斗', 'fighting'),
+    '音樂': ('音乐', 'music', '節奏', '节奏', 'rhythm'),
+    '教育': ('education',),
+    '實用工具': ('实用工具', 'utility'),
+    '健身': ('fitness',),
+    '桌上遊戲': ('桌上游戏', 'board game', '桌遊', '桌游'),
+    '其他': ('other',),
+}
+
+_SPLIT_RE = re.compile(r'[,，、/;；\n]+')
+_PLAYERS_RE = re.compile(r'(\d+)\s*(?:[~～\-－至到]\s*(\d+))?')
+
+
+def _language_bits(token):
+    token = token.strip().lower()
+    if not token:
+        return 0
+    mask = 0
+    for bit, _, _, words in LANGUAGES:
+        if any(w in token for w in words):
+            mask |= 1 << bit
+    if not mask & CHINESE_MASK and any(w in token for w in _CHINESE_WORDS):
+        mask |= CHINESE_MASK  # 没写繁简的「中文」
+    return mask
+
+
+def language_mask(text):
+    """详情页语言文本 → 位掩码（无法识别的语言忽略），空文本返回None"""
+    if not text:
+        return None
+    mask = 0
+    for token in _SPLIT_RE.split(text):
+        mask |= _language_bits(token)
+    return mask
+
+
+def language_query_masks(languages):
+    """查询的语言列表（如 ['中文', '英文']）→ 每种语言一个掩码，游戏需与每个掩码都有交集；
+    无法识别时抛 ValueError"""
+    masks = []
+    for name in languages:
+        mask = _language_bits(name)
+        if not mask:
+            raise ValueError(f"不认识的语言: {name}")
+        masks.append(mask)
+    return masks
+
+
+def language_names(mask):
+    """位掩码 → 语言名称列表"""
+    if not mask:
+        return []
+    return [name for bit, _, name, _ in LANGUAGES if mask & (1 << bit)]
+
+
+def parse_players(text):
+    """人数文本 → (最少人数, 最多人数)，无法解析返回 (None, None)"""
+    if not text:
+        return None, None
+    m = _PLAYERS_RE.search(text)
+    if not m:
+        return None, None
+    low = int(m.group(1))
+    high = int(m.group(2)) if m.group(2) else low
+    return min(low, high), max(low, high)
+
+
+def genre_tags(text):
+    """类型文本 → 去重的类型标签列表（保持顺序）"""
+    if not text:
+        return []
+    return list(dict.fromkeys(t.strip() for t in _SPLIT_RE.split(text) if t.strip()))
+
+
+def genre_key(text):
+    """类型写法的查找键（别名表中的 alias）"""
+    return text.strip().lower()
+
+
+_GENRE_INDEX = {genre_key(alias): canonical for canonical, aliases in GENRE_SYNONYMS.items()
+                for alias in (canonical, *aliases)}
+
+
+def canonical_genre(tag):
+    """类型标签 → 规范类型名（不在字典里的保留原文）"""
+    return _GENRE_INDEX.get(genre_key(tag), tag.strip())
+
+
+def genre_aliases(canonical, tag=None):
+    """规范类型名的所有查找键：本身、繁简转换、字典中的其他写法，以及原始标签"""
+    from src.embedding import convert_to_simplified, convert_to_traditional
+
+    names = [canonical, *GENRE_SYNONYMS.get(canonical, ())]
+    if tag:
+        names.append(tag)
+    keys = []
+    for name in names:
+        keys.extend([name, convert_to_simplified(name), convert_to_traditional(name)])
+    return list(dict.fromkeys(genre_key(k) for k in keys if k.strip()))
+
+
+def game_facets(row):
+    """game_details 的一行（languages/players/genre）→ 要写入的筛选值"""
+    min_players, max_players = parse_players(row.get('players'))
+    return {
+        'language_mask': language_mask(row.get('languages')),
+        'min_players': min_players,
+        'max_players': max_players,
+        'genres': genre_tags(row.get('genre')),
+    }
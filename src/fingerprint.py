@@ -0,0 +1,30 @@
+"""内容指纹 - 判断列表项/详情字段是否变化，未变化的记录跳过写入和下游重建"""
+
+import hashlib
+import json
+
+DETAIL_FIELDS = ('description', 'genre', 'publisher', 'release_date',
+                 'languages', 'players', 'sale_start', 'sale_end')
+LISTING_FIELDS = ('name', 'url', 'img', 'finalPrice', 'oldPrice')
+
+
+def content_hash(data, fields):
+    """对指定字段计算sha256（None字段不参与），字段顺序固定"""
+    payload = {k: str(data[k]) for k in fields if data.get(k) is not None}
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def text_hash(text):
+    """文本的sha256，用作embedding缓存的key"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def detail_hash(details):
+    """详情页提取字段的指纹"""
+    return content_hash(details, DETAIL_FIELDS)
+
+
+def listing_hash(item):
+    """列表页商品（名称、链接、图片、价格）的指纹"""
+    return content_hash(item, LISTING_FIELDS)
@@ -51,3 +51,13 @@ def detect_changes(game_id, new_price, new_original):
         })
 
     return alerts
+
+
+def detect_disappeared(missing_games):
+    """减价页上消失的打折游戏视为折扣结束，批量生成sale_ended alert（新价格=原价）"""
+    return [{
+        'game_id': g['id'],
+        'alert_type': 'sale_ended',
+        'old_price': g['current_price'],
+        'new_price': g['original_price'],
+    } for g in missing_games]
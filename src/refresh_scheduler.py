@@ -0,0 +1,105 @@
+"""详情页刷新调度 - 在固定的页面预算内优先刷新价值最高的详情页
+
+评分依据：
+- 过期程度：上次爬取时间（checked_at，旧记录用updated_at）距今越久越需要刷新
+- 折扣状态：当前打折的游戏，sale_start/sale_end 最可能变化
+- sale_end 临近或已过：折扣即将结束/刚结束，详情页的优惠期间需要更新
+- 热度：以价格变动次数（price_alerts）作为热度的近似
+"""
+
+import math
+from datetime import datetime, timedelta, timezone
+
+from src.config import (
+    DETAIL_REFRESH_BUDGET, DETAIL_STALE_DAYS, DETAIL_MIN_REFRESH_HOURS,
+    SALE_END_URGENT_HOURS, HKT_OFFSET_HOURS,
+)
+
+WEIGHTS = {
+    'staleness': 0.4,
+    'discounted': 0.25,
+    'sale_end': 0.25,
+    'popularity': 0.1,
+}
+POPULARITY_SATURATION = 20  # 价格变动次数达到该值即视为最热门
+
+
+def utcnow():
+    """当前UTC时间（naive，与数据库NOW()写入的TIMESTAMP一致）"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def to_datetime(value):
+    """把数据库返回的时间（datetime或字符串）统一转为datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def score_refresh(game, now=None):
+    """计算单个游戏的刷新价值（0~1），刚刷新过的游戏返回0"""
+    now = now or utcnow()
+    updated_at = to_datetime(game.get('updated_at'))
+
+    if updated_at is None:
+        staleness = 1.0
+    else:
+        age_hours = (now - updated_at).total_seconds() / 3600
+        if age_hours < DETAIL_MIN_REFRESH_HOURS:
+            return 0.0
+        staleness = min(age_hours / 24 / DETAIL_STALE_DAYS, 1.0)
+
+    discounted = 1.0 if game.get('discount_percent') else 0.0
+
+    # sale_end是香港时间
+    sale_end_score = 0.0
+    sale_end = to_datetime(game.get('sale_end'))
+    if sale_end is not None:
+        hours_left = (sale_end - (now + timedelta(hours=HKT_OFFSET_HOURS))).total_seconds() / 3600
+        if hours_left <= 0:
+            # 上次爬取之后才结束的优惠期间：详情还是旧的，需要刷新；爬取时已结束的说明页面仍显示该期间，不再加权
+            if updated_at is None or sale_end > updated_at + timedelta(hours=HKT_OFFSET_HOURS):
+                sale_end_score = 1.0
+        elif hours_left <= SALE_END_URGENT_HOURS:
+            sale_end_score = 1.0 - hours_left / SALE_END_URGENT_HOURS
+
+    alert_count = game.get('alert_count') or 0
+    popularity = min(math.log1p(alert_count) / math.log1p(POPULARITY_SATURATION), 1.0)
+
+    return (WEIGHTS['staleness'] * staleness
+            + WEIGHTS['discounted'] * discounted
+            + WEIGHTS['sale_end'] * sale_end_score
+            + WEIGHTS['popularity'] * popularity)
+
+
+def plan_detail_refresh(budget=DETAIL_REFRESH_BUDGET, now=None):
+    """生成本次要爬取的详情页列表：优先未爬过的新游戏，剩余预算按刷新价值从高到低填满。
+
+    返回 (games, stats)，stats 含 new/refresh/candidates 数量。
+    """
+    from src.database import get_games_without_details, get_detail_refresh_candidates
+
+    now = now or utcnow()
+    new_games = get_games_without_details()[:budget]
+    remaining = budget - len(new_games)
+
+    refresh_games = []
+    candidates = []
+    if remaining > 0:
+        for game in get_detail_refresh_candidates():
+            score = score_refresh(game, now)
+            if score > 0:
+                game['refresh_score'] = round(score, 3)
+                candidates.append(game)
+        candidates.sort(key=lambda g: g['refresh_score'], reverse=True)
+        refresh_games = candidates[:remaining]
+
+    stats = {
+        'new': len(new_games),
+        'refresh': len(refresh_games),
+        'candidates': len(candidates),
+    }
+    return new_games + refresh_games, stats
@@ -0,0 +1,60 @@
+"""折扣窗口定向复查调度 - 根据 sale_start/sale_end 计算哪些游戏需要在折扣开始/结束前后复查
+
+上次确认价格之后发生过折扣切换（sale_start 或 sale_end 已过且晚于上次确认）的游戏到期复查。
+复查确认价格后（价格没变、没有写新记录时也会更新 current_prices.checked_at），同一切换不会再次触发；超过一天仍未观察到的切换交给每日全量扫描。
+"""
+
+from datetime import timedelta
+
+from src.config import HKT_OFFSET_HOURS, SALE_RECHECK_SETTLE_MINUTES
+from src.refresh_scheduler import utcnow, to_datetime
+
+MAX_TRANSITION_AGE = timedelta(days=1)
+
+
+def _hkt_to_utc(value):
+    """sale_start/sale_end是香港时间，转为与scanned_at一致的UTC"""
+    value = to_datetime(value)
+    return value - timedelta(hours=HKT_OFFSET_HOURS) if value else None
+
+
+def recheck_reason(game, now=None):
+    """返回该游戏需要复查的原因，不需要复查返回None"""
+    now = now or utcnow()
+    settled = now - timedelta(minutes=SALE_RECHECK_SETTLE_MINUTES)
+    oldest = now - MAX_TRANSITION_AGE
+    sale_start = _hkt_to_utc(game.get('sale_start'))
+    sale_end = _hkt_to_utc(game.get('sale_end'))
+    last_scanned = to_datetime(game.get('last_scanned_at'))
+
+    for label, t in (('sale_start', sale_start), ('sale_end', sale_end)):
+        if t and oldest <= t <= settled and (last_scanned is None or last_scanned < t):
+            return label
+    return None
+
+
+def next_transition(games, now=None):
+    """所有游戏中下一次折扣切换的UTC时间（加上等待时间），没有则返回None"""
+    now = now or utcnow()
+    upcoming = []
+    for game in games:
+        for key in ('sale_start', 'sale_end'):
+            t = _hkt_to_utc(game.get(key))
+            if t and t > now:
+                upcoming.append(t + timedelta(minutes=SALE_RECHECK_SETTLE_MINUTES))
+    return min(upcoming) if upcoming else None
+
+
+def plan_sale_recheck(now=None):
+    """返回 (到期需复查的游戏列表, 下一次切换时间)，每个游戏带 recheck_reason 字段"""
+    from src.database import get_sale_window_games
+
+    now = now or utcnow()
+    games = get_sale_window_games()
+    due = []
+    for game in games:
+        reason = recheck_reason(game, now)
+        if reason:
+            game['recheck_reason'] = reason
+            due.append(game)
+    return due, next_transition(games, now)
@@ -0,0 +1,222 @@
+"""Metacritic评分 - 可替换的查询provider + 限速 + 批量预取
+
+provider 接口与 embedding 后端一致：name 标识来源，lookup(name) 返回评分dict或None。
+- ddgs: DuckDuckGo 搜索 "metacritic <游戏名>"，从结果摘要中解析 Metascore / 用户评分
+- local: 读取本地JSON文件 {游戏名: {"metascore": 87, "user_score": 8.5}}，用于测试和离线环境
+"""
+
+import json
+import re
+import threading
+import time
+from datetime import timedelta
+
+from src.config import (
+    METACRITIC_PROVIDER, METACRITIC_LOCAL_PATH, METACRITIC_SCORE_TTL_DAYS, METACRITIC_EMPTY_TTL_DAYS,
+    METACRITIC_RPM, METACRITIC_BATCH_LIMIT,
+)
+from src.database import get_game_score, get_games_needing_scores, save_game_scores
+from src.refresh_scheduler import to_datetime, utcnow
+
+_METASCORE_RES = [
+    re.compile(r'metascore[^0-9]{0,20}(\d{1,3})\b', re.I),
+    re.compile(r'\b(\d{1,3})\s*/\s*100\b'),
+    re.compile(r'metacritic score (?:of )?(\d{1,3})\b', re.I),
+]
+_USER_SCORE_RE = re.compile(r'user score[^0-9]{0,20}(\d(?:\.\d)?)\b', re.I)
+# 商店名中的英文片段（如「Hollow Knight 空洞騎士」中的 Hollow Knight）
+_LATIN_RUN_RE = re.compile(r"[A-Za-z][A-Za-z0-9'’:&!.,\- ]*[A-Za-z0-9!]")
+
+
+class RateLimiter:
+    """每分钟请求数上限（令牌桶，线程安全，按时间线性回填）"""
+
+    def __init__(self, rpm):
+        self.rpm = rpm
+        self._tokens = float(rpm)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.rpm, self._tokens + (now - self._updated) * self.rpm / 60)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) * 60 / self.rpm)
+
+
+def parse_scores(text):
+    """从搜索摘要中解析 (metascore, user_score)，解析不到的为None"""
+    metascore = user_score = None
+    for pattern in _METASCORE_RES:
+        m = pattern.search(text)
+        if m and 0 <= int(m.group(1)) <= 100:
+            metascore = int(m.group(1))
+            break
+    m = _USER_SCORE_RE.search(text)
+    if m and float(m.group(1)) <= 10:
+        user_score = float(m.group(1))
+    return metascore, user_score
+
+
+class ScoreProvider:
+    """评分查询provider接口"""
+
+    name = None
+
+    def __init__(self, rpm=METACRITIC_RPM):
+        self.limiter = RateLimiter(rpm) if rpm else None
+
+    def lookup(self, game_name):
+        """返回 {'metascore', 'user_score', 'url', 'snippet'} 或 None（查询失败）"""
+        if self.limiter is not None:
+            self.limiter.acquire()
+        return self._lookup(game_name)
+
+    def _lookup(self, game_name):
+        raise NotImplementedError
+
+
+class DdgsProvider(ScoreProvider):
+    """DuckDuckGo 搜索 Metacritic 页面摘要"""
+
+    name = 'ddgs'
+
+    def _lookup(self, game_name):
+        from ddgs import DDGS
+
+        query = f"metacritic {game_name} nintendo switch score"
+        try:
+            with DDGS() as ddgs:
+                results = list(ddgs.text(query, max_results=3))
+        except Exception:
+            return None
+
+        first = None
+        for r in results:
+            metascore, user_score = parse_scores(f"{r['title']} {r['body']}")
+            entry = {'metascore': metascore, 'user_score': user_score,
+                     'url': r['href'], 'snippet': f"{r['title']}\n{r['body']}"}
+            if first is None:
+                first = entry
+            if metascore is not None and 'metacritic.com' in r['href']:
+                return entry
+        return first or {'metascore': None, 'user_score': None, 'url': None, 'snippet': None}
+
+
+class LocalScoreProvider(ScoreProvider):
+    """本地JSON替身：不联网、不限速，未收录的游戏返回无分数"""
+
+    name = 'local'
+
+    def __init__(self, path=METACRITIC_LOCAL_PATH):
+        super().__init__(rpm=None)
+        self.path = path
+        self._scores = None
+
+    def _lookup(self, game_name):
+        if self._scores is None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self._scores = json.load(f)
+            except (OSError, ValueError):
+                self._scores = {}
+        entry = self._scores.get(game_name) or {}
+        return {'metascore': entry.get('metascore'), 'user_score': entry.get('user_score'),
+                'url': entry.get('url'), 'snippet': None}
+
+
+_providers = {}
+
+
+def get_score_provider(name=None):
+    """按名称（默认config.METACRITIC_PROVIDER）返回进程内复用的provider（共享限速）"""
+    name = name or METACRITIC_PROVIDER
+    if name not in _providers:
+        if name == 'ddgs':
+            _providers[name] = DdgsProvider()
+        elif name == 'local':
+            _providers[name] = LocalScoreProvider()
+        else:
+            raise ValueError(f"未知的评分provider: {name}（可选 ddgs / local）")
+    return _providers[name]
+
+
+def has_score(score):
+    return bool(score) and (score.get('metascore') is not None or score.get('user_score') is not None)
+
+
+def lookup_name(store_name, query_name=None):
+    """批量预取用的查询名：之前查到过分数的名称优先，其次商店名中最长的英文片段，都没有时用商店名"""
+    if query_name:
+        return query_name
+    runs = [r.strip() for r in _LATIN_RUN_RE.findall(store_name or '')]
+    runs = [r for r in runs if sum(c.isalpha() for c in r) >= 3]
+    return max(runs, key=len) if runs else store_name
+
+
+def is_fresh(score, ttl_days=METACRITIC_SCORE_TTL_DAYS, empty_ttl_days=METACRITIC_EMPTY_TTL_DAYS):
+    """缓存的评分是否还在有效期内（按上次查询时间；没查到分数的记录用较短的 empty_ttl_days）"""
+    checked_at = to_datetime(score.get('checked_at') or score.get('fetched_at')) if score else None
+    if checked_at is None:
+        return False
+    ttl = ttl_days if has_score(score) else empty_ttl_days
+    return utcnow() - checked_at < timedelta(days=ttl)
+
+
+def fetch_and_save(game_id, game_name, provider=None):
+    """实时查询一个游戏的评分并写入缓存，返回查询结果（失败返回None，不写缓存）。
+
+    没查到分数但缓存中已有分数时，返回缓存的分数（写入时不会被覆盖）。
+    """
+    provider = provider or get_score_provider()
+    result = provider.lookup(game_name)
+    if result is not None:
+        save_game_scores([{**result, 'game_id': game_id, 'source': provider.name,
+                           'query_name': game_name if has_score(result) else None}])
+        if not has_score(result):
+            saved = get_game_score(game_id)
+            if has_score(saved):
+                return saved
+    return result
+
+
+def cached_score(game_id):
+    """读取有效期内的缓存评分，过期或没有返回None"""
+    score = get_game_score(game_id)
+    return score if is_fresh(score) else None
+
+
+def refresh_scores(limit=METACRITIC_BATCH_LIMIT, provider=None, ttl_days=METACRITIC_SCORE_TTL_DAYS,
+                   empty_ttl_days=METACRITIC_EMPTY_TTL_DAYS):
+    """批量预取评分：打折游戏优先，其次从未查过/已过期的。返回 (查询数, 有分数数, 失败数)"""
+    provider = provider or get_score_provider()
+    now = utcnow()
+    games = get_games_needing_scores(now - timedelta(days=ttl_days), limit,
+                                     empty_stale_before=now - timedelta(days=empty_ttl_days))
+    found = failed = 0
+    rows = []
+
+    for i, game in enumerate(games):
+        name = lookup_name(game['name'], game.get('query_name'))
+        result = provider.lookup(name)
+        if result is None:
+            failed += 1
+            continue
+        rows.append({**result, 'game_id': game['id'], 'source': provider.name,
+                     'query_name': name if has_score(result) else None})
+        if result.get('metascore') is not None:
+            found += 1
+        # 分批写入，中途中断也不丢已查到的结果
+        if len(rows) >= 20:
+            save_game_scores(rows)
+            rows = []
+        label = game['name'] if name == game['name'] else f"{game['name']}（{name}）"
+        print(f"  [{i+1}/{len(games)}] {label}: {result.get('metascore') or '-'}")
+
+    save_game_scores(rows)
+    return len(games), found, failed
@@ -25,15 +25,20 @@ def scrape_page(page):
     return page.evaluate(JS_EXTRACT_ITEMS)
 
 
-def scrape_all_pages(page, max_pages=None, url_template=None):
-    """遍历所有列表页，返回去重后的全部商品。url_template 可自定义，需含 {page} 占位符。"""
+def scrape_all_pages(page, max_pages=None, url_template=None, return_complete=False):
+    """遍历所有列表页，返回去重后的全部商品。url_template 可自定义，需含 {page} 占位符。
+
+    return_complete=True 时返回 (商品列表, 是否完整爬到最后一页)，页面加载失败或被max_pages截断视为不完整。
+    """
     all_games = []
+    complete = True
     seen_urls = set()
     page_num = 1
     template = url_template or (BASE_URL + LIST_URL_TEMPLATE)
 
     while True:
         if max_pages and page_num > max_pages:
+            complete = False
             break
 
         url = template.format(page=page_num)
@@ -42,6 +47,7 @@ def scrape_all_pages(page, max_pages=None, url_template=None):
         ok = navigate(page, url)
         if not ok:
             print(f"  第{page_num}页加载失败，跳过")
+            complete = False
             break
 
         items = scrape_page(page)
@@ -62,4 +68,6 @@ def scrape_all_pages(page, max_pages=None, url_template=None):
         wait_between_pages()
 
     print(f"爬取完成，共{len(all_games)}个商品（去重后）")
+    if return_complete:
+        return all_games, complete
     return all_games
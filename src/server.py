@@ -0,0 +1,253 @@
+"""HTTP API - 多用户并发访问Agent提问和数据库查询（aiohttp）
+
+端点：
+- POST /ask                  {"question", "session_id"?, "fast_path"?} → Agent回答；session_id 对应Agent的对话thread
+- GET  /deals                ?limit&cursor&min_discount&max_price → 分页折扣列表
+- GET  /games/search         ?q= → 名称搜索
+- GET  /games/filter         ?language&players&max_price&min_discount&on_sale&genre&limit → 按筛选维度查询
+- GET  /games/{id}           → 游戏详情（元数据 + 最近价格 + 统计）
+- GET  /games/{id}/history   ?limit&cursor → 分页价格记录
+- GET  /health, GET /stats
+
+并发控制：
+- Agent提问最多 max_concurrent 个同时执行，排队超过 max_pending 个时返回503（背压），单次超时返回504
+- 同一个 session_id 的提问串行执行（同一对话thread不能并发写）
+- 数据库查询在固定大小的线程池执行，PG连接来自共享连接池
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from langgraph.checkpoint.memory import MemorySaver
+
+import src.database as database
+from src.agent.agent import aask, build_agent, create_llm
+from src.agent.cache import get_tool_cache_stats
+from src.agent.memory import open_checkpointer
+from src.agent.router import get_router_stats
+from src.config import (
+    AGENT_MEMORY_PATH, API_MAX_CONCURRENT_ASKS, API_MAX_PENDING_ASKS, API_ASK_TIMEOUT, API_DB_POOL_SIZE,
+)
+
+MAX_PAGE_SIZE = 100
+
+AGENT = web.AppKey('agent', object)
+CHECKPOINTER = web.AppKey('checkpointer', object)
+LIMITER = web.AppKey('limiter', object)
+DB_EXECUTOR = web.AppKey('db_executor', ThreadPoolExecutor)
+
+
+class AskLimiter:
+    """Agent提问的有界并发 + 排队上限 + 按会话串行，并统计各种结果的次数"""
+
+    def __init__(self, max_concurrent, max_pending, timeout):
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.in_flight = 0  # 排队中 + 执行中
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._sessions = {}  # session_id -> [lock, 引用数]
+        self.counts = {'ok': 0, 'rejected': 0, 'timeout': 0, 'error': 0}
+
+    def full(self):
+        return self.in_flight >= self.max_concurrent + self.max_pending
+
+    async def run(self, session_id, coro_factory):
+        """排队执行 coro_factory()，返回 (结果, 排队ms)；超时抛 asyncio.TimeoutError"""
+        entry = self._sessions.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            async with entry[0], self._slots:
+                queued_ms = (time.perf_counter() - t0) * 1000
+                remaining = max(self.timeout - queued_ms / 1000, 0.001)
+                result = await asyncio.wait_for(coro_factory(), timeout=remaining)
+                return result, queued_ms
+        finally:
+            self.in_flight -= 1
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._sessions[session_id]
+
+    def stats(self):
+        return {'in_flight': self.in_flight, 'max_concurrent': self.max_concurrent,
+                'max_pending': self.max_pending, **self.counts}
+
+
+def _json(data, status=200, headers=None):
+    return web.json_response(data, status=status, headers=headers,
+                             dumps=lambda obj: json.dumps(obj, ensure_ascii=False, default=str))
+
+
+def _error(status, message, headers=None):
+    return _json({'error': message}, status=status, headers=headers)
+
+
+def _bad_request(message):
+    return web.HTTPBadRequest(text=json.dumps({'error': message}, ensure_ascii=False),
+                              content_type='application/json')
+
+
+def _int_param(request, name, default=None, maximum=None):
+    value = request.query.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise _bad_request(f'{name} 必须是整数')
+    return min(value, maximum) if maximum else value
+
+
+def _float_param(request, name):
+    value = request.query.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise _bad_request(f'{name} 必须是数字')
+
+
+async def _db(request, func, *args, **kwargs):
+    """在数据库线程池中执行同步查询函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app[DB_EXECUTOR], lambda: func(*args, **kwargs))
+
+
+async def handle_ask(request):
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return _error(400, '请求体必须是JSON')
+    if not isinstance(body, dict):
+        return _error(400, '请求体必须是JSON对象')
+    question = str(body.get('question') or '').strip()
+    if not question:
+        return _error(400, '缺少 question')
+    session_id = str(body.get('session_id') or uuid.uuid4().hex)
+
+    limiter = request.app[LIMITER]
+    if limiter.full():
+        limiter.counts['rejected'] += 1
+        return _error(503, '服务繁忙，请稍后重试', headers={'Retry-After': '1'})
+
+    t0 = time.perf_counter()
+    try:
+        answer, queued_ms = await limiter.run(session_id, lambda: aask(
+            request.app[AGENT], question, verbose=False, thread_id=f"api:{session_id}",
+            fast_path=bool(body.get('fast_path', True))))
+    except asyncio.TimeoutError:
+        limiter.counts['timeout'] += 1
+        return _error(504, f'回答超时（{limiter.timeout}秒）')
+    except Exception as e:
+        limiter.counts['error'] += 1
+        return _error(500, f'出错了: {e}')
+
+    limiter.counts['ok'] += 1
+    return _json({'answer': answer, 'session_id': session_id,
+                  'queued_ms': round(queued_ms, 1), 'elapsed_ms': round((time.perf_counter() - t0) * 1000, 1)})
+
+
+async def handle_deals(request):
+    limit = _int_param(request, 'limit', 30, MAX_PAGE_SIZE)
+    cursor = request.query.get('cursor') or None
+    min_discount = _int_param(request, 'min_discount')
+    max_price = _float_param(request, 'max_price')
+    try:
+        items, next_cursor = await _db(request, database.get_deals_page, limit=limit, cursor=cursor,
+                                       min_discount=min_discount, max_price=max_price)
+    except ValueError:
+        return _error(400, 'cursor 无效')
+    result = {'items': items, 'next_cursor': next_cursor}
+    if cursor is None:
+        result['total'] = await _db(request, database.count_deals, min_discount=min_discount, max_price=max_price)
+    return _json(result)
+
+
+async def handle_search(request):
+    q = request.query.get('q', '').strip()
+    if not q:
+        return _error(400, '缺少 q')
+    return _json({'items': await _db(request, database.search_games_by_name, q)})
+
+
+async def handle_filter(request):
+    languages = [x for x in request.query.getall('language', []) if x]
+    genres = [x for x in request.query.getall('genre', []) if x]
+    try:
+        items = await _db(request, database.filter_games, languages=languages,
+                          players=_int_param(request, 'players'), max_price=_float_param(request, 'max_price'),
+                          min_discount=_int_param(request, 'min_discount'),
+                          on_sale=request.query.get('on_sale') in ('1', 'true'), genres=genres,
+                          limit=_int_param(request, 'limit', 20, MAX_PAGE_SIZE))
+    except ValueError as e:
+        return _error(400, str(e))
+    return _json({'items': items})
+
+
+async def handle_game(request):
+    game_id = int(request.match_info['game_id'])
+    game = await _db(request, database.get_game_overview, game_id,
+                     history_limit=_int_param(request, 'history_limit', 10, MAX_PAGE_SIZE))
+    if game is None:
+        return _error(404, f'找不到 game_id={game_id} 的游戏')
+    return _json(game)
+
+
+async def handle_history(request):
+    game_id = int(request.match_info['game_id'])
+    try:
+        items, next_cursor = await _db(request, database.get_price_history_page, game_id,
+                                       limit=_int_param(request, 'limit', 20, MAX_PAGE_SIZE),
+                                       cursor=request.query.get('cursor') or None)
+    except ValueError:
+        return _error(400, 'cursor 无效')
+    return _json({'items': items, 'next_cursor': next_cursor})
+
+
+async def handle_health(request):
+    return _json({'status': 'ok'})
+
+
+async def handle_stats(request):
+    return _json({'asks': request.app[LIMITER].stats(), 'router': get_router_stats(),
+                  'tool_cache': get_tool_cache_stats()})
+
+
+def create_app(llm=None, memory_path=AGENT_MEMORY_PATH, max_concurrent=API_MAX_CONCURRENT_ASKS,
+               max_pending=API_MAX_PENDING_ASKS, timeout=API_ASK_TIMEOUT, db_pool_size=API_DB_POOL_SIZE):
+    """创建aiohttp应用。llm 默认为Claude（create_llm），压测时传入替身模型；memory_path 为空时对话只存内存"""
+    app = web.Application()
+
+    async def startup(app):
+        database.init_db()
+        database.enable_pool(maxconn=db_pool_size)
+        app[DB_EXECUTOR] = ThreadPoolExecutor(max_workers=db_pool_size, thread_name_prefix='db')
+        # checkpointer 必须在服务的事件循环里打开
+        app[CHECKPOINTER] = await open_checkpointer(memory_path) if memory_path else MemorySaver()
+        app[AGENT] = build_agent(llm or create_llm(), app[CHECKPOINTER])
+        app[LIMITER] = AskLimiter(max_concurrent, max_pending, timeout)
+
+    async def cleanup(app):
+        if memory_path:
+            await app[CHECKPOINTER].conn.close()
+        app[DB_EXECUTOR].shutdown(wait=False)
+        database.close_pool()
+
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    app.router.add_post('/ask', handle_ask)
+    app.router.add_get('/deals', handle_deals)
+    app.router.add_get('/games/search', handle_search)
+    app.router.add_get('/games/filter', handle_filter)
+    app.router.add_get(r'/games/{game_id:\d+}', handle_game)
+    app.router.add_get(r'/games/{game_id:\d+}/history', handle_history)
+    app.router.add_get('/health', handle_health)
+    app.router.add_get('/stats', handle_stats)
+    return app
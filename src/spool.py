@@ -0,0 +1,225 @@
+"""本地spool扫描 - 扫描期间只写本地SQLite，结束后一次性批量同步到PostgreSQL
+
+流程：
+1. prepare_spool: 从PG一次读出所有游戏和每个游戏的最新价格，写入本地SQLite作为基线，
+   之后 src.database 的所有读写都走本地SQLite（detect_changes/去重逻辑照常工作）
+2. 扫描照常调用 upsert_game / insert_price / save_alerts 等函数
+3. sync_spool: 把基线之后变化的games、新增的price_history和price_alerts
+   用COPY写入临时表，再在同一个事务里merge到正式表并提升数据版本（读者要么看到全部，要么看不到）
+"""
+
+import csv
+import io
+import os
+import sqlite3
+
+import src.database as database
+
+GAME_COLUMNS = ('eshop_id', 'name', 'url', 'image_url', 'magento_product_id', 'listing_hash')
+
+
+def _pg_conn():
+    import psycopg2
+    return psycopg2.connect(database.DATABASE_URL)
+
+
+def _sqlite_conn(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _ts(value):
+    """PG时间转为SQLite CURRENT_TIMESTAMP同格式的字符串"""
+    return value.isoformat(sep=' ') if value is not None else None
+
+
+def prepare_spool(path):
+    """从PG拉取基线写入本地spool，并把数据库后端切换到该spool。返回基线游戏数。"""
+    if not database.DATABASE_URL:
+        raise ValueError("spool模式需要设置 DATABASE_URL")
+
+    # 确保PG端表结构最新（含listing_hash等列）
+    database.init_db()
+
+    pg = _pg_conn()
+    cur = pg.cursor()
+    cur.execute(f"""
+        SELECT id, {', '.join(GAME_COLUMNS)}, first_seen_at, updated_at
+        FROM games
+    """)
+    games = cur.fetchall()
+    cur.execute("""
+        SELECT DISTINCT ON (game_id)
+               id, game_id, current_price, original_price, discount_percent, scanned_at
+        FROM price_history
+        ORDER BY game_id, scanned_at DESC
+    """)
+    prices = cur.fetchall()
+    cur.close()
+    pg.close()
+
+    if os.path.exists(path):
+        os.remove(path)
+    database.use_sqlite(path)
+    database.init_db()
+
+    conn = _sqlite_conn(path)
+    conn.executemany(f"""
+        INSERT INTO games (id, {', '.join(GAME_COLUMNS)}, first_seen_at, updated_at)
+        VALUES ({', '.join(['?'] * (len(GAME_COLUMNS) + 3))})
+    """, [row[:-2] + (_ts(row[-2]), _ts(row[-1])) for row in games])
+    conn.executemany("""
+        INSERT INTO price_history (id, game_id, current_price, original_price, discount_percent, scanned_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [row[:-1] + (_ts(row[-1]),) for row in prices])
+    conn.execute("CREATE TABLE spool_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.executemany("INSERT INTO spool_meta (key, value) VALUES (?, ?)", [
+        ('seeded_at', conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]),
+        ('price_baseline', str(max((row[0] for row in prices), default=0))),
+    ])
+    conn.commit()
+    conn.close()
+    database.rebuild_current_prices()
+
+    print(f"spool基线: {len(games)} 个游戏, {len(prices)} 条最新价格 → {path}")
+    return len(games)
+
+
+def _read_delta(path):
+    """读出spool中基线之后的变化：(games, prices, alerts, checked)，都以eshop_id关联；
+    checked 为扫描中确认价格未变的游戏（current_prices.checked_at 在基线之后）"""
+    conn = _sqlite_conn(path)
+    meta = dict(conn.execute("SELECT key, value FROM spool_meta").fetchall())
+    seeded_at = meta['seeded_at']
+    price_baseline = int(meta['price_baseline'])
+
+    prices = conn.execute("""
+        SELECT g.eshop_id, ph.current_price, ph.original_price, ph.discount_percent, ph.scanned_at
+        FROM price_history ph JOIN games g ON g.id = ph.game_id
+        WHERE ph.id > ?
+        ORDER BY ph.id
+    """, (price_baseline,)).fetchall()
+    alerts = conn.execute("""
+        SELECT g.eshop_id, pa.alert_type, pa.old_price, pa.new_price, pa.created_at
+        FROM price_alerts pa JOIN games g ON g.id = pa.game_id
+        ORDER BY pa.id
+    """).fetchall()
+    games = conn.execute(f"""
+        SELECT {', '.join(GAME_COLUMNS)}
+        FROM games
+        WHERE updated_at >= ?
+           OR id IN (SELECT game_id FROM price_history WHERE id > ?)
+           OR id IN (SELECT game_id FROM price_alerts)
+    """, (seeded_at, price_baseline)).fetchall()
+    checked = conn.execute("""
+        SELECT g.eshop_id, cp.checked_at
+        FROM current_prices cp JOIN games g ON g.id = cp.game_id
+        WHERE cp.checked_at >= ?
+    """, (seeded_at,)).fetchall()
+    conn.close()
+    return games, prices, alerts, checked
+
+
+def _copy(cur, table, rows):
+    """用COPY把rows写入临时表"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow(['\\N' if v is None else v for v in row])
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+
+
+def sync_spool(path):
+    """把spool中的增量批量同步到PG（单事务）。返回 {'games', 'prices', 'alerts'} 数量。"""
+    games, prices, alerts, checked = _read_delta(path)
+
+    pg = _pg_conn()
+    cur = pg.cursor()
+    try:
+        cur.execute("""
+            CREATE TEMP TABLE spool_games (
+                eshop_id TEXT, name TEXT, url TEXT, image_url TEXT,
+                magento_product_id TEXT, listing_hash TEXT
+            ) ON COMMIT DROP
+        """)
+        cur.execute("""
+            CREATE TEMP TABLE spool_prices (
+                eshop_id TEXT, current_price REAL, original_price REAL,
+                discount_percent INTEGER, scanned_at TIMESTAMP
+            ) ON COMMIT DROP
+        """)
+        cur.execute("""
+            CREATE TEMP TABLE spool_alerts (
+                eshop_id TEXT, alert_type TEXT, old_price REAL, new_price REAL,
+                created_at TIMESTAMP
+            ) ON COMMIT DROP
+        """)
+        cur.execute("""
+            CREATE TEMP TABLE spool_checked (eshop_id TEXT, checked_at TIMESTAMP) ON COMMIT DROP
+        """)
+        _copy(cur, 'spool_games', games)
+        _copy(cur, 'spool_prices', prices)
+        _copy(cur, 'spool_alerts', alerts)
+        _copy(cur, 'spool_checked', checked)
+
+        # 改名的游戏需要重建search_text/embedding（与upsert_game一致）
+        cur.execute(f"""
+            UPDATE game_details gd SET search_text = NULL, {database.embedding_reset_sql()}
+            FROM games g JOIN spool_games s ON s.eshop_id = g.eshop_id
+            WHERE gd.game_id = g.id AND g.name IS DISTINCT FROM s.name
+        """)
+        cur.execute("""
+            INSERT INTO games (eshop_id, name, url, image_url, magento_product_id, listing_hash)
+            SELECT eshop_id, name, url, image_url, magento_product_id, listing_hash
+            FROM spool_games
+            ON CONFLICT (eshop_id) DO UPDATE SET
+                name = EXCLUDED.name,
+                image_url = EXCLUDED.image_url,
+                listing_hash = EXCLUDED.listing_hash,
+                updated_at = NOW()
+        """)
+        cur.execute("""
+            INSERT INTO price_history (game_id, current_price, original_price, discount_percent, scanned_at)
+            SELECT g.id, s.current_price, s.original_price, s.discount_percent, s.scanned_at
+            FROM spool_prices s JOIN games g ON g.eshop_id = s.eshop_id
+        """)
+        cur.execute("""
+            INSERT INTO current_prices (game_id, current_price, original_price, discount_percent, checked_at)
+            SELECT DISTINCT ON (ph.game_id)
+                   ph.game_id, ph.current_price, ph.original_price, ph.discount_percent, ph.scanned_at
+            FROM price_history ph
+            WHERE ph.game_id IN (SELECT g.id FROM spool_prices s JOIN games g ON g.eshop_id = s.eshop_id)
+            ORDER BY ph.game_id, ph.scanned_at DESC
+            ON CONFLICT (game_id) DO UPDATE SET
+                current_price = EXCLUDED.current_price,
+                original_price = EXCLUDED.original_price,
+                discount_percent = EXCLUDED.discount_percent,
+                checked_at = EXCLUDED.checked_at
+        """)
+        cur.execute("""
+            UPDATE current_prices cp SET checked_at = s.checked_at
+            FROM spool_checked s JOIN games g ON g.eshop_id = s.eshop_id
+            WHERE cp.game_id = g.id AND (cp.checked_at IS NULL OR cp.checked_at < s.checked_at)
+        """)
+        cur.execute("""
+            INSERT INTO price_alerts (game_id, alert_type, old_price, new_price, created_at)
+            SELECT g.id, s.alert_type, s.old_price, s.new_price, s.created_at
+            FROM spool_alerts s JOIN games g ON g.eshop_id = s.eshop_id
+        """)
+        # 与数据同一事务提升数据版本，查询缓存在读到新数据的同时失效
+        cur.execute("""
+            UPDATE data_version SET version = version + 1, updated_at = NOW() WHERE id = 1
+        """)
+        pg.commit()
+    except Exception:
+        pg.rollback()
+        raise
+    finally:
+        cur.close()
+        pg.close()
+
+    counts = {'games': len(games), 'prices': len(prices), 'alerts': len(alerts)}
+    print(f"spool同步完成: games {counts['games']}, 价格 {counts['prices']}, alerts {counts['alerts']}")
+    return counts
@@ -0,0 +1,219 @@
+"""结构化追踪 - 记录Agent每轮提问中模型调用、工具调用和数据库函数的耗时与token用量
+
+span 组成一棵树：turn（一轮提问）→ model / tool → db。只有在一轮提问（trace）之内才记录，
+扫描、爬虫等批量任务调用同样的数据库函数时不产生记录。
+
+导出方式（config.AGENT_TRACE_EXPORTER，或调用 configure_tracing）：
+- jsonl: 每个span结束时追加一行JSON到 AGENT_TRACE_PATH，用 scripts/trace_report.py 汇总
+- otel: 转成OpenTelemetry span（只依赖 opentelemetry-api；装了 opentelemetry-sdk 和 OTLP exporter 时
+  自动按 OTEL_EXPORTER_OTLP_* 环境变量配置导出，否则使用应用已配置的TracerProvider）
+"""
+
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from src.config import AGENT_TRACE_EXPORTER, AGENT_TRACE_PATH
+
+# 当前所在的span（None表示不在任何trace内）
+_CURRENT = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    """一个计时区间；attrs 在结束前可以继续补充（如模型返回后的token数）"""
+
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'attrs', 'start', 'start_ts',
+                 'duration_ms', 'error', 'otel')
+
+    def __init__(self, name, kind, parent=None, attrs=None):
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.attrs = dict(attrs or {})
+        self.start = time.perf_counter()
+        self.start_ts = datetime.now(timezone.utc)
+        self.duration_ms = None
+        self.error = None
+        self.otel = None
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+            'name': self.name, 'kind': self.kind, 'start': self.start_ts.isoformat(),
+            'duration_ms': self.duration_ms, 'error': self.error, 'attrs': self.attrs,
+        }
+
+
+class JsonlExporter:
+    """span结束时追加写一行JSON（多线程安全）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def start(self, span, parent):
+        pass
+
+    def end(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+class OtelExporter:
+    """转成OpenTelemetry span，父子关系与本模块的span一致"""
+
+    def __init__(self):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("otel导出需要安装 opentelemetry-api（以及导出用的 opentelemetry-sdk）")
+        _setup_otel_sdk(trace)
+        self._trace = trace
+        self.tracer = trace.get_tracer('eshop-agent')
+
+    def start(self, span, parent):
+        context = None
+        if parent is not None and parent.otel is not None:
+            context = self._trace.set_span_in_context(parent.otel)
+        span.otel = self.tracer.start_span(f"{span.kind}.{span.name}", context=context,
+                                           start_time=int(span.start_ts.timestamp() * 1e9))
+
+    def end(self, span):
+        for key, value in span.attrs.items():
+            if isinstance(value, (str, bool, int, float)):
+                span.otel.set_attribute(key, value)
+            elif value is not None:
+                span.otel.set_attribute(key, json.dumps(value, ensure_ascii=False, default=str))
+        if span.error:
+            from opentelemetry.trace import Status, StatusCode
+            span.otel.set_status(Status(StatusCode.ERROR, span.error))
+        span.otel.end()
+
+
+def _setup_otel_sdk(trace):
+    """应用还没有配置TracerProvider且装了SDK和OTLP exporter时，按环境变量配置批量导出"""
+    if not isinstance(trace.get_tracer_provider(), trace.ProxyTracerProvider):
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        print("⚠ 没有安装 opentelemetry-sdk / opentelemetry-exporter-otlp，span不会被导出")
+        return
+    provider = TracerProvider(resource=Resource.create({'service.name': 'eshop-agent'}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+
+
+_exporter = None
+_configured = False
+
+
+def configure_tracing(exporter=None, path=None):
+    """设置导出方式：'jsonl'（写到 path，默认 AGENT_TRACE_PATH）/ 'otel' / None（关闭）"""
+    global _exporter, _configured
+    if exporter == 'jsonl':
+        _exporter = JsonlExporter(path or AGENT_TRACE_PATH or 'data/agent_traces.jsonl')
+    elif exporter == 'otel':
+        _exporter = OtelExporter()
+    elif exporter is None:
+        _exporter = None
+    else:
+        raise ValueError(f"未知的追踪导出方式: {exporter}（可选 jsonl / otel）")
+    _configured = True
+
+
+def _get_exporter():
+    if not _configured:
+        # 默认由配置决定：jsonl 需要设置 AGENT_TRACE_PATH 才开启
+        if AGENT_TRACE_EXPORTER == 'otel':
+            configure_tracing('otel')
+        elif AGENT_TRACE_EXPORTER == 'jsonl' and AGENT_TRACE_PATH:
+            configure_tracing('jsonl', AGENT_TRACE_PATH)
+        else:
+            configure_tracing(None)
+    return _exporter
+
+
+def tracing_enabled():
+    return _get_exporter() is not None
+
+
+def current_span():
+    return _CURRENT.get()
+
+
+def start_span(name, kind, attrs=None, root=False, activate=True):
+    """开始一个span，返回 (span, token)；不在trace内（且不是root）或未开启追踪时返回 (None, None)。
+
+    activate=True 时设为当前span（之后开始的span以它为父），token 用于 end_span 时恢复。
+    """
+    exporter = _get_exporter()
+    parent = _CURRENT.get()
+    if exporter is None or (parent is None and not root):
+        return None, None
+    span = Span(name, kind, parent, attrs)
+    exporter.start(span, parent)
+    return span, _CURRENT.set(span) if activate else None
+
+
+def end_span(span, token=None, error=None):
+    """结束span并导出；token 为 start_span 返回的，用于恢复当前span"""
+    if span is None:
+        return
+    span.duration_ms = round((time.perf_counter() - span.start) * 1000, 2)
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+    if token is not None:
+        _CURRENT.reset(token)
+    _exporter.end(span)
+
+
+@contextmanager
+def span(name, kind, root=False, **attrs):
+    """with span(...) as s: s 为 Span（未追踪时为None），可在 s.attrs 中补充属性"""
+    s, token = start_span(name, kind, attrs, root=root)
+    try:
+        yield s
+    except BaseException as e:
+        end_span(s, token, error=e)
+        raise
+    else:
+        end_span(s, token)
+
+
+def traced(kind):
+    """函数装饰器：在trace内调用时记录一个以函数名命名的span（如数据库查询函数）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _CURRENT.get() is None:
+                return func(*args, **kwargs)
+            with span(func.__name__, kind):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def load_spans(path):
+    """读取JSONL追踪文件（跳过损坏的行）"""
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans